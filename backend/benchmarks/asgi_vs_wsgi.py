@@ -0,0 +1,134 @@
+'''
+Requests per second of the read endpoints served by the WSGI app
+(create_app, one thread per concurrent client) and by the ASGI app
+(flaskr/asgi.py, one task per concurrent client on an event loop).
+
+Both apps are called in-process, without an HTTP server, on the same
+SQLite database file, so the numbers compare the serving paths and not
+the network. From the backend folder:
+
+  python benchmarks/asgi_vs_wsgi.py [--questions 10000] [--requests 2000] [--concurrency 16]
+
+Needs asgiref and aiosqlite.
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import create_benchmark_app, generate, WORDS
+
+from flaskr.asgi import create_asgi_app
+
+CATEGORIES = 6
+
+
+# (method, path, JSON body) of the requests sent, in a fixed random order
+def build_requests(count, questions):
+    pages = max(1, questions // 10)
+    generators = [
+        lambda: ("GET", "/categories", None),
+        lambda: ("GET", "/questions?page={}".format(random.randint(1, pages)), None),
+        lambda: ("GET", "/categories/{}/questions?page={}".format(
+            random.randint(1, CATEGORIES), random.randint(1, pages // CATEGORIES or 1)), None),
+        lambda: ("POST", "/questions", {"search_term": random.choice(WORDS)}),
+        lambda: ("POST", "/quizzes", {
+            "previous_questions": [], "quiz_category": {"id": random.randint(0, CATEGORIES)}}),
+        lambda: ("POST", "/quizzes/batch", {
+            "previous_questions": [], "quiz_category": {"id": 0}, "count": 10}),
+    ]
+    random.seed(0)
+    return [random.choice(generators)() for _ in range(count)]
+
+
+def run_wsgi(app, requests, concurrency):
+    client = app.test_client()
+
+    def send(request):
+        method, path, body = request
+        response = client.open(path, method=method, json=body)
+        assert response.status_code in (200, 422), response.status_code
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        list(executor.map(send, requests))
+    return len(requests) / (time.perf_counter() - started_at)
+
+
+async def send_asgi(asgi, request):
+    method, path, body = request
+    path, _, query_string = path.partition("?")
+    payload = json.dumps(body).encode("utf-8") if body is not None else b""
+    headers = [(b"host", b"benchmark")]
+    if body is not None:
+        headers += [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode("ascii"))]
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "root_path": "",
+        "query_string": query_string.encode("ascii"), "headers": headers,
+        "server": ("benchmark", 80), "client": ("127.0.0.1", 0),
+    }
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await asgi(scope, receive, send)
+    assert status[0] in (200, 422), status[0]
+
+
+async def run_asgi(asgi, requests, concurrency):
+    queue = list(reversed(requests))
+
+    async def worker():
+        while queue:
+            await send_asgi(asgi, queue.pop())
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    seconds = time.perf_counter() - started_at
+    await asgi.dispose()
+    return len(requests) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--questions", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    arguments = parser.parse_args()
+
+    app = create_benchmark_app(os.path.join(tempfile.mkdtemp(), "benchmark.db"))
+    generate(app, CATEGORIES, arguments.questions)
+    requests = build_requests(arguments.requests, arguments.questions)
+    warm_up = requests[:arguments.requests // 10]
+
+    run_wsgi(app, warm_up, arguments.concurrency)
+    wsgi = run_wsgi(app, requests, arguments.concurrency)
+
+    asyncio.run(run_asgi(create_asgi_app(app), warm_up, arguments.concurrency))
+    asgi = asyncio.run(run_asgi(create_asgi_app(app), requests, arguments.concurrency))
+
+    print("concurrency {}".format(arguments.concurrency))
+    print("wsgi    {:8.0f} requests/s".format(wsgi))
+    print("asgi    {:8.0f} requests/s".format(asgi))
+    print("ratio   {:8.2f}x".format(asgi / wsgi))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+'''
+Memory of the workers with and without the catalog snapshot
+
+Forks 1, 2, 4... workers like a pre-fork server, each sending listing,
+category and quiz requests through the Flask test client, and reports
+their mean RSS, PSS (shared pages divided between the processes mapping
+them) and private memory. With the snapshot the catalog is mapped from
+one file and its pages are shared, without it every worker loads its own
+question id index. Linux only (/proc/self/smaps_rollup). From the
+backend folder:
+
+  python benchmarks/catalog_snapshot.py [--questions 100000] [--workers 8]
+      [--requests 2000] [--database PATH]
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import generate
+
+from flask_migrate import upgrade
+
+from models import db, catalog_snapshot
+from flaskr import create_app, QUESTIONS_PER_PAGE
+
+CATEGORIES = 6
+
+
+def create_snapshot_app(path, snapshot):
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + path,
+        "REPLICA_DATABASE_URIS": [],
+        "DATA_VERSION_FILE": path + ".version",
+        "CATALOG_SNAPSHOT_FILE": path + ".catalog" if snapshot else "",
+        "FUZZY_INDEX_WARM_UP": False,
+    })
+    with app.app_context():
+        upgrade()
+    return app
+
+
+# Memory of this process in kB, from the kernel
+def memory_usage():
+    usage = {}
+    with open("/proc/self/smaps_rollup") as smaps:
+        for line in smaps:
+            fields = line.split()
+            if len(fields) == 3 and fields[2] == "kB":
+                usage[fields[0].rstrip(":")] = int(fields[1])
+    return {
+        "rss": usage["Rss"],
+        "pss": usage["Pss"],
+        "private": usage["Private_Clean"] + usage["Private_Dirty"],
+    }
+
+
+def serve(app, questions, requests, seed):
+    generator = random.Random(seed)
+    pages = max(1, questions // QUESTIONS_PER_PAGE)
+    client = app.test_client()
+    for _ in range(requests):
+        choice = generator.randrange(3)
+        if choice == 0:
+            response = client.get("/questions?page={}".format(generator.randint(1, pages)))
+        elif choice == 1:
+            response = client.get("/categories/{}/questions?page={}".format(
+                generator.randint(1, CATEGORIES), generator.randint(1, pages // CATEGORIES or 1)))
+        else:
+            response = client.post("/quizzes", json={
+                "previous_questions": [], "quiz_category": {"id": generator.randint(0, CATEGORIES)}})
+        if response.status_code != 200:
+            raise RuntimeError("returned {}".format(response.status_code))
+
+
+# Forks the workers, returns the memory of each measured once all of them
+# served their requests, so that the shared pages are counted while shared
+def run_workers(app, workers, questions, requests):
+    with app.app_context():
+        # No connection is shared with the children
+        db.engine.dispose()
+
+    children = []
+    for number in range(workers):
+        report_read, report_write = os.pipe()
+        measure_read, measure_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(report_read)
+            os.close(measure_write)
+            status = 0
+            try:
+                serve(app, questions, requests, seed=number)
+                os.write(report_write, b"served\n")
+                # Closed by the parent when every worker served
+                os.read(measure_read, 1)
+                os.write(report_write, json.dumps(memory_usage()).encode("ascii") + b"\n")
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        os.close(report_write)
+        os.close(measure_read)
+        children.append((pid, os.fdopen(report_read), measure_write))
+
+    for pid, report, measure_write in children:
+        if report.readline() != "served\n":
+            raise RuntimeError("worker {} failed".format(pid))
+    for pid, report, measure_write in children:
+        os.close(measure_write)
+
+    usages = []
+    for pid, report, measure_write in children:
+        usages.append(json.loads(report.readline()))
+        report.close()
+        os.waitpid(pid, 0)
+    return usages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--questions", type=int, default=100000)
+    parser.add_argument("--workers", type=int, default=8, help="most workers forked")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per worker")
+    parser.add_argument("--database", help="database made by benchmarks/data.py, "
+                        "with --categories 6 and the same --questions")
+    arguments = parser.parse_args()
+
+    path = os.path.abspath(arguments.database) if arguments.database else os.path.join(
+        tempfile.mkdtemp(), "benchmark.db")
+    generated = arguments.database is None
+
+    print("{:<10} {:>8} {:>12} {:>12} {:>12}".format(
+        "mode", "workers", "RSS MB", "PSS MB", "private MB"))
+    for snapshot in (False, True):
+        app = create_snapshot_app(path, snapshot)
+        if generated:
+            generate(app, CATEGORIES, arguments.questions)
+            generated = False
+        if snapshot:
+            with app.app_context():
+                catalog_snapshot.build()
+
+        workers = 1
+        while workers <= arguments.workers:
+            usages = run_workers(app, workers, arguments.questions, arguments.requests)
+            print("{:<10} {:>8} {:>12.1f} {:>12.1f} {:>12.1f}".format(
+                "snapshot" if snapshot else "database", workers,
+                *[sum(usage[name] for usage in usages) / len(usages) / 1024
+                  for name in ("rss", "pss", "private")]))
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+'''
+Synthetic data for the benchmarks
+
+Creates a SQLite database with the migrations and fills it with
+categories and questions made of random words, so that searches match
+a realistic share of the questions. The same seed gives the same data.
+From the backend folder:
+
+  python benchmarks/data.py PATH [--categories 6] [--questions 100000] [--seed 0]
+'''
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_migrate import upgrade
+
+from models import db, data_version, question_id_index, Question, QuestionCount, Category
+from flaskr import create_app
+
+INSERT_BATCH_SIZE = 10000
+WORDS = (
+    "actor album animal army artist battle bird book bridge capital car "
+    "castle city coast country dance desert disease dynasty element emperor "
+    "empire engine film flag flower football forest fruit galaxy game gold "
+    "guitar island king lake language law machine metal mountain movie "
+    "music novel ocean opera painter planet poem president queen river "
+    "rocket science ship singer song sport star team temple theory title "
+    "tower treaty volcano war water winner writer"
+).split()
+QUESTION_STARTS = ("What", "Who", "Which", "Where", "When", "How many")
+
+
+'''
+create_benchmark_app(path, **config)
+    returns an app using the SQLite database at path, migrated to the
+    latest revision, with the given settings on top of the defaults
+'''
+def create_benchmark_app(path, **config):
+    app = create_app(dict({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + path,
+        "REPLICA_DATABASE_URIS": [],
+        # Data version in memory, away from the file of the development
+        # server, so no catalog snapshot
+        "DATA_VERSION_FILE": "",
+        "CATALOG_SNAPSHOT_FILE": "",
+        # Built by the benchmarks that need it, once the data is generated
+        "FUZZY_INDEX_WARM_UP": False,
+    }, **config))
+    with app.app_context():
+        upgrade()
+    return app
+
+
+def random_question(generator, number, categories):
+    words = generator.sample(WORDS, generator.randint(3, 7))
+    return {
+        "question": "{} {} number {}?".format(
+            generator.choice(QUESTION_STARTS), " ".join(words), number),
+        "answer": " ".join(generator.sample(WORDS, 2)).capitalize(),
+        "category": generator.randint(1, categories),
+        "difficulty": generator.randint(1, 5),
+    }
+
+
+'''
+generate(app, categories, questions, seed, on_batch)
+    adds categories and questions to the database of app, in batches of
+    INSERT_BATCH_SIZE questions. on_batch is called with the number of
+    questions inserted so far.
+'''
+def generate(app, categories=6, questions=100000, seed=0, on_batch=None):
+    generator = random.Random(seed)
+    with app.app_context():
+        db.session.add_all([
+            Category(type="Category {}".format(number))
+            for number in range(1, categories + 1)])
+        db.session.commit()
+
+        inserted = 0
+        while inserted < questions:
+            batch = [
+                random_question(generator, number, categories)
+                for number in range(inserted, min(inserted + INSERT_BATCH_SIZE, questions))]
+            db.session.execute(Question.__table__.insert(), batch)
+            db.session.commit()
+            inserted += len(batch)
+            if on_batch is not None:
+                on_batch(inserted)
+
+        QuestionCount.rebuild()
+        data_version.bump()
+        question_id_index.reset()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path")
+    parser.add_argument("--categories", type=int, default=6)
+    parser.add_argument("--questions", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    if os.path.exists(arguments.path):
+        parser.error("{} already exists".format(arguments.path))
+
+    started_at = time.perf_counter()
+    app = create_benchmark_app(os.path.abspath(arguments.path))
+    generate(app, arguments.categories, arguments.questions, arguments.seed,
+             on_batch=lambda inserted: print("{} questions".format(inserted)))
+    print("done in {:.1f} s".format(time.perf_counter() - started_at))
+
+
+if __name__ == "__main__":
+    main()
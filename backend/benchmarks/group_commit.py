@@ -0,0 +1,100 @@
+'''
+Throughput of question creation with a commit per request and with group
+commit
+
+Sends POST /questions from concurrent threads through the Flask test
+client, first with one transaction per creation, then in group commit
+mode (GROUP_COMMIT), each on a new SQLite database file, and reports the
+creations per second, the p50 and p99 latency of a creation and the
+number of transactions. From the backend folder:
+
+  python benchmarks/group_commit.py [--threads 32] [--requests 100]
+      [--max-batch-size 100] [--max-wait-ms 5]
+'''
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import create_benchmark_app, generate
+
+from sqlalchemy import event
+
+from models import db
+
+CATEGORIES = 6
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(app, threads, requests):
+    latencies = []
+    failures = []
+    commits = {"count": 0}
+    with app.app_context():
+        @event.listens_for(db.engine, "commit")
+        def count_commit(connection):
+            commits["count"] += 1
+
+    def create(number):
+        client = app.test_client()
+        for request_number in range(requests):
+            started_at = time.perf_counter()
+            response = client.post("/questions", json={
+                "question": "Question {} of thread {}?".format(request_number, number),
+                "answer": "Answer", "category": 1 + request_number % CATEGORIES,
+                "difficulty": 1 + request_number % 5})
+            latencies.append(time.perf_counter() - started_at)
+            if response.status_code != 200:
+                failures.append(response.status_code)
+
+    workers = [threading.Thread(target=create, args=(number,)) for number in range(threads)]
+    started_at = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    seconds = time.perf_counter() - started_at
+
+    if failures:
+        raise RuntimeError("{} creations failed".format(len(failures)))
+    return {
+        "creations_per_second": len(latencies) / seconds,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "commits": commits["count"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=100, help="creations per thread")
+    parser.add_argument("--max-batch-size", type=int, default=100)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    arguments = parser.parse_args()
+
+    print("{:<12} {:>12} {:>10} {:>10} {:>10}".format(
+        "mode", "creations/s", "p50 ms", "p99 ms", "commits"))
+    for mode, config in (
+            ("per request", {}),
+            ("group", {"GROUP_COMMIT": True,
+                       "GROUP_COMMIT_MAX_BATCH_SIZE": arguments.max_batch_size,
+                       "GROUP_COMMIT_MAX_WAIT_MS": arguments.max_wait_ms})):
+        app = create_benchmark_app(os.path.join(tempfile.mkdtemp(), "benchmark.db"), **config)
+        generate(app, CATEGORIES, questions=0)
+        result = run(app, arguments.threads, arguments.requests)
+        print("{:<12} {:>12.0f} {:>10.2f} {:>10.2f} {:>10}".format(
+            mode, result["creations_per_second"], result["p50_ms"], result["p99_ms"],
+            result["commits"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+'''
+Latency, throughput and SQL queries of every route of the API
+
+Generates a SQLite database with benchmarks/data.py (or reuses one made
+with it), then sends each scenario below through the Flask test client,
+one request at a time, and reports the p50 and p99 latency, the requests
+per second and the SQL queries per request of every scenario. Runs fully
+offline. From the backend folder:
+
+  python benchmarks/routes.py [--questions 100000] [--requests 200]
+      [--database PATH] [--output baseline.json] [--compare baseline.json]
+
+--output writes the results as a JSON baseline, --compare reports the
+change against a baseline and exits with status 1 when a scenario got
+slower than --tolerance times its baseline p50, or runs more queries.
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from data import create_benchmark_app, generate, WORDS
+
+from sqlalchemy import event
+
+from models import db, question_text_index
+from flaskr import encode_cursor, QUESTIONS_PER_PAGE
+
+# Number of ids sent as previous_questions by the quiz scenarios
+PREVIOUS_QUESTIONS = 500
+
+
+'''
+Scenarios
+    every scenario returns the (method, path, JSON body or raw data) of
+    its next request, the state shared between them is kept here
+'''
+class Scenarios:
+
+    def __init__(self, client, categories, questions, seed=0):
+        self.client = client
+        self.categories = categories
+        self.questions = questions
+        self.pages = max(1, questions // QUESTIONS_PER_PAGE)
+        self.random = random.Random(seed)
+        self.created = []
+        self.sessions = []
+        self.all = [
+            ("categories", self.categories_list),
+            ("questions_first_page", self.questions_first_page),
+            ("questions_deep_page", self.questions_deep_page),
+            ("questions_deep_cursor", self.questions_deep_cursor),
+            ("category_questions_deep_page", self.category_questions_deep_page),
+            ("stats", self.stats),
+            ("search", self.search),
+            ("search_deep_page", self.search_deep_page),
+            ("search_fuzzy", self.search_fuzzy),
+            ("create_question", self.create_question),
+            ("delete_question", self.delete_question),
+            ("bulk_delete_questions", self.bulk_delete_questions),
+            ("import_questions", self.import_questions),
+            ("export_questions", self.export_questions),
+            ("create_category", self.create_category),
+            ("quiz", self.quiz),
+            ("quiz_long_previous_questions", self.quiz_long_previous_questions),
+            ("quiz_batch", self.quiz_batch),
+            ("quiz_session_start", self.quiz_session_start),
+            ("quiz_session_next", self.quiz_session_next),
+            ("metrics", self.metrics),
+        ]
+
+    def categories_list(self):
+        return "GET", "/categories", None
+
+    def questions_first_page(self):
+        return "GET", "/questions?page=1", None
+
+    def questions_deep_page(self):
+        return "GET", "/questions?page={}".format(
+            self.random.randint(self.pages * 9 // 10, self.pages)), None
+
+    def questions_deep_cursor(self):
+        last_id = self.random.randint(self.questions * 9 // 10, self.questions - QUESTIONS_PER_PAGE)
+        return "GET", "/questions?cursor={}".format(encode_cursor(last_id)), None
+
+    def category_questions_deep_page(self):
+        pages = max(1, self.pages // self.categories)
+        return "GET", "/categories/{}/questions?page={}".format(
+            self.random.randint(1, self.categories),
+            self.random.randint(pages * 9 // 10 or 1, pages)), None
+
+    def stats(self):
+        return "GET", "/stats", None
+
+    def search(self):
+        return "POST", "/questions", {"search_term": self.random.choice(WORDS)}
+
+    def search_deep_page(self):
+        return "POST", "/questions?page=20", {"search_term": self.random.choice(WORDS)}
+
+    # A long word with its middle letter doubled, as a typo
+    def search_fuzzy(self):
+        word = self.random.choice([word for word in WORDS if len(word) >= 6])
+        middle = len(word) // 2
+        return "POST", "/questions", {
+            "search_term": word[:middle] + word[middle] + word[middle:], "fuzzy": True}
+
+    def create_question(self):
+        return "POST", "/questions", {
+            "question": "Benchmark question {}?".format(len(self.created)),
+            "answer": "Benchmark",
+            "category": self.random.randint(1, self.categories),
+            "difficulty": self.random.randint(1, 5),
+        }
+
+    def delete_question(self):
+        return "DELETE", "/questions/{}".format(self.created.pop()), None
+
+    def bulk_delete_questions(self):
+        ids = [self.created.pop() for _ in range(min(10, len(self.created)))]
+        return "DELETE", "/questions", {"ids": ids}
+
+    def import_questions(self):
+        lines = [json.dumps({
+            "question": "Imported question {}?".format(number),
+            "answer": "Imported",
+            "category": self.random.randint(1, self.categories),
+            "difficulty": self.random.randint(1, 5),
+        }) for number in range(100)]
+        return "POST", "/questions/import?format=jsonl", "\n".join(lines).encode("utf-8")
+
+    def export_questions(self):
+        return "GET", "/questions/export?category={}&difficulty={}".format(
+            self.random.randint(1, self.categories), self.random.randint(1, 5)), None
+
+    def create_category(self):
+        return "POST", "/categories", {"type": "Benchmark {}".format(self.random.random())}
+
+    def quiz(self):
+        return "POST", "/quizzes", {
+            "previous_questions": [],
+            "quiz_category": {"id": self.random.randint(0, self.categories)}}
+
+    def quiz_long_previous_questions(self):
+        return "POST", "/quizzes", {
+            "previous_questions": self.random.sample(
+                range(1, self.questions + 1), min(PREVIOUS_QUESTIONS, self.questions)),
+            "quiz_category": {"id": self.random.randint(1, self.categories)}}
+
+    def quiz_batch(self):
+        return "POST", "/quizzes/batch", {
+            "previous_questions": [], "quiz_category": {"id": 0}, "count": 10}
+
+    def quiz_session_start(self):
+        return "POST", "/quizzes/sessions", {
+            "quiz_category": {"id": self.random.randint(1, self.categories)}}
+
+    def quiz_session_next(self):
+        return "POST", "/quizzes/sessions/{}/next".format(
+            self.random.choice(self.sessions)), None
+
+    def metrics(self):
+        return "GET", "/metrics", None
+
+    # Keeps what the next requests of other scenarios need
+    def record(self, name, response):
+        if name == "create_question":
+            self.created.append(response.get_json()["question_created"]["id"])
+        elif name == "quiz_session_start":
+            self.sessions.append(response.get_json()["session"])
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_scenario(scenarios, name, next_request, requests, counter):
+    latencies = []
+    queries = 0
+    started_at = time.perf_counter()
+    for _ in range(requests):
+        method, path, body = next_request()
+        options = {"json": body} if not isinstance(body, bytes) else {
+            "data": body, "content_type": "application/x-ndjson"}
+
+        counter["queries"] = 0
+        request_started_at = time.perf_counter()
+        response = scenarios.client.open(path, method=method, **options)
+        # Streamed responses are read to the end
+        response.get_data()
+        latencies.append(time.perf_counter() - request_started_at)
+        queries += counter["queries"]
+
+        if response.status_code != 200:
+            raise RuntimeError("{} {} returned {}".format(method, path, response.status_code))
+        scenarios.record(name, response)
+    seconds = time.perf_counter() - started_at
+
+    return {
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "requests_per_second": round(requests / seconds, 1),
+        "queries_per_request": round(queries / requests, 2),
+    }
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    print("\n{:<30} {:>12} {:>12} {:>12}".format("scenario", "p50", "p99", "queries"))
+    for name, result in results.items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            print("{:<30} {:>12}".format(name, "new"))
+            continue
+        print("{:<30} {:>11.2f}x {:>11.2f}x {:>5.2f} -> {:<5.2f}".format(
+            name, result["p50_ms"] / before["p50_ms"], result["p99_ms"] / before["p99_ms"],
+            before["queries_per_request"], result["queries_per_request"]))
+        if result["p50_ms"] > before["p50_ms"] * tolerance \
+                or result["queries_per_request"] > before["queries_per_request"]:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--categories", type=int, default=6)
+    parser.add_argument("--questions", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--database", help="database made by benchmarks/data.py, "
+                        "with the same --categories and --questions")
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--compare", help="baseline to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=1.5)
+    arguments = parser.parse_args()
+
+    if arguments.database:
+        app = create_benchmark_app(os.path.abspath(arguments.database))
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+        app = create_benchmark_app(path)
+        print("generating {} questions in {}".format(arguments.questions, path))
+        generate(app, arguments.categories, arguments.questions, arguments.seed)
+
+    counter = {"queries": 0}
+    with app.app_context():
+        # Built at startup by the app, outside of the timed requests here
+        question_text_index.load()
+
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def count_query(*args):
+            counter["queries"] += 1
+
+    scenarios = Scenarios(
+        app.test_client(), arguments.categories, arguments.questions, arguments.seed)
+    results = {}
+    print("{:<30} {:>10} {:>10} {:>10} {:>10}".format(
+        "scenario", "p50 ms", "p99 ms", "req/s", "queries"))
+    for name, next_request in scenarios.all:
+        # The deletes remove the questions made by create_question, half
+        # one at a time and the other half 10 at a time
+        requests = arguments.requests
+        if name == "delete_question":
+            requests = max(1, len(scenarios.created) // 2)
+        elif name == "bulk_delete_questions":
+            requests = max(1, len(scenarios.created) // 10)
+        result = results[name] = run_scenario(
+            scenarios, name, next_request, requests, counter)
+        print("{:<30} {:>10.2f} {:>10.2f} {:>10.1f} {:>10.2f}".format(
+            name, result["p50_ms"], result["p99_ms"],
+            result["requests_per_second"], result["queries_per_request"]))
+
+    baseline = {
+        "settings": {
+            "categories": arguments.categories,
+            "questions": arguments.questions,
+            "requests": arguments.requests,
+            "seed": arguments.seed,
+            "python": sys.version.split()[0],
+        },
+        "scenarios": results,
+    }
+    if arguments.output:
+        with open(arguments.output, "w") as output:
+            json.dump(baseline, output, indent=2, sort_keys=True)
+            output.write("\n")
+
+    if arguments.compare:
+        with open(arguments.compare) as previous:
+            regressions = compare(results, json.load(previous), arguments.tolerance)
+        if regressions:
+            print("\nregressions: {}".format(", ".join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
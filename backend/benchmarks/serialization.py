@@ -0,0 +1,96 @@
+'''
+CPU time per request for a page of 100 questions, before and after the
+serialization layer of flaskr/serialization.py:
+
+  before: ORM Question objects, Question.format() and the stdlib json
+          encoder (what the list endpoints used to do)
+  after:  column tuple projection, format_question_row() and the app's
+          JSON provider (orjson when installed)
+
+Runs on an in-memory SQLite database, from the backend folder:
+
+  python benchmarks/serialization.py [--questions 10000] [--requests 2000]
+'''
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from models import db, Question, Category
+from flaskr.serialization import (
+    FastJSONProvider, project_questions, format_question_row, orjson)
+
+PAGE_SIZE = 100
+
+
+def create_benchmark_app(questions):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite://"
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add_all([Category(type="Category {}".format(id)) for id in range(1, 7)])
+        db.session.bulk_insert_mappings(Question, [{
+            "question": "Question number {} of the benchmark?".format(id),
+            "answer": "Answer {}".format(id),
+            "category": id % 6 + 1,
+            "difficulty": id % 5 + 1,
+        } for id in range(questions)])
+        db.session.commit()
+    return app
+
+
+def before(offset):
+    rows = Question.query.order_by(Question.id).limit(PAGE_SIZE).offset(offset).all()
+    body = {"questions": [question.format() for question in rows]}
+    return json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+def after(app, offset):
+    rows = project_questions(Question.query.order_by(Question.id)).limit(
+        PAGE_SIZE).offset(offset).all()
+    body = {"questions": [format_question_row(row) for row in rows]}
+    return app.json.response(body).get_data()
+
+
+def measure(function, requests, questions):
+    started_at = time.process_time()
+    for request_number in range(requests):
+        function(request_number * PAGE_SIZE % (questions - PAGE_SIZE))
+        # A new session per request, as in the app
+        db.session.remove()
+    return (time.process_time() - started_at) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--questions", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=2000)
+    arguments = parser.parse_args()
+
+    app = create_benchmark_app(arguments.questions)
+    app.json = FastJSONProvider(app)
+    with app.app_context():
+        # Both paths must produce the same document
+        assert json.loads(before(0)) == json.loads(after(app, 0))
+
+        results = {}
+        for name, function in (("before", before),
+                               ("after", lambda offset: after(app, offset))):
+            measure(function, arguments.requests // 10, arguments.questions)
+            results[name] = measure(function, arguments.requests, arguments.questions)
+
+    print("encoder: {}".format("orjson" if orjson is not None else "json"))
+    for name, seconds in results.items():
+        print("{:<7} {:8.3f} ms CPU per request".format(name, seconds * 1000))
+    print("speedup {:8.2f}x".format(results["before"] / results["after"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,371 +1,1044 @@
-from cgi import test
-import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
-from flask_cors import CORS
-import random
-from models import setup_db, Question, Category
-
-QUESTIONS_PER_PAGE = 10
-
-# Function used to paginate questions
-def paginate_questions(request, selection):
-    page = request.args.get('page', 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
-    return current_questions
-
-
-def create_app(test_config=None):
-    # create and configure the app
-    app = Flask(__name__)
-    setup_db(app)
-
-    '''
-    @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
-    '''
-    CORS(app)
-
-    '''
-    @TODO: Use the after_request decorator to set Access-Control-Allow
-    '''
-    @app.after_request
-    def after_request(response):
-        response.headers.add(
-            'Access-Control-Allow-Headers',
-            'Content-Type, Authorization, true')
-        response.headers.add(
-            'Access-Control-Allow-Methods',
-            'GET, POST, PUT, DELETE, OPTIONS')
-        return response
-    '''
-    @TODO:
-    Create an endpoint to handle GET requests
-    for all available categories.
-    '''
-    @app.route('/categories', methods=['GET'])
-    def get_categories():
-        all_categories = Category.query.order_by(Category.id).all()
-
-        # Test if request returned an empty result
-        # If not then format categories
-        if len(all_categories) == 0:
-            categories = {}
-        else:
-            categories = {cat.id: cat.type for cat in all_categories}
-
-        return jsonify({
-            'categories': categories
-        })
-
-    '''
-    @TODO:
-    Create an endpoint to handle GET requests for questions,
-    including pagination (every 10 questions).
-    This endpoint should return a list of questions,
-    number of total questions, current category, categories.
-
-    TEST: At this point, when you start the application
-    you should see questions and categories generated,
-    ten questions per page and pagination at the bottom of the screen for three pages.
-    Clicking on the page numbers should update the questions.
-    '''
-    @app.route('/questions', methods=['GET'])
-    def get_questions():
-        all_categories = Category.query.order_by(Category.id).all()
-        all_questions = Question.query.order_by(Question.id).all()
-        current_questions = paginate_questions(request, all_questions)
-
-        if len(current_questions) == 0:
-            abort(404)
-
-        return jsonify({
-            'questions': current_questions,
-            'total_questions': len(all_questions),
-            'categories': {cat.id: cat.type for cat in all_categories},
-            # 'currentCategory' : None
-        })
-
-    '''
-    @TODO:
-    Create an endpoint to DELETE question using a question ID.
-
-    TEST: When you click the trash icon next to a question, the question will be removed.
-    This removal will persist in the database and when you refresh the page.
-    '''
-    @app.route('/questions/<int:question_id>', methods=['DELETE'])
-    def delete_one_question(question_id):
-        try:
-            question = Question.query.get_or_404(question_id)
-            question.delete()
-            all_questions = Question.query.all()
-
-            return jsonify({
-                "question_deleted": question_id,
-                "total_questions": len(all_questions)
-            })
-
-        except BaseException:
-            abort(422)
-    '''
-    @TODO:
-    Create an endpoint to POST a new question,
-    which will require the question and answer text,
-    category, and difficulty score.
-
-    TEST: When you submit a question on the "Add" tab,
-    the form will clear and the question will appear at the end of the last page
-    of the questions list in the "List" tab.
-    '''
-    '''
-    @TODO:
-    Create a POST endpoint to get questions based on a search term.
-    It should return any questions for whom the search term
-    is a substring of the question.
-
-    TEST: Search by any phrase. The questions list will update to include
-    only question that include that string within their question.
-    Try using the word "title" to start.
-    '''
-    @app.route("/questions", methods=["POST"])
-    def create_new_question_and_search_for_existing_questions():
-        body = request.get_json()
-
-        new_answer = body.get("answer", None)
-        new_question = body.get("question", None)
-        new_difficulty = body.get("difficulty", None)
-        new_category = body.get("category", None)
-        search_term = body.get("search_term", None)
-
-        try:
-            # Test if parameters list contains search_term in order to make
-            # search request
-            if search_term:
-                questions_based_on_search = Question.query.filter(
-                    Question.question.ilike("%{}%".format(search_term))).all()
-
-                if len(questions_based_on_search) == 0:
-                    abort(422)
-                current_books = paginate_questions(
-                    request, questions_based_on_search)
-
-                return jsonify({
-                    "questions": current_books,
-                    "total_questions": len(questions_based_on_search),
-                })
-            # If parameters list does not contains search_term, then proceed to
-            # creation of new question
-            else:
-                question = Question(
-                    answer=new_answer,
-                    question=new_question,
-                    difficulty=new_difficulty,
-                    category=new_category)
-                if new_answer and new_question:
-                    question.insert()
-                else:
-                    abort(422)
-
-                # all_questions = Question.query.order_by(Question.id).all()
-                # current_questions = paginate_questions(request, all_questions)
-
-                return jsonify(
-                    {
-                        "question_created": question.format(),
-                        # "questions": current_questions,
-                        # "total_questions": len(all_questions),
-                    }
-                )
-
-        except BaseException:
-            abort(422)
-
-    '''
-    @TODO: (bonus)
-    Create an endpoint to POST a new category,
-    which will require the type of category text.
-    '''
-    @app.route("/categories", methods=["POST"])
-    def create_new_category():
-        body = request.get_json()
-        new_type = body.get("type", None)
-
-        try:
-            if new_type:
-                category = Category(type=new_type)
-                category.insert()
-            else:
-                abort(422)
-
-            return jsonify(
-                {
-                    "category_created": category.format()
-                }
-            )
-
-        except BaseException:
-            abort(422)
-
-    '''
-    @TODO:
-    Create a GET endpoint to get questions based on category.
-
-    TEST: In the "List" tab / main screen, clicking on one of the
-    categories in the left column will cause only questions of that
-    category to be shown.
-    '''
-    @app.route("/categories/<int:category_id>/questions", methods=["GET"])
-    def get_questions_based_on_category(category_id):
-
-        try:
-            # Trying to get questions based on category in parameter
-            questions_from_category = Question.query.join(
-                Category,
-                Category.id == Question.category) .with_entities(
-                Question.id,
-                Question.answer,
-                Question.question,
-                Question.difficulty,
-                Question.category) .filter(
-                Question.category == category_id).all()
-
-            questions_from_category_formatted = []
-            # Format questions
-            for question in questions_from_category:
-                questions_from_category_formatted.append({
-                    'id': question.id,
-                    'question': question.question,
-                    'answer': question.answer,
-                    'category': question.category,
-                    'difficulty': question.difficulty
-                })
-            current_category = Category.query.get_or_404(category_id)
-
-            return jsonify(
-                {
-                    "questions": questions_from_category_formatted,
-                    "total_questions": len(questions_from_category),
-                    "current_category": current_category.format(),
-                }
-            )
-
-        except BaseException:
-            abort(404)
-
-    '''
-    @TODO:
-    Create a POST endpoint to get questions to play the quiz.
-    This endpoint should take category and previous question parameters
-    and return a random questions within the given category,
-    if provided, and that is not one of the previous questions.
-
-    TEST: In the "Play" tab, after a user selects "All" or a category,
-    one question at a time is displayed, the user is allowed to answer
-    and shown whether they were correct or not.
-    '''
-    @app.route("/quizzes", methods=["POST"])
-    def get_questions_to_play_the_quiz():
-        body = request.get_json()
-
-        previous_questions = body.get("previous_questions", None)
-        quiz_category = body.get("quiz_category", None)
-
-        try:
-            # Test if there is no category specified
-            if quiz_category['id'] == 0:
-                all_categories_id = []
-                all_categories = Category.query.all()
-                for category in all_categories:
-                    all_categories_id.append(category.id)
-
-                # Getting random category to launch quiz
-                quiz_category_id = random.choice(all_categories_id)
-            else:
-                quiz_category_id = quiz_category['id']
-
-            query = Category.query.filter(
-                Category.id == quiz_category_id).one_or_none()
-
-            # If no result found, abort with error 422
-            if not query:
-                abort(422)
-
-            quiz_category_id = query.id
-            all_questions_id_for_quiz_category = Question.query.join(
-                Category, Category.id == Question.category) .with_entities(
-                Question.id) .filter(
-                Question.category == quiz_category_id).all()
-
-            all_questions_id_for_quiz_category_formatted = []
-            for question in all_questions_id_for_quiz_category:
-                # Chechs if question has already been asked to the user
-                if question.id not in previous_questions:
-                    all_questions_id_for_quiz_category_formatted.append(
-                        question.id)
-
-            if len(all_questions_id_for_quiz_category_formatted) == 0:
-                current_question = None
-            else:
-                current_question_id = random.choice(
-                    all_questions_id_for_quiz_category_formatted)
-                current_question = Question.query.get(
-                    current_question_id).format()
-
-            return jsonify(
-                {
-                    "question": current_question,
-                }
-            )
-
-        except BaseException:
-            abort(422)
-
-    '''
-    @TODO:
-    Create error handlers for all expected errors
-    including 404 and 422.
-    '''
-    @app.errorhandler(400)
-    def bad_request(error):
-        return (jsonify({
-            "success": False,
-            "error": 400,
-            "message": "You request is not valid"
-        }), 400)
-
-    @app.errorhandler(404)
-    def not_found(error):
-        return (jsonify({
-            "success": False,
-            "error": 404,
-            "message": "Resource not found"
-        }), 404)
-
-    @app.errorhandler(422)
-    def unprocessable(error):
-        return (jsonify({
-            "success": False,
-            "error": 422,
-            "message": "Unprocessable"
-        }), 422)
-
-    @app.errorhandler(405)
-    def not_allowed(error):
-        return (jsonify({
-            "success": False,
-            "error": 405,
-            "message": "Method not allowed"
-        }), 405)
-
-    @app.errorhandler(500)
-    def internal_server_eror(error):
-        return (jsonify({
-            "success": False,
-            "error": 500,
-            "message": "Internal server error"
-        }), 500)
-
-    return app
+from cgi import test
+import os
+import io
+import sys
+import json
+import gzip
+import click
+import time
+import hashlib
+import bisect
+import functools
+from datetime import datetime, timezone
+from flask import Flask, request, abort, jsonify, make_response, current_app, stream_with_context, g
+from werkzeug.http import is_resource_modified
+from flask_sqlalchemy import SQLAlchemy
+from flask_cors import CORS
+from dotenv import load_dotenv
+import random
+import base64
+import binascii
+from models import db, setup_db, search_questions, search_words, fuzzy_search_questions, data_version, catalog_snapshot, category_cache, question_id_index, question_text_index, Question, QuestionCount, Category
+from .quiz_sessions import MemoryQuizSessionStore
+from .bulk import import_questions, export_questions, gzip_lines, DEFAULT_BATCH_SIZE
+from .serialization import FastJSONProvider, project_questions, format_question_row
+from .metrics import Metrics, CollectedMetric
+from .config import CONFIG_PROFILES
+from .search_cache import SearchCache
+from .single_flight import SingleFlight, single_flight
+from .group_commit import GroupCommit, GroupCommitTimeout
+from .admission import AdmissionControl, retry_after
+
+QUESTIONS_PER_PAGE = 10
+MAX_QUIZ_BATCH_SIZE = 50
+MAX_IMPORT_BATCH_SIZE = 50000
+IMPORT_FORMATS = ("jsonl", "csv")
+
+
+# Functions used to build and read the opaque cursors handed out by
+# cursor (keyset) pagination. A cursor wraps the id of the last question
+# of the previous page.
+def encode_cursor(last_id):
+    token = "q:{}".format(last_id).encode("ascii")
+    return base64.urlsafe_b64encode(token).decode("ascii").rstrip("=")
+
+
+# Ids of the cursors: the range of a 64-bit signed integer column
+MAX_CURSOR_ID = 2 ** 63 - 1
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        token = base64.urlsafe_b64decode(padded.encode("ascii")).decode("ascii")
+        prefix, last_id = token.split(":", 1)
+        last_id = int(last_id)
+        if prefix != "q" or not 0 <= last_id <= MAX_CURSOR_ID:
+            raise ValueError(cursor)
+        return last_id
+    except (TypeError, ValueError, OverflowError, UnicodeError, binascii.Error):
+        abort(400)
+
+
+# Read the `cursor` parameter from the query string, or from the JSON body
+# for POST requests (search). Returns None when paging by page number.
+def get_cursor(request):
+    cursor = request.args.get('cursor', None)
+    if cursor is None and request.is_json:
+        body = request.get_json(silent=True) or {}
+        cursor = body.get('cursor', None)
+    return cursor
+
+
+# Function used to paginate questions
+# Takes a query ordered by Question.id (not a list of rows) so that only
+# the requested page is loaded, as column tuples, and the total is
+# computed with a COUNT, unless it is already known (from the question
+# counters).
+# When a `cursor` is sent, the page is fetched with a keyset condition on
+# Question.id instead of OFFSET, so deep pages cost the same as the first.
+def paginate_questions(request, selection, total_questions=None):
+    if total_questions is None:
+        total_questions = selection.order_by(None).count()
+    cursor = get_cursor(request)
+    selection = project_questions(selection)
+
+    if cursor is not None:
+        last_id = decode_cursor(cursor)
+        page_of_questions = selection.filter(
+            Question.id > last_id).limit(QUESTIONS_PER_PAGE + 1).all()
+    else:
+        page = request.args.get('page', 1, type=int)
+        start = (page - 1) * QUESTIONS_PER_PAGE
+        if start < 0 or start >= total_questions:
+            return [], total_questions, None
+        page_of_questions = selection.limit(
+            QUESTIONS_PER_PAGE + 1).offset(start).all()
+
+    # One extra row is fetched to know if there is a next page
+    next_cursor = None
+    if len(page_of_questions) > QUESTIONS_PER_PAGE:
+        page_of_questions = page_of_questions[:QUESTIONS_PER_PAGE]
+        next_cursor = encode_cursor(page_of_questions[-1].id)
+
+    current_questions = [format_question_row(row) for row in page_of_questions]
+    return current_questions, total_questions, next_cursor
+
+
+# Function used to paginate a list of question ids, the results of the
+# fuzzy search index. Only the questions of the requested page are loaded.
+# The ids are in id order in cursor mode, where the page starts after the
+# id of the cursor.
+def paginate_question_ids(request, question_ids):
+    total_questions = len(question_ids)
+    cursor = get_cursor(request)
+
+    if cursor is not None:
+        start = bisect.bisect_right(question_ids, decode_cursor(cursor))
+    else:
+        page = request.args.get('page', 1, type=int)
+        start = (page - 1) * QUESTIONS_PER_PAGE
+        if start < 0 or start >= total_questions:
+            return [], total_questions, None
+    page_ids = question_ids[start:start + QUESTIONS_PER_PAGE + 1]
+
+    rows = project_questions(Question.query.filter(Question.id.in_(page_ids))).all()
+    rows_by_id = {row.id: row for row in rows}
+    # Questions deleted by another process since the index was built are left out
+    page_of_questions = [rows_by_id[id] for id in page_ids if id in rows_by_id]
+
+    next_cursor = None
+    if len(page_ids) > QUESTIONS_PER_PAGE:
+        page_of_questions = page_of_questions[:QUESTIONS_PER_PAGE]
+        next_cursor = encode_cursor(page_ids[QUESTIONS_PER_PAGE - 1])
+
+    current_questions = [format_question_row(row) for row in page_of_questions]
+    return current_questions, total_questions, next_cursor
+
+
+# Function used to paginate the questions of the catalog snapshot, at
+# positions (ordered by id) of the snapshot. Same pages and cursors as
+# paginate_questions, read from the mapped file without a query.
+def paginate_snapshot(request, snapshot, positions):
+    total_questions = len(positions)
+    cursor = get_cursor(request)
+
+    if cursor is not None:
+        start = snapshot.count_up_to(positions, decode_cursor(cursor))
+    else:
+        page = request.args.get('page', 1, type=int)
+        start = (page - 1) * QUESTIONS_PER_PAGE
+        if start < 0 or start >= total_questions:
+            return [], total_questions, None
+    page_positions = positions[start:start + QUESTIONS_PER_PAGE + 1]
+
+    next_cursor = None
+    if len(page_positions) > QUESTIONS_PER_PAGE:
+        page_positions = page_positions[:QUESTIONS_PER_PAGE]
+        next_cursor = encode_cursor(snapshot.ids[page_positions[-1]])
+
+    current_questions = [snapshot.question(position) for position in page_positions]
+    return current_questions, total_questions, next_cursor
+
+
+# Decorator used to answer conditional GET requests
+# The ETag and Last-Modified headers are derived from the data version and
+# the request URL, so If-None-Match / If-Modified-Since are answered with
+# a 304 before the view touches the database
+def conditional_get(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version, last_modified = data_version.current()
+        etag = hashlib.sha1("{}:{}".format(
+            version, request.full_path).encode("utf-8")).hexdigest()
+        last_modified = datetime.fromtimestamp(
+            int(last_modified), tz=timezone.utc)
+
+        if is_resource_modified(
+                request.environ, etag=etag, last_modified=last_modified):
+            response = make_response(view(*args, **kwargs))
+        else:
+            response = current_app.response_class(status=304)
+
+        # A replica may be behind the data version, its responses are not
+        # given the validators of the version
+        if response.status_code == 304 or reads_from_primary():
+            response.set_etag(etag)
+            response.last_modified = last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config["CACHE_MAX_AGE"]
+        response.cache_control.must_revalidate = True
+        return response
+    return wrapper
+
+
+# Cookie telling until when the client reads from the primary, after a write
+PRIMARY_STICKY_COOKIE = "trivia_primary_until"
+
+
+# Tells if the client wrote recently, its reads then go to the primary
+# and skip the process caches (read-your-writes)
+def primary_sticky():
+    primary_until = request.cookies.get(PRIMARY_STICKY_COOKIE, 0, type=float)
+    return primary_until > time.time()
+
+
+# Function used to send the reads of the current request to a read replica,
+# unless the client wrote recently (read-your-writes)
+def route_reads_to_replica():
+    replica_binds = current_app.config.get("REPLICA_BINDS")
+    if not replica_binds:
+        return
+    if primary_sticky():
+        return
+    g.replica_bind = random.choice(replica_binds)
+
+
+# Tells if the reads of the current request ran on the primary, only their
+# results are cached or validated with the data version
+def reads_from_primary():
+    return g.get("replica_bind") is None or db.session().wrote
+
+
+# Categories of the process cache, or of the primary for a client which
+# wrote recently
+def get_category_types():
+    return category_cache.load() if primary_sticky() else category_cache.get()
+
+
+# Decorator used to mark the read-only views, which can read from a replica
+def read_only(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        route_reads_to_replica()
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def create_app(test_config=None):
+    # create and configure the app
+    app = Flask(__name__)
+    if test_config is None:
+        # Settings of the database and others come from the environment
+        load_dotenv()
+    else:
+        if isinstance(test_config, str):
+            test_config = CONFIG_PROFILES[test_config]
+        app.config.from_mapping(test_config)
+    app.json = FastJSONProvider(app)
+    setup_db(app)
+
+    # Seconds during which the reads of a client go to the primary after
+    # it wrote, so that it reads its own writes despite replication lag
+    app.config.setdefault(
+        "REPLICA_STICKY_SECONDS", int(os.getenv('REPLICA_STICKY_SECONDS', 5)))
+
+    # Seconds during which clients and CDNs may reuse a read response
+    # without revalidating it
+    app.config.setdefault("CACHE_MAX_AGE", int(os.getenv('CACHE_MAX_AGE', 0)))
+
+    # Questions of a quiz session, drawn at random when it starts
+    app.config.setdefault("QUIZ_SESSION_SIZE", int(os.getenv('QUIZ_SESSION_SIZE', 5)))
+
+    # Store of the quiz sessions, can be replaced by any QuizSessionStore
+    app.config.setdefault("QUIZ_SESSION_STORE", MemoryQuizSessionStore(
+        ttl=int(os.getenv('QUIZ_SESSION_TTL', 3600))))
+
+    # Requests slower than this many seconds are logged with their SQL
+    # statements, 0 to not log them
+    app.config.setdefault(
+        "SLOW_REQUEST_SECONDS", float(os.getenv('SLOW_REQUEST_SECONDS', 0)))
+
+    # Cache of the pages of search results, bounded in entries and bytes
+    app.config.setdefault("SEARCH_CACHE", SearchCache(
+        max_entries=int(os.getenv('SEARCH_CACHE_ENTRIES', 1000)),
+        max_bytes=int(os.getenv('SEARCH_CACHE_BYTES', 16 * 1024 * 1024)),
+        ttl=int(os.getenv('SEARCH_CACHE_TTL', 300))))
+    search_cache = app.config["SEARCH_CACHE"]
+
+    # Minimum trigram similarity (0 to 1) of the words found by fuzzy
+    # searches with the words searched
+    app.config.setdefault(
+        "FUZZY_SEARCH_THRESHOLD", float(os.getenv('FUZZY_SEARCH_THRESHOLD', 0.5)))
+
+    # Build the fuzzy search index in the background at startup, instead of
+    # in the first fuzzy search (not built where pg_trgm is installed). Off
+    # by default, every process building it holds its own copy
+    app.config.setdefault(
+        "FUZZY_INDEX_WARM_UP", bool(int(os.getenv('FUZZY_INDEX_WARM_UP', 0))))
+    if app.config["FUZZY_INDEX_WARM_UP"]:
+        question_text_index.refresh(app)
+
+    def cache_requests():
+        samples = []
+        for name, stats in (("categories", category_cache.stats()),
+                            ("search", search_cache.stats())):
+            samples.append(((name, "hit"), stats["hits"]))
+            samples.append(((name, "miss"), stats["misses"]))
+        return samples
+
+    # Question creations committed in batches by a writer thread, with at
+    # most GROUP_COMMIT_MAX_BATCH_SIZE questions, waiting for concurrent
+    # creations for at most GROUP_COMMIT_MAX_WAIT_MS
+    app.config.setdefault("GROUP_COMMIT", bool(int(os.getenv('GROUP_COMMIT', 0))))
+    app.config.setdefault(
+        "GROUP_COMMIT_MAX_BATCH_SIZE", int(os.getenv('GROUP_COMMIT_MAX_BATCH_SIZE', 100)))
+    app.config.setdefault(
+        "GROUP_COMMIT_MAX_WAIT_MS", float(os.getenv('GROUP_COMMIT_MAX_WAIT_MS', 5)))
+    # Creations not committed after GROUP_COMMIT_TIMEOUT_MS get a 503
+    app.config.setdefault(
+        "GROUP_COMMIT_TIMEOUT_MS", float(os.getenv('GROUP_COMMIT_TIMEOUT_MS', 10000)))
+    group_commit = None
+    if app.config["GROUP_COMMIT"]:
+        group_commit = app.extensions["group_commit"] = GroupCommit(
+            app, max_batch_size=app.config["GROUP_COMMIT_MAX_BATCH_SIZE"],
+            max_wait=app.config["GROUP_COMMIT_MAX_WAIT_MS"] / 1000,
+            timeout=app.config["GROUP_COMMIT_TIMEOUT_MS"] / 1000)
+
+    # Limits of the expensive routes by "METHOD rule": most concurrent
+    # requests, and token bucket rate (requests per second) and burst, for
+    # example {"POST /quizzes": {"concurrency": 8, "rate": 50, "burst": 100}}.
+    # Requests over them are shed with a 503 or a 429
+    app.config.setdefault(
+        "ADMISSION_LIMITS", json.loads(os.getenv('ADMISSION_LIMITS', '{}')))
+
+    # Identical concurrent reads wait for one computation of the response
+    app.extensions["single_flight"] = coalescer = SingleFlight()
+
+    metrics = Metrics()
+    metrics.add(CollectedMetric(
+        "trivia_cache_requests_total", "Cache lookups by cache and result",
+        "counter", cache_requests, ("cache", "result")))
+    metrics.add(CollectedMetric(
+        "trivia_search_cache_evictions_total", "Search results evicted to stay under the bounds",
+        "counter", lambda: [((), search_cache.stats()["evictions"])]))
+    metrics.add(CollectedMetric(
+        "trivia_search_cache_bytes", "Size of the cached search results",
+        "gauge", lambda: [((), search_cache.stats()["bytes"])]))
+    metrics.add(CollectedMetric(
+        "trivia_catalog_snapshot_rebuilds_total", "Catalog snapshots written by this process",
+        "counter", lambda: [((), catalog_snapshot.stats()["rebuilds"])]))
+    metrics.add(CollectedMetric(
+        "trivia_catalog_snapshot_bytes", "Size of the catalog snapshot mapped by this process",
+        "gauge", lambda: [((), catalog_snapshot.stats()["bytes"])]))
+    metrics.add(CollectedMetric(
+        "trivia_single_flight_requests_total",
+        "Reads by route, computed (leader) or given the response of an identical one (coalesced)",
+        "counter", lambda: sorted(coalescer.stats().items()), ("method", "route", "result")))
+    if group_commit is not None:
+        metrics.add(CollectedMetric(
+            "trivia_group_commit_batches_total", "Transactions committed by the group commit",
+            "counter", lambda: [((), group_commit.stats()["batches"])]))
+        metrics.add(CollectedMetric(
+            "trivia_group_commit_questions_total", "Questions created by the group commit",
+            "counter", lambda: [((), group_commit.stats()["questions"])]))
+    metrics.init_app(app)
+    AdmissionControl(app.config["ADMISSION_LIMITS"], metrics).init_app(app)
+
+    '''
+    @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
+    '''
+    CORS(app)
+
+    '''
+    @TODO: Use the after_request decorator to set Access-Control-Allow
+    '''
+    @app.after_request
+    def after_request(response):
+        response.headers.add(
+            'Access-Control-Allow-Headers',
+            'Content-Type, Authorization, true')
+        response.headers.add(
+            'Access-Control-Allow-Methods',
+            'GET, POST, PUT, DELETE, OPTIONS')
+
+        # Keep the reads of a client that just wrote on the primary
+        if app.config["REPLICA_BINDS"] and db.session().wrote:
+            sticky_seconds = app.config["REPLICA_STICKY_SECONDS"]
+            response.set_cookie(
+                PRIMARY_STICKY_COOKIE, str(time.time() + sticky_seconds),
+                max_age=sticky_seconds, httponly=True, samesite="Lax")
+        return response
+    '''
+    @TODO:
+    Create an endpoint to handle GET requests
+    for all available categories.
+    '''
+    @app.route('/categories', methods=['GET'])
+    @conditional_get
+    @read_only
+    @single_flight
+    def get_categories():
+        # Categories are read from the in-process cache
+        categories = get_category_types()
+
+        return jsonify({
+            'categories': categories
+        })
+
+    '''
+    @TODO:
+    Create an endpoint to handle GET requests for questions,
+    including pagination (every 10 questions).
+    This endpoint should return a list of questions,
+    number of total questions, current category, categories.
+
+    TEST: At this point, when you start the application
+    you should see questions and categories generated,
+    ten questions per page and pagination at the bottom of the screen for three pages.
+    Clicking on the page numbers should update the questions.
+    '''
+    @app.route('/questions', methods=['GET'])
+    @conditional_get
+    @read_only
+    @single_flight
+    def get_questions():
+        # Served from the catalog snapshot when it is up to date
+        snapshot = catalog_snapshot.current()
+        if snapshot is not None:
+            categories = snapshot.category_types()
+            current_questions, total_questions, next_cursor = paginate_snapshot(
+                request, snapshot, snapshot.positions(None))
+        else:
+            categories = get_category_types()
+            current_questions, total_questions, next_cursor = paginate_questions(
+                request, Question.query.order_by(Question.id), QuestionCount.total())
+
+        if len(current_questions) == 0:
+            abort(404)
+
+        return jsonify({
+            'questions': current_questions,
+            'total_questions': total_questions,
+            'next_cursor': next_cursor,
+            'categories': categories,
+            # 'currentCategory' : None
+        })
+
+    '''
+    Endpoint exposing the request, database and cache metrics of this
+    process in the Prometheus text format
+    '''
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return current_app.response_class(
+            metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    '''
+    Endpoint returning the number of questions by category and by
+    difficulty, read from the maintained question counters
+    '''
+    @app.route('/stats', methods=['GET'])
+    @conditional_get
+    @read_only
+    @single_flight
+    def get_stats():
+        stats = QuestionCount.stats()
+        categories = get_category_types()
+        for category_id, category_stats in stats['categories'].items():
+            category_stats['type'] = categories.get(category_id)
+
+        return jsonify(stats)
+
+    '''
+    @TODO:
+    Create an endpoint to DELETE question using a question ID.
+
+    TEST: When you click the trash icon next to a question, the question will be removed.
+    This removal will persist in the database and when you refresh the page.
+    '''
+    @app.route('/questions/<int:question_id>', methods=['DELETE'])
+    def delete_one_question(question_id):
+        try:
+            question = Question.query.get_or_404(question_id)
+            question.delete()
+
+            return jsonify({
+                "question_deleted": question_id,
+                "total_questions": QuestionCount.total()
+            })
+
+        except BaseException:
+            abort(422)
+
+    '''
+    Bulk delete of questions, either a list of `ids` or a filter on
+    `category` and/or `difficulty` (criteria are combined). The questions
+    are deleted with set-based DELETE statements in a single transaction.
+    '''
+    @app.route('/questions', methods=['DELETE'])
+    def delete_questions_in_bulk():
+        body = request.get_json(silent=True) or {}
+
+        ids = body.get("ids", None)
+        category = body.get("category", None)
+        difficulty = body.get("difficulty", None)
+
+        try:
+            # At least one criterion is needed to not delete every question
+            if ids is None and category is None and difficulty is None:
+                abort(422)
+            if ids is not None and not all(isinstance(id, int) for id in ids):
+                abort(422)
+
+            deleted = Question.delete_many(ids, category, difficulty)
+
+            return jsonify({
+                "questions_deleted": deleted,
+                "total_questions": QuestionCount.total()
+            })
+
+        except BaseException:
+            abort(422)
+    '''
+    @TODO:
+    Create an endpoint to POST a new question,
+    which will require the question and answer text,
+    category, and difficulty score.
+
+    TEST: When you submit a question on the "Add" tab,
+    the form will clear and the question will appear at the end of the last page
+    of the questions list in the "List" tab.
+    '''
+    '''
+    @TODO:
+    Create a POST endpoint to get questions based on a search term.
+    It should return any questions for whom the search term
+    is a substring of the question.
+
+    TEST: Search by any phrase. The questions list will update to include
+    only question that include that string within their question.
+    Try using the word "title" to start.
+    '''
+    @app.route("/questions", methods=["POST"])
+    def create_new_question_and_search_for_existing_questions():
+        body = request.get_json()
+
+        new_answer = body.get("answer", None)
+        new_question = body.get("question", None)
+        new_difficulty = body.get("difficulty", None)
+        new_category = body.get("category", None)
+        search_term = body.get("search_term", None)
+        fuzzy = body.get("fuzzy", False) is True
+
+        try:
+            # Test if parameters list contains search_term in order to make
+            # search request
+            if search_term:
+                route_reads_to_replica()
+
+                # Pages of results are cached by normalized term and page,
+                # except for a client which wrote recently
+                cursor = get_cursor(request)
+                search_key = (
+                    " ".join(search_words(search_term)), cursor,
+                    request.args.get('page', 1, type=int), fuzzy)
+                version = data_version.current()[0]
+                cached = not primary_sticky()
+                results = search_cache.get(search_key, version) if cached else None
+
+                def search():
+                    if fuzzy:
+                        # Typo tolerant: pg_trgm, or the in-process trigram index
+                        threshold = app.config["FUZZY_SEARCH_THRESHOLD"]
+                        questions_based_on_search = fuzzy_search_questions(
+                            search_term, threshold, ranked=cursor is None)
+                        if questions_based_on_search is None:
+                            return paginate_question_ids(request, question_text_index.search(
+                                search_term, threshold, ranked=cursor is None))
+                    else:
+                        # Results are ranked by relevance, except in cursor mode
+                        # which pages through the matches in id order
+                        questions_based_on_search = search_questions(
+                            search_term, ranked=cursor is None)
+                    return paginate_questions(request, questions_based_on_search)
+
+                if results is None:
+                    # Concurrent identical searches run once
+                    results = coalescer.do(
+                        ("POST", "/questions"),
+                        search_key + (version, g.get("replica_bind") is None), search)
+                    # Results of a replica may be behind the data version
+                    if cached and reads_from_primary():
+                        search_cache.set(search_key, version, results)
+                current_questions, total_questions, next_cursor = results
+
+                if total_questions == 0:
+                    abort(422)
+
+                return jsonify({
+                    "questions": current_questions,
+                    "total_questions": total_questions,
+                    "next_cursor": next_cursor,
+                })
+            # If parameters list does not contains search_term, then proceed to
+            # creation of new question
+            else:
+                if not (new_answer and new_question):
+                    abort(422)
+                if group_commit is not None:
+                    # Committed with the concurrent creations
+                    question_created = group_commit.insert({
+                        "answer": new_answer,
+                        "question": new_question,
+                        "difficulty": new_difficulty,
+                        "category": new_category})
+                else:
+                    question = Question(
+                        answer=new_answer,
+                        question=new_question,
+                        difficulty=new_difficulty,
+                        category=new_category)
+                    question.insert()
+                    question_created = question.format()
+
+                # all_questions = Question.query.order_by(Question.id).all()
+                # current_questions = paginate_questions(request, all_questions)
+
+                return jsonify(
+                    {
+                        "question_created": question_created,
+                        # "questions": current_questions,
+                        # "total_questions": len(all_questions),
+                    }
+                )
+
+        except GroupCommitTimeout:
+            abort(503, retry_after=1)
+        except BaseException:
+            abort(422)
+
+    '''
+    Bulk import of questions. The body is a JSONL or CSV file (format query
+    parameter, or text/csv content type for CSV) streamed into batched
+    inserts of `batch_size` rows.
+    '''
+    @app.route("/questions/import", methods=["POST"])
+    def import_questions_in_bulk():
+        format = request.args.get("format", None)
+        if format is None:
+            format = "csv" if request.mimetype == "text/csv" else "jsonl"
+        batch_size = request.args.get(
+            "batch_size", DEFAULT_BATCH_SIZE, type=int)
+
+        if format not in IMPORT_FORMATS or not 0 < batch_size <= MAX_IMPORT_BATCH_SIZE:
+            abort(422)
+
+        try:
+            stream = io.TextIOWrapper(
+                request.stream, encoding="utf-8", newline="")
+            batch_throughput = []
+            report = import_questions(
+                stream, format, batch_size, batch_throughput.append)
+            report["batch_throughput"] = batch_throughput
+
+        except BaseException:
+            abort(422)
+
+        return jsonify(report)
+
+    @app.cli.command("import-questions")
+    @click.argument("path")
+    @click.option("--format", type=click.Choice(IMPORT_FORMATS), default=None,
+                  help="Defaults to csv for .csv files, else jsonl.")
+    @click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+    def import_questions_command(path, format, batch_size):
+        """Import questions from a JSONL or CSV file ('-' for stdin)."""
+        if format is None:
+            format = "csv" if path.endswith(".csv") else "jsonl"
+
+        def print_batch(batch):
+            click.echo("batch {batch}: {rows} rows in {seconds}s "
+                       "({rows_per_second} rows/s)".format(**batch))
+
+        if path == "-":
+            stream = io.TextIOWrapper(
+                sys.stdin.buffer, encoding="utf-8", newline="")
+            report = import_questions(stream, format, batch_size, print_batch)
+        else:
+            with open(path, encoding="utf-8", newline="") as stream:
+                report = import_questions(
+                    stream, format, batch_size, print_batch)
+
+        for rejected_row in report["rejected_rows"]:
+            click.echo("rejected line {line}: {error}".format(**rejected_row),
+                       err=True)
+        click.echo("{inserted} questions imported, {rejected} rejected, "
+                   "in {seconds}s ({rows_per_second} rows/s)".format(**report))
+
+    '''
+    Export of the questions as NDJSON, optionally filtered by category and
+    difficulty. The response is generated while the rows are read, and is
+    compressed on the fly when the client accepts gzip.
+    '''
+    @app.route("/questions/export", methods=["GET"])
+    @read_only
+    def export_questions_as_ndjson():
+        category = request.args.get("category", None, type=int)
+        difficulty = request.args.get("difficulty", None, type=int)
+
+        lines = export_questions(category, difficulty)
+        headers = {"Vary": "Accept-Encoding"}
+        if request.accept_encodings["gzip"]:
+            body = gzip_lines(lines)
+            headers["Content-Encoding"] = "gzip"
+        else:
+            body = lines
+
+        return current_app.response_class(
+            stream_with_context(body),
+            mimetype="application/x-ndjson",
+            headers=headers)
+
+    @app.cli.command("export-questions")
+    @click.option("--category", type=int, default=None)
+    @click.option("--difficulty", type=int, default=None)
+    @click.option("--output", default="-", show_default=True,
+                  help="File to write, '-' for stdout.")
+    @click.option("--gzip", "compress", is_flag=True,
+                  help="Compress the output with gzip.")
+    def export_questions_command(category, difficulty, output, compress):
+        """Export questions as NDJSON."""
+        lines = export_questions(category, difficulty)
+        if output == "-":
+            if compress:
+                for chunk in gzip_lines(lines):
+                    sys.stdout.buffer.write(chunk)
+            else:
+                sys.stdout.writelines(lines)
+        elif compress:
+            with gzip.open(output, "wt", encoding="utf-8") as export_file:
+                export_file.writelines(lines)
+        else:
+            with open(output, "w", encoding="utf-8") as export_file:
+                export_file.writelines(lines)
+
+    '''
+    @TODO: (bonus)
+    Create an endpoint to POST a new category,
+    which will require the type of category text.
+    '''
+    @app.route("/categories", methods=["POST"])
+    def create_new_category():
+        body = request.get_json()
+        new_type = body.get("type", None)
+
+        try:
+            if new_type:
+                category = Category(type=new_type)
+                category.insert()
+            else:
+                abort(422)
+
+            return jsonify(
+                {
+                    "category_created": category.format()
+                }
+            )
+
+        except BaseException:
+            abort(422)
+
+    '''
+    @TODO:
+    Create a GET endpoint to get questions based on category.
+
+    TEST: In the "List" tab / main screen, clicking on one of the
+    categories in the left column will cause only questions of that
+    category to be shown.
+    '''
+    @app.route("/categories/<int:category_id>/questions", methods=["GET"])
+    @conditional_get
+    @read_only
+    @single_flight
+    def get_questions_based_on_category(category_id):
+
+        try:
+            snapshot = catalog_snapshot.current()
+            categories = snapshot.category_types() if snapshot else get_category_types()
+            if category_id not in categories:
+                abort(404)
+            current_category = {'id': category_id, 'type': categories[category_id]}
+
+            if snapshot is not None:
+                current_questions, total_questions, next_cursor = paginate_snapshot(
+                    request, snapshot, snapshot.positions(category_id))
+            else:
+                # Trying to get questions based on category in parameter
+                questions_from_category = Question.query.filter(
+                    Question.category == category_id).order_by(Question.id)
+                current_questions, total_questions, next_cursor = paginate_questions(
+                    request, questions_from_category, QuestionCount.total(category_id))
+
+            return jsonify(
+                {
+                    "questions": current_questions,
+                    "total_questions": total_questions,
+                    "next_cursor": next_cursor,
+                    "current_category": current_category,
+                }
+            )
+
+        except BaseException:
+            abort(404)
+
+    '''
+    @TODO:
+    Create a POST endpoint to get questions to play the quiz.
+    This endpoint should take category and previous question parameters
+    and return a random questions within the given category,
+    if provided, and that is not one of the previous questions.
+
+    TEST: In the "Play" tab, after a user selects "All" or a category,
+    one question at a time is displayed, the user is allowed to answer
+    and shown whether they were correct or not.
+    '''
+    @app.route("/quizzes", methods=["POST"])
+    @read_only
+    def get_questions_to_play_the_quiz():
+        body = request.get_json()
+
+        previous_questions = body.get("previous_questions", None)
+        quiz_category = body.get("quiz_category", None)
+
+        try:
+            # Test if there is no category specified, then play with the
+            # questions of all categories
+            if quiz_category['id'] == 0:
+                quiz_category_id = None
+            else:
+                quiz_category_id = quiz_category['id']
+
+            snapshot = catalog_snapshot.current()
+            if snapshot is not None:
+                # Picked from the catalog snapshot, without a query
+                positions = snapshot.positions(quiz_category_id)
+                if positions is None:
+                    abort(422)
+                position = snapshot.choice(positions, set(previous_questions or []))
+                current_question = snapshot.question(position) if position is not None else None
+            else:
+                # If category does not exist, abort with error 422
+                if quiz_category_id is not None and quiz_category_id not in get_category_types():
+                    abort(422)
+
+                # Questions are picked from the in-memory id index, excluding
+                # the previous ones, and only the chosen row is fetched
+                question = question_id_index.random_question(
+                    quiz_category_id, previous_questions or [])
+                current_question = question.format() if question else None
+
+            return jsonify(
+                {
+                    "question": current_question,
+                }
+            )
+
+        except BaseException:
+            abort(422)
+
+    '''
+    Batched variant of /quizzes returning `count` distinct questions at
+    once, so that the client can prefetch a whole round
+    '''
+    @app.route("/quizzes/batch", methods=["POST"])
+    @read_only
+    def get_batch_of_questions_to_play_the_quiz():
+        body = request.get_json()
+
+        previous_questions = body.get("previous_questions", None)
+        quiz_category = body.get("quiz_category", None)
+        count = body.get("count", 5)
+
+        try:
+            if not isinstance(count, int) or not 0 < count <= MAX_QUIZ_BATCH_SIZE:
+                abort(422)
+
+            # Test if there is no category specified
+            if quiz_category['id'] == 0:
+                quiz_category_id = None
+            else:
+                quiz_category_id = quiz_category['id']
+
+            snapshot = catalog_snapshot.current()
+            if snapshot is not None:
+                positions = snapshot.positions(quiz_category_id)
+                if positions is None:
+                    abort(422)
+                questions = [snapshot.question(position) for position in snapshot.sample(
+                    positions, set(previous_questions or []), count)]
+            else:
+                # If category does not exist, abort with error 422
+                if quiz_category_id is not None and quiz_category_id not in get_category_types():
+                    abort(422)
+
+                questions = [question.format() for question in question_id_index.random_questions(
+                    quiz_category_id, previous_questions or [], count)]
+
+            return jsonify(
+                {
+                    "questions": questions,
+                }
+            )
+
+        except BaseException:
+            abort(422)
+
+    '''
+    Quiz sessions: the server keeps a deck of QUIZ_SESSION_SIZE random
+    question ids of the category, and each request for the next question
+    pops from it.
+    '''
+    @app.route("/quizzes/sessions", methods=["POST"])
+    @read_only
+    def start_quiz_session():
+        body = request.get_json()
+
+        quiz_category = body.get("quiz_category", None)
+
+        try:
+            # Test if there is no category specified
+            if quiz_category['id'] == 0:
+                quiz_category_id = None
+            else:
+                quiz_category_id = quiz_category['id']
+
+                # If category does not exist, abort with error 422
+                if quiz_category_id not in get_category_types():
+                    abort(422)
+
+            question_id_index.load()
+            question_ids = question_id_index.sample(
+                quiz_category_id, set(), app.config["QUIZ_SESSION_SIZE"])
+            session = app.config["QUIZ_SESSION_STORE"].create(question_ids)
+
+            return jsonify(
+                {
+                    "session": session,
+                    "total_questions": len(question_ids),
+                }
+            )
+
+        except BaseException:
+            abort(422)
+
+    @app.route("/quizzes/sessions/<session>/next", methods=["POST"])
+    @read_only
+    def get_next_question_of_quiz_session(session):
+        store = app.config["QUIZ_SESSION_STORE"]
+
+        try:
+            question_id, remaining = store.pop(session)
+            current_question = None
+            while question_id is not None:
+                question = Question.query.get(question_id)
+                # Skip questions deleted since the session started
+                if question is not None:
+                    current_question = question.format()
+                    break
+                question_id, remaining = store.pop(session)
+
+        except KeyError:
+            abort(404)
+
+        return jsonify(
+            {
+                "question": current_question,
+                "remaining_questions": remaining,
+            }
+        )
+
+    @app.route("/quizzes/sessions/<session>", methods=["DELETE"])
+    def end_quiz_session(session):
+        app.config["QUIZ_SESSION_STORE"].delete(session)
+
+        return jsonify(
+            {
+                "session_deleted": session,
+            }
+        )
+
+    '''
+    @TODO:
+    Create error handlers for all expected errors
+    including 404 and 422.
+    '''
+    @app.errorhandler(400)
+    def bad_request(error):
+        return (jsonify({
+            "success": False,
+            "error": 400,
+            "message": "You request is not valid"
+        }), 400)
+
+    @app.errorhandler(404)
+    def not_found(error):
+        return (jsonify({
+            "success": False,
+            "error": 404,
+            "message": "Resource not found"
+        }), 404)
+
+    @app.errorhandler(422)
+    def unprocessable(error):
+        return (jsonify({
+            "success": False,
+            "error": 422,
+            "message": "Unprocessable"
+        }), 422)
+
+    @app.errorhandler(405)
+    def not_allowed(error):
+        return (jsonify({
+            "success": False,
+            "error": 405,
+            "message": "Method not allowed"
+        }), 405)
+
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        return (jsonify({
+            "success": False,
+            "error": 429,
+            "message": "Too many requests"
+        }), 429, retry_after(error))
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return (jsonify({
+            "success": False,
+            "error": 503,
+            "message": "Service unavailable"
+        }), 503, retry_after(error))
+
+    @app.errorhandler(500)
+    def internal_server_eror(error):
+        return (jsonify({
+            "success": False,
+            "error": 500,
+            "message": "Internal server error"
+        }), 500)
+
+    return app
@@ -0,0 +1,146 @@
+import math
+import threading
+import time
+
+from flask import abort, g, request
+
+from .metrics import Counter, CollectedMetric
+
+'''
+Admission control
+
+Limits of the expensive routes, so that a spike on them cannot take all
+the connections of the pool and slow down every route. Each route (method
+and URL rule) can have:
+
+  concurrency  most requests of the route running at once in the process
+  rate, burst  token bucket: requests per second on average, and at once
+
+A request over a limit is rejected right away, before the view runs:
+503 when the route has too many requests running, 429 when it is over
+its rate, both with a Retry-After header. Limits are per process, set
+with the ADMISSION_LIMITS setting of create_app, for example:
+
+  {"POST /questions": {"concurrency": 8, "rate": 50, "burst": 100},
+   "POST /quizzes": {"concurrency": 8}}
+'''
+
+# Seconds after which a request rejected for concurrency may be retried
+CONCURRENCY_RETRY_AFTER = 1
+
+
+'''
+TokenBucket
+    rate tokens per second, up to burst tokens saved
+'''
+class TokenBucket:
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate)
+        self.lock = threading.Lock()
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+
+    # Takes a token, returns 0 or the seconds until a token is available
+    def take(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+'''
+ConcurrencyLimit
+    counter of the running requests, never waiting for a slot
+'''
+class ConcurrencyLimit:
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.running = 0
+
+    def acquire(self):
+        with self.lock:
+            if self.running >= self.limit:
+                return False
+            self.running += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.running -= 1
+
+
+# Headers of the response to a shed request (an aborted 429 or 503)
+def retry_after(error):
+    seconds = getattr(error, "retry_after", None)
+    return {} if seconds is None else {"Retry-After": str(seconds)}
+
+
+class RouteLimits:
+
+    def __init__(self, concurrency=None, rate=None, burst=None):
+        self.concurrency = ConcurrencyLimit(concurrency) if concurrency else None
+        self.bucket = TokenBucket(rate, burst) if rate else None
+
+
+'''
+AdmissionControl
+    limits of the routes of an app, from {"METHOD rule": limits}, with the
+    admitted and shed requests counted in metrics
+'''
+class AdmissionControl:
+
+    def __init__(self, limits, metrics):
+        self.routes = {}
+        for route, route_limits in limits.items():
+            method, rule = route.split(" ", 1)
+            self.routes[method.upper(), rule] = RouteLimits(**route_limits)
+        self.requests = metrics.add(Counter(
+            "trivia_admission_requests_total",
+            "Requests of the limited routes, admitted or shed (by concurrency or rate)",
+            ("method", "route", "result")))
+        metrics.add(CollectedMetric(
+            "trivia_admission_running", "Requests running in the routes with a concurrency limit",
+            "gauge", self.running, ("method", "route")))
+
+    def init_app(self, app):
+        app.extensions["admission_control"] = self
+        app.before_request(self.before_request)
+        app.teardown_request(self.teardown_request)
+
+    def running(self):
+        return [(route, limits.concurrency.running)
+                for route, limits in sorted(self.routes.items()) if limits.concurrency]
+
+    def before_request(self):
+        if request.url_rule is None:
+            return
+        route = (request.method, request.url_rule.rule)
+        limits = self.routes.get(route)
+        if limits is None:
+            return
+
+        if limits.concurrency is not None:
+            if not limits.concurrency.acquire():
+                self.requests.inc(route + ("shed_concurrency",))
+                abort(503, retry_after=CONCURRENCY_RETRY_AFTER)
+            g.admission_slot = limits.concurrency
+
+        if limits.bucket is not None:
+            wait = limits.bucket.take()
+            if wait:
+                self.requests.inc(route + ("shed_rate",))
+                abort(429, retry_after=math.ceil(wait))
+        self.requests.inc(route + ("admitted",))
+
+    def teardown_request(self, exception):
+        slot = g.pop("admission_slot", None)
+        if slot is not None:
+            slot.release()
@@ -0,0 +1,571 @@
+import hashlib
+import json
+import random
+import re
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from werkzeug.exceptions import HTTPException, abort
+from werkzeug.http import http_date, is_resource_modified, parse_cookie
+
+from models import (
+    search_words, search_clauses, data_version, category_cache,
+    question_id_index, Question, QuestionCount, Category)
+from . import (
+    create_app, encode_cursor, decode_cursor, QUESTIONS_PER_PAGE,
+    MAX_QUIZ_BATCH_SIZE, PRIMARY_STICKY_COOKIE)
+from .serialization import QUESTION_COLUMNS, format_question_row, encode_json
+
+'''
+Async serving mode
+
+create_asgi_app() returns an ASGI application serving the same routes and
+JSON documents as create_app(). The read endpoints hit on every page view
+(categories, lists of questions, search and quizzes) are served natively
+with async SQLAlchemy sessions (asyncpg for Postgres, aiosqlite for
+SQLite), so a worker keeps serving other requests while it waits on the
+database. The other routes (writes, import/export, quiz sessions) are
+handed to the Flask app in a thread.
+
+Run with an ASGI server, from the backend folder:
+
+  uvicorn --factory flaskr.asgi:create_asgi_app
+'''
+
+# Async driver used for the dialect of the database URI
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
+# Same bodies as the error handlers of create_app
+ERROR_MESSAGES = {
+    400: "You request is not valid",
+    404: "Resource not found",
+    405: "Method not allowed",
+    422: "Unprocessable",
+    500: "Internal server error",
+}
+
+
+# Returns the database URI with the async driver of its dialect
+def async_database_uri(uri):
+    scheme, separator, rest = uri.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    if dialect == "postgres":
+        dialect = "postgresql"
+    if dialect not in ASYNC_DRIVERS:
+        raise ValueError("No async driver for {}".format(dialect))
+    return "{}+{}://{}".format(dialect, ASYNC_DRIVERS[dialect], rest)
+
+
+'''
+AsyncRequest
+    the parts of an ASGI HTTP request used by the async views, with the
+    same accessors as the flask request where they overlap
+'''
+class AsyncRequest:
+
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.query_string = scope["query_string"].decode("latin-1")
+        self.args = dict(parse_qsl(self.query_string))
+        self.headers = {
+            name.decode("latin-1"): value.decode("latin-1")
+            for name, value in scope["headers"]}
+        self.body = body
+        self.cookies = parse_cookie(self.headers.get("cookie", ""))
+        # Bind of the reads, set by the app: a replica, or None for the primary
+        self.replica_bind = None
+
+    @property
+    def full_path(self):
+        return "{}?{}".format(self.path, self.query_string)
+
+    def arg(self, name, default=None, type=None):
+        value = self.args.get(name)
+        if value is None:
+            return default
+        try:
+            return type(value) if type is not None else value
+        except ValueError:
+            return default
+
+    def get_json(self):
+        if not self.headers.get("content-type", "").startswith("application/json"):
+            return None
+        try:
+            return json.loads(self.body or b"null")
+        except ValueError:
+            return None
+
+    # Same as primary_sticky() of the flask app
+    def primary_sticky(self):
+        try:
+            primary_until = float(self.cookies.get(PRIMARY_STICKY_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        return primary_until > time.time()
+
+    # Same as get_cursor() of the flask app
+    def cursor(self):
+        cursor = self.args.get("cursor")
+        if cursor is None:
+            body = self.get_json()
+            if isinstance(body, dict):
+                cursor = body.get("cursor")
+        return cursor
+
+
+# Same bytes as jsonify() with the JSON provider of the flask app
+def json_response(body, status=200, headers=()):
+    return status, encode_json(body) + b"\n", [("Content-Type", "application/json")] + list(headers)
+
+
+def error_response(code):
+    return json_response({
+        "success": False,
+        "error": code,
+        "message": ERROR_MESSAGES.get(code, ERROR_MESSAGES[500])
+    }, code)
+
+
+# Same as the conditional_get decorator of the flask app
+def conditional_get(view):
+    async def wrapper(app, request, **kwargs):
+        version, last_modified = data_version.current()
+        etag = hashlib.sha1("{}:{}".format(
+            version, request.full_path).encode("utf-8")).hexdigest()
+        last_modified = datetime.fromtimestamp(
+            int(last_modified), tz=timezone.utc)
+
+        environ = {"REQUEST_METHOD": request.method}
+        for header in ("if-none-match", "if-modified-since"):
+            if header in request.headers:
+                environ["HTTP_" + header.upper().replace("-", "_")] = request.headers[header]
+
+        if is_resource_modified(environ, etag=etag, last_modified=last_modified):
+            status, body, headers = await view(app, request, **kwargs)
+        else:
+            status, body, headers = 304, b"", []
+
+        if status == 304 or request.replica_bind is None:
+            headers = headers + [
+                ("ETag", '"{}"'.format(etag)),
+                ("Last-Modified", http_date(last_modified))]
+        headers = headers + [
+            ("Cache-Control", "public, max-age={}, must-revalidate".format(
+                app.flask_app.config["CACHE_MAX_AGE"])),
+        ]
+        return status, body, headers
+    return wrapper
+
+
+async def total_questions(session, category_id=None):
+    selection = select(func.coalesce(func.sum(QuestionCount.count), 0))
+    if category_id is not None:
+        selection = selection.where(QuestionCount.category == category_id)
+    return (await session.execute(selection)).scalar()
+
+
+# Same as get_category_types() of the flask app, loaded from the primary
+async def get_categories(app, request):
+    sticky = request.primary_sticky()
+    if not sticky:
+        categories, version = category_cache.lookup()
+        if categories is not None:
+            return categories
+    async with app.sessionmakers[None]() as session:
+        categories = dict((await session.execute(
+            select(Category.id, Category.type).order_by(Category.id))).all())
+    return categories if sticky else category_cache.store(version, categories)
+
+
+# Same as QuestionIdIndex.load(): loaded with the async session the first
+# time, then reloaded in the background when too old
+async def load_question_id_index(app, session):
+    if question_id_index.loaded_at is not None:
+        if not question_id_index.is_loaded():
+            question_id_index.refresh(app.flask_app)
+        return
+    category_rows = (await session.execute(select(Category.id))).all()
+    question_rows = (await session.execute(
+        select(Question.id, Question.category))).all()
+    question_id_index.fill(category_rows, question_rows)
+
+
+# Same as paginate_questions() of the flask app, for a select() of the
+# question columns ordered by Question.id
+async def paginate_questions(session, request, selection, total=None):
+    if total is None:
+        total = (await session.execute(select(func.count()).select_from(
+            selection.order_by(None).subquery()))).scalar()
+    cursor = request.cursor()
+
+    if cursor is not None:
+        last_id = decode_cursor(cursor)
+        selection = selection.where(Question.id > last_id)
+    else:
+        page = request.arg("page", 1, type=int)
+        start = (page - 1) * QUESTIONS_PER_PAGE
+        if start < 0 or start >= total:
+            return [], total, None
+        selection = selection.offset(start)
+    page_of_questions = (await session.execute(
+        selection.limit(QUESTIONS_PER_PAGE + 1))).all()
+
+    # One extra row is fetched to know if there is a next page
+    next_cursor = None
+    if len(page_of_questions) > QUESTIONS_PER_PAGE:
+        page_of_questions = page_of_questions[:QUESTIONS_PER_PAGE]
+        next_cursor = encode_cursor(page_of_questions[-1].id)
+
+    return [format_question_row(row) for row in page_of_questions], total, next_cursor
+
+
+def question_category_id(body):
+    quiz_category = body.get("quiz_category", None)
+    if quiz_category["id"] == 0:
+        return None
+    return quiz_category["id"]
+
+
+@conditional_get
+async def get_all_categories(app, request):
+    async with app.session(request) as session:
+        categories = await get_categories(app, request)
+
+    return json_response({
+        "categories": categories
+    })
+
+
+@conditional_get
+async def get_questions(app, request):
+    async with app.session(request) as session:
+        categories = await get_categories(app, request)
+        current_questions, total, next_cursor = await paginate_questions(
+            session, request, select(*QUESTION_COLUMNS).order_by(Question.id),
+            await total_questions(session))
+
+    if len(current_questions) == 0:
+        abort(404)
+
+    return json_response({
+        "questions": current_questions,
+        "total_questions": total,
+        "next_cursor": next_cursor,
+        "categories": categories,
+    })
+
+
+@conditional_get
+async def get_questions_based_on_category(app, request, category_id):
+    try:
+        async with app.session(request) as session:
+            categories = await get_categories(app, request)
+            if category_id not in categories:
+                abort(404)
+            current_category = {"id": category_id, "type": categories[category_id]}
+
+            current_questions, total, next_cursor = await paginate_questions(
+                session, request, select(*QUESTION_COLUMNS).where(
+                    Question.category == category_id).order_by(Question.id),
+                await total_questions(session, category_id))
+
+        return json_response({
+            "questions": current_questions,
+            "total_questions": total,
+            "next_cursor": next_cursor,
+            "current_category": current_category,
+        })
+
+    except BaseException:
+        abort(404)
+
+
+# Only searches are served here, question creation goes to the flask app
+async def search_for_questions(app, request):
+    body = request.get_json()
+    search_term = body.get("search_term", None) if isinstance(body, dict) else None
+    # Fuzzy searches go to the flask app, which has the trigram index
+    if not search_term or body.get("fuzzy", False) is True:
+        return None
+
+    try:
+        words = search_words(search_term)
+        if not words:
+            abort(422)
+
+        # Same cache and keys as the flask app
+        search_cache = app.flask_app.config["SEARCH_CACHE"]
+        search_key = (" ".join(words), request.cursor(), request.arg("page", 1, type=int), False)
+        version = data_version.current()[0]
+        cached = not request.primary_sticky()
+        results = search_cache.get(search_key, version) if cached else None
+
+        if results is None:
+            async with app.session(request) as session:
+                join, condition, rank = search_clauses(
+                    search_term, words, session.bind.dialect.name)
+                selection = select(*QUESTION_COLUMNS)
+                if join is not None:
+                    selection = selection.join(*join)
+                selection = selection.where(condition)
+                # Results are ranked by relevance, except in cursor mode
+                if rank is not None and request.cursor() is None:
+                    selection = selection.order_by(rank, Question.id)
+                else:
+                    selection = selection.order_by(Question.id)
+
+                results = await paginate_questions(session, request, selection)
+            # Results of a replica may be behind the data version
+            if cached and request.replica_bind is None:
+                search_cache.set(search_key, version, results)
+        current_questions, total, next_cursor = results
+
+        if total == 0:
+            abort(422)
+
+        return json_response({
+            "questions": current_questions,
+            "total_questions": total,
+            "next_cursor": next_cursor,
+        })
+
+    except BaseException:
+        abort(422)
+
+
+# Fetches the rows of the chosen ids, dropping the ids deleted since the
+# index was loaded
+async def fetch_questions(session, category_id, question_ids, excluded):
+    rows = await session.execute(
+        select(*QUESTION_COLUMNS).where(Question.id.in_(question_ids)))
+    found_by_id = {row.id: row for row in rows}
+    questions = []
+    for question_id in question_ids:
+        excluded.add(question_id)
+        if question_id in found_by_id:
+            questions.append(format_question_row(found_by_id[question_id]))
+        else:
+            question_id_index.remove(question_id, category_id)
+    return questions
+
+
+async def get_questions_to_play_the_quiz(app, request):
+    try:
+        body = request.get_json()
+        previous_questions = body.get("previous_questions", None)
+        quiz_category_id = question_category_id(body)
+
+        async with app.session(request) as session:
+            if quiz_category_id is not None and \
+                    quiz_category_id not in await get_categories(app, request):
+                abort(422)
+
+            await load_question_id_index(app, session)
+            excluded = set(previous_questions or [])
+            current_question = None
+            while current_question is None:
+                question_id = question_id_index.choose(quiz_category_id, excluded)
+                if question_id is None:
+                    break
+                questions = await fetch_questions(
+                    session, quiz_category_id, [question_id], excluded)
+                current_question = questions[0] if questions else None
+
+        return json_response({
+            "question": current_question,
+        })
+
+    except BaseException:
+        abort(422)
+
+
+async def get_batch_of_questions_to_play_the_quiz(app, request):
+    try:
+        body = request.get_json()
+        previous_questions = body.get("previous_questions", None)
+        count = body.get("count", 5)
+        if not isinstance(count, int) or not 0 < count <= MAX_QUIZ_BATCH_SIZE:
+            abort(422)
+        quiz_category_id = question_category_id(body)
+
+        async with app.session(request) as session:
+            if quiz_category_id is not None and \
+                    quiz_category_id not in await get_categories(app, request):
+                abort(422)
+
+            await load_question_id_index(app, session)
+            excluded = set(previous_questions or [])
+            questions = []
+            while len(questions) < count:
+                question_ids = question_id_index.sample(
+                    quiz_category_id, excluded, count - len(questions))
+                if not question_ids:
+                    break
+                questions.extend(await fetch_questions(
+                    session, quiz_category_id, question_ids, excluded))
+
+        return json_response({
+            "questions": questions,
+        })
+
+    except BaseException:
+        abort(422)
+
+
+ROUTES = [
+    ("GET", r"/categories", get_all_categories),
+    ("GET", r"/questions", get_questions),
+    ("POST", r"/questions", search_for_questions),
+    ("GET", r"/categories/(?P<category_id>\d+)/questions", get_questions_based_on_category),
+    ("POST", r"/quizzes", get_questions_to_play_the_quiz),
+    ("POST", r"/quizzes/batch", get_batch_of_questions_to_play_the_quiz),
+]
+
+
+'''
+TriviaASGI
+    ASGI application serving ROUTES with async sessions and everything
+    else with the flask app
+'''
+class TriviaASGI:
+
+    def __init__(self, flask_app, wsgi_app):
+        self.flask_app = flask_app
+        self.wsgi_app = wsgi_app
+        self.routes = [
+            (method, re.compile(pattern + r"/?\Z"), view)
+            for method, pattern, view in ROUTES]
+
+        config = flask_app.config
+        binds = config.get("SQLALCHEMY_BINDS") or {}
+        self.engines = {None: create_async_engine(
+            async_database_uri(config["SQLALCHEMY_DATABASE_URI"]))}
+        for bind in config.get("REPLICA_BINDS") or []:
+            self.engines[bind] = create_async_engine(async_database_uri(binds[bind]))
+        self.sessionmakers = {
+            bind: sessionmaker(engine, class_=AsyncSession)
+            for bind, engine in self.engines.items()}
+
+    # Read replica of a request, unless the client wrote recently
+    def route_reads_to_replica(self, request):
+        replica_binds = self.flask_app.config.get("REPLICA_BINDS")
+        if replica_binds and not request.primary_sticky():
+            request.replica_bind = random.choice(replica_binds)
+
+    # Async session of the read replica of the request, or of the primary
+    def session(self, request):
+        return self.sessionmakers[request.replica_bind]()
+
+    def match(self, method, path):
+        for route_method, pattern, view in self.routes:
+            if route_method == method:
+                match = pattern.match(path)
+                if match is not None:
+                    return view, {name: int(value) for name, value in match.groupdict().items()}
+        return None, None
+
+    async def dispose(self):
+        for engine in self.engines.values():
+            await engine.dispose()
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+
+        view, kwargs = (None, None)
+        if scope["type"] == "http":
+            view, kwargs = self.match(scope["method"], scope["path"])
+        if view is None:
+            return await self.wsgi_app(scope, receive, send)
+
+        body = await read_body(receive)
+        request = AsyncRequest(scope, body)
+        self.route_reads_to_replica(request)
+        try:
+            response = await view(self, request, **kwargs)
+        except HTTPException as error:
+            response = error_response(error.code)
+        except Exception:
+            self.flask_app.logger.exception("Exception on %s [%s]", request.path, request.method)
+            response = error_response(500)
+
+        if response is None:
+            # Not served here, the flask app reads the body again
+            return await self.wsgi_app(scope, replay_body(body, receive), send)
+        await self.send_response(request, response, send)
+
+    async def send_response(self, request, response, send):
+        status, body, headers = response
+        # Same headers as the after_request handler and CORS of the flask app
+        headers = headers + [
+            ("Content-Length", str(len(body))),
+            ("Access-Control-Allow-Headers", "Content-Type, Authorization, true"),
+            ("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS"),
+        ]
+        if "origin" in request.headers:
+            headers.append(("Access-Control-Allow-Origin", "*"))
+
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in headers],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+# Returns a receive callable sending the body already read, then the
+# messages of the original receive
+def replay_body(body, receive):
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+    return replay
+
+
+'''
+create_asgi_app(flask_app)
+    returns the ASGI application of flask_app, created with create_app()
+    when not given. Needs asgiref and the async driver of the database
+    (asyncpg or aiosqlite).
+'''
+def create_asgi_app(flask_app=None):
+    from asgiref.wsgi import WsgiToAsgi
+
+    if flask_app is None:
+        flask_app = create_app()
+    return TriviaASGI(flask_app, WsgiToAsgi(flask_app))
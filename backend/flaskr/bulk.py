@@ -0,0 +1,204 @@
+import csv
+import io
+import json
+import time
+import zlib
+from itertools import islice
+
+from models import db, data_version, catalog_snapshot, category_cache, question_id_index, question_text_index, Question, QuestionCount
+from .serialization import project_questions, format_question_row, encode_json
+
+'''
+Bulk import and export of questions
+
+Questions are read one row at a time from a JSONL or CSV stream, checked,
+and inserted in batches of batch_size rows with one statement per batch
+(COPY on Postgres, executemany elsewhere) and one commit per batch, so the
+memory used does not depend on the size of the input.
+
+Exports stream the questions table as NDJSON through a server-side cursor
+(yield_per), with optional gzip compression on the fly, so they run in
+constant memory too.
+'''
+
+DEFAULT_BATCH_SIZE = 1000
+# Only the first rejected rows are kept in the report, the others are counted
+MAX_REPORTED_REJECTIONS = 100
+QUESTION_FIELDS = ("question", "answer", "category", "difficulty")
+DIFFICULTIES = range(1, 6)
+EXPORT_BATCH_SIZE = 1000
+# Size of the compressed chunks sent when exporting with gzip
+GZIP_CHUNK_SIZE = 64 * 1024
+
+
+# Yields (line number, row) for every row of the stream
+def read_rows(stream, format):
+    if format == "jsonl":
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError:
+                yield line_number, None
+    elif format == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        raise ValueError("Unknown format {}".format(format))
+
+
+# Returns the values to insert for a row, raises ValueError when invalid
+def validate_row(row, category_ids):
+    if not isinstance(row, dict):
+        raise ValueError("row is not an object")
+
+    question = row.get("question")
+    answer = row.get("answer")
+    if not isinstance(question, str) or not question.strip():
+        raise ValueError("question is missing")
+    if not isinstance(answer, str) or not answer.strip():
+        raise ValueError("answer is missing")
+
+    try:
+        category = int(row.get("category"))
+        difficulty = int(row.get("difficulty"))
+    except (TypeError, ValueError):
+        raise ValueError("category and difficulty must be integers")
+    if category not in category_ids:
+        raise ValueError("category {} does not exist".format(category))
+    if difficulty not in DIFFICULTIES:
+        raise ValueError("difficulty must be between 1 and 5")
+
+    return {
+        "question": question,
+        "answer": answer,
+        "category": category,
+        "difficulty": difficulty,
+    }
+
+
+def copy_batch(connection, batch):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for values in batch:
+        writer.writerow([values[field] for field in QUESTION_FIELDS])
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    cursor.copy_expert(
+        "COPY questions (question, answer, category, difficulty) "
+        "FROM STDIN WITH (FORMAT csv)", buffer)
+    cursor.close()
+
+
+def insert_batch(batch):
+    try:
+        connection = db.session.connection()
+        if connection.dialect.name == "postgresql":
+            copy_batch(connection, batch)
+        else:
+            connection.execute(Question.__table__.insert(), batch)
+        QuestionCount.add_rows(batch)
+        db.session.commit()
+    except BaseException:
+        db.session.rollback()
+        raise
+
+
+'''
+import_questions(stream, format, batch_size, on_batch)
+    imports the questions of a JSONL or CSV text stream and returns a
+    report. on_batch is called with the report of every inserted batch.
+'''
+def import_questions(stream, format="jsonl", batch_size=DEFAULT_BATCH_SIZE,
+                     on_batch=None):
+    category_ids = set(category_cache.get())
+    report = {
+        "inserted": 0,
+        "rejected": 0,
+        "rejected_rows": [],
+        "batches": 0,
+        "seconds": 0.0,
+    }
+
+    def valid_rows():
+        for line_number, row in read_rows(stream, format):
+            try:
+                yield validate_row(row, category_ids)
+            except ValueError as error:
+                report["rejected"] += 1
+                if len(report["rejected_rows"]) < MAX_REPORTED_REJECTIONS:
+                    report["rejected_rows"].append(
+                        {"line": line_number, "error": str(error)})
+
+    started_at = time.perf_counter()
+    rows = valid_rows()
+    try:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+
+            batch_started_at = time.perf_counter()
+            insert_batch(batch)
+            seconds = time.perf_counter() - batch_started_at
+
+            report["inserted"] += len(batch)
+            report["batches"] += 1
+            if on_batch is not None:
+                on_batch({
+                    "batch": report["batches"],
+                    "rows": len(batch),
+                    "seconds": round(seconds, 4),
+                    "rows_per_second": round(len(batch) / seconds) if seconds else None,
+                })
+    finally:
+        if report["inserted"]:
+            data_version.bump()
+            catalog_snapshot.invalidate()
+            question_id_index.reset()
+            question_text_index.invalidate()
+
+    report["seconds"] = round(time.perf_counter() - started_at, 4)
+    report["rows_per_second"] = (
+        round(report["inserted"] / report["seconds"]) if report["seconds"] else None)
+    return report
+
+
+'''
+export_questions(category, difficulty, batch_size)
+    yields the questions, optionally filtered by category and difficulty,
+    as NDJSON lines in id order. Rows are fetched batch_size at a time.
+'''
+def export_questions(category=None, difficulty=None,
+                     batch_size=EXPORT_BATCH_SIZE):
+    selection = project_questions(Question.query).order_by(Question.id)
+    if category is not None:
+        selection = selection.filter(Question.category == category)
+    if difficulty is not None:
+        selection = selection.filter(Question.difficulty == difficulty)
+
+    rows = selection.execution_options(
+        stream_results=True).yield_per(batch_size)
+    for row in rows:
+        yield encode_json(format_question_row(row)).decode("utf-8") + "\n"
+
+
+# Compresses a stream of text lines into gzip chunks of about chunk_size
+def gzip_lines(lines, chunk_size=GZIP_CHUNK_SIZE):
+    compressor = zlib.compressobj(wbits=31)
+    pending = []
+    pending_size = 0
+    for line in lines:
+        compressed = compressor.compress(line.encode("utf-8"))
+        if compressed:
+            pending.append(compressed)
+            pending_size += len(compressed)
+            if pending_size >= chunk_size:
+                yield b"".join(pending)
+                pending = []
+                pending_size = 0
+    pending.append(compressor.flush())
+    yield b"".join(pending)
@@ -0,0 +1,20 @@
+'''
+Configuration profiles of create_app
+
+create_app(test_config) takes the name of one of these profiles, or a
+mapping of settings. Without one, the settings come from the environment
+and the .env file.
+'''
+
+CONFIG_PROFILES = {
+    # In-memory SQLite database and data version, nothing is read from the
+    # environment. The database is empty until migrated (flask_migrate.upgrade)
+    "test": {
+        "TESTING": True,
+        "SQLALCHEMY_DATABASE_URI": "sqlite://",
+        "REPLICA_DATABASE_URIS": [],
+        "DATA_VERSION_FILE": "",
+        "CATALOG_SNAPSHOT_FILE": "",
+        "FUZZY_INDEX_WARM_UP": False,
+    },
+}
@@ -0,0 +1,156 @@
+import queue
+import threading
+import time
+
+from models import db, Question
+
+'''
+Group commit of question creations
+
+Every creation normally commits its own transaction, so a burst of
+creations costs one commit (and one fsync on the database server) each.
+In group commit mode, the creations of the request threads are queued
+and a writer thread inserts them together in one transaction: a batch
+starts with the first waiting creation, and takes the ones queued until
+it has max_batch_size of them or max_wait seconds have passed.
+
+Every caller gets its own question back. When the transaction of the
+batch fails, its questions are inserted again one transaction each, so
+that only the callers whose question failed get the error. A caller
+waits at most timeout seconds: its creation is then cancelled if the
+writer did not take it yet, and GroupCommitTimeout is raised.
+'''
+
+
+class GroupCommitTimeout(Exception):
+    pass
+
+
+class Creation:
+
+    def __init__(self, row):
+        self.row = row
+        self.done = threading.Event()
+        # Taken in a batch by the writer, or given up by its caller
+        self.claimed = False
+        self.cancelled = False
+        self.question = None
+        self.error = None
+
+
+'''
+GroupCommit
+    queue of the question creations of an app, committed in batches by a
+    writer thread started with the first creation
+'''
+class GroupCommit:
+
+    def __init__(self, app, max_batch_size=100, max_wait=0.005, timeout=10):
+        self.app = app
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.batches = 0
+        self.questions = 0
+
+    '''
+    insert(row)
+        queues a question from a (question, answer, category, difficulty)
+        dict, returns its format() once committed or raises its error
+    '''
+    def insert(self, row):
+        with self.lock:
+            # Started with the first creation, and again if it died
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.write, name="group-commit", daemon=True)
+                self.thread.start()
+
+        creation = Creation(row)
+        self.queue.put(creation)
+        if not creation.done.wait(self.timeout):
+            with self.lock:
+                creation.cancelled = not creation.claimed
+            if creation.claimed:
+                # Being committed, the question may be created
+                db.session().wrote = True
+            raise GroupCommitTimeout("Question not committed after {}s".format(self.timeout))
+        # Read your writes: the request wrote, through the writer thread
+        db.session().wrote = True
+        if creation.error is not None:
+            raise creation.error
+        return creation.question
+
+    # Takes a creation in a batch, unless its caller gave up on it
+    def claim(self, creation):
+        with self.lock:
+            creation.claimed = not creation.cancelled
+            return creation.claimed
+
+    def next_batch(self):
+        batch = []
+        while not batch:
+            creation = self.queue.get()
+            if self.claim(creation):
+                batch.append(creation)
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                creation = (self.queue.get(timeout=remaining) if remaining > 0
+                            else self.queue.get_nowait())
+            except queue.Empty:
+                break
+            if self.claim(creation):
+                batch.append(creation)
+        return batch
+
+    def write(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                with self.app.app_context():
+                    try:
+                        self.commit(batch)
+                    finally:
+                        db.session.remove()
+            except Exception as error:
+                self.app.logger.exception("Group commit failed")
+                for creation in batch:
+                    if creation.question is None and creation.error is None:
+                        creation.error = error
+            finally:
+                for creation in batch:
+                    creation.done.set()
+
+    def commit(self, batch):
+        try:
+            questions = Question.commit_many([creation.row for creation in batch])
+        except Exception as error:
+            if len(batch) == 1:
+                batch[0].error = error
+                return
+            # One of them failed, find which
+            for creation in batch:
+                self.commit([creation])
+            return
+
+        for creation, question in zip(batch, questions):
+            creation.question = question
+        with self.lock:
+            self.batches += 1
+            self.questions += len(batch)
+
+        # Committed: the questions are created even if the caches and
+        # indexes cannot be updated, they are never inserted again
+        try:
+            Question.inserted_many(questions)
+        except Exception:
+            self.app.logger.exception("Could not update the indexes after a group commit")
+
+    def stats(self):
+        with self.lock:
+            return {'batches': self.batches, 'questions': self.questions}
@@ -0,0 +1,267 @@
+import bisect
+import threading
+import time
+
+from flask import current_app, g, request, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import db
+
+'''
+Request metrics
+
+Every request records its latency and the number and duration of the SQL
+queries it ran (counted with SQLAlchemy engine events). The time spent
+checking connections out of the pools, and the counters of the caches,
+are collected too. Everything is rendered in the Prometheus text format
+by the /metrics endpoint.
+
+Metrics are kept in the memory of each process, so every worker is
+scraped on its own (or aggregated by the scraper).
+
+When a request takes longer than SLOW_REQUEST_SECONDS, its SQL statements
+and their timings are logged.
+'''
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+# Statements longer than this are cut in the slow request log
+MAX_LOGGED_STATEMENT_LENGTH = 500
+
+
+def format_labels(labelnames, labels):
+    if not labelnames:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(
+        name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, labels)) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+'''
+Counter
+    value by labels, only increasing
+'''
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield self.name + format_labels(self.labelnames, labels), value
+
+
+'''
+Histogram
+    cumulative buckets, sum and count of the observed values by labels
+'''
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labelnames = labelnames
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def observe(self, value, labels=()):
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                # Counts per bucket, then +Inf, then the sum
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[position] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted((labels, list(counts)) for labels, counts in self.values.items())
+        labelnames = self.labelnames + ("le",)
+        for labels, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                yield self.name + "_bucket" + format_labels(
+                    labelnames, labels + (format_value(bound),)), total
+            yield self.name + "_sum" + format_labels(self.labelnames, labels), counts[-1]
+            yield self.name + "_count" + format_labels(self.labelnames, labels), total
+
+
+'''
+CollectedMetric
+    gauge or counter kept elsewhere, read when the metrics are rendered by
+    a function returning (labels, value) pairs
+'''
+class CollectedMetric:
+
+    def __init__(self, name, help, type, read, labelnames=()):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.read = read
+        self.labelnames = labelnames
+
+    def samples(self):
+        for labels, value in self.read():
+            yield self.name + format_labels(self.labelnames, labels), value
+
+
+'''
+RequestMetrics
+    queries of the current request, kept in g.request_metrics
+'''
+class RequestMetrics:
+
+    def __init__(self, keep_statements):
+        self.started_at = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.keep_statements = keep_statements
+        self.statements = []
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if has_request_context() and "request_metrics" in g:
+        connection.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    started_at = connection.info.get("query_started_at")
+    if not started_at or not has_request_context() or "request_metrics" not in g:
+        return
+    seconds = time.perf_counter() - started_at.pop()
+    request_metrics = g.request_metrics
+    request_metrics.queries += 1
+    request_metrics.query_seconds += seconds
+    if request_metrics.keep_statements:
+        request_metrics.statements.append((seconds, statement))
+
+
+'''
+Metrics
+    metrics of an app, registered with init_app(app)
+'''
+class Metrics:
+
+    def __init__(self):
+        self.metrics = []
+        # Pool currently used by each bind, by name
+        self.pools = {}
+        self.pools_lock = threading.Lock()
+        self.requests = self.add(Counter(
+            "trivia_requests_total", "Requests by route and status",
+            ("method", "route", "status")))
+        self.request_seconds = self.add(Histogram(
+            "trivia_request_duration_seconds", "Request latency by route",
+            LATENCY_BUCKETS, ("method", "route")))
+        self.request_queries = self.add(Histogram(
+            "trivia_request_queries", "SQL queries per request by route",
+            QUERY_COUNT_BUCKETS, ("method", "route")))
+        self.request_query_seconds = self.add(Histogram(
+            "trivia_request_query_duration_seconds", "Time spent in SQL queries per request by route",
+            LATENCY_BUCKETS, ("method", "route")))
+        self.pool_checkout_seconds = self.add(Histogram(
+            "trivia_db_pool_checkout_duration_seconds",
+            "Time to check a connection out of a pool, waits and new connections included",
+            LATENCY_BUCKETS, ("pool",)))
+        self.add(CollectedMetric(
+            "trivia_db_pool_checked_out", "Connections checked out of a pool",
+            "gauge", self.checked_out_connections, ("pool",)))
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def init_app(self, app):
+        app.extensions["metrics"] = self
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def instrument_pool(self, name, pool):
+        # The engine replaces its pool when disposed, every pool is timed
+        with self.pools_lock:
+            if self.pools.get(name) is pool:
+                return
+            self.pools[name] = pool
+
+        connect = pool.connect
+        histogram = self.pool_checkout_seconds
+
+        def timed_connect():
+            started_at = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                histogram.observe(time.perf_counter() - started_at, (name,))
+        pool.connect = timed_connect
+
+    def checked_out_connections(self):
+        with self.pools_lock:
+            pools = sorted(self.pools.items())
+        return [((name,), pool.checkedout())
+                for name, pool in pools if hasattr(pool, "checkedout")]
+
+    def before_request(self):
+        for bind in [None] + list(current_app.config.get("SQLALCHEMY_BINDS") or {}):
+            engine = db.get_engine(current_app, bind=bind)
+            self.instrument_pool(bind or "primary", engine.pool)
+        g.request_metrics = RequestMetrics(
+            keep_statements=bool(current_app.config["SLOW_REQUEST_SECONDS"]))
+
+    def after_request(self, response):
+        request_metrics = g.pop("request_metrics", None)
+        if request_metrics is None:
+            return response
+        seconds = time.perf_counter() - request_metrics.started_at
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        labels = (request.method, route)
+
+        self.requests.inc(labels + (response.status_code,))
+        self.request_seconds.observe(seconds, labels)
+        self.request_queries.observe(request_metrics.queries, labels)
+        self.request_query_seconds.observe(request_metrics.query_seconds, labels)
+
+        slow_request_seconds = current_app.config["SLOW_REQUEST_SECONDS"]
+        if slow_request_seconds and seconds >= slow_request_seconds:
+            current_app.logger.warning(
+                "Slow request %s %s: %.1f ms, %d queries in %.1f ms%s",
+                request.method, request.full_path, seconds * 1000,
+                request_metrics.queries, request_metrics.query_seconds * 1000,
+                "".join("\n  {:8.1f} ms  {}".format(
+                    query_seconds * 1000,
+                    " ".join(statement.split())[:MAX_LOGGED_STATEMENT_LENGTH])
+                    for query_seconds, statement in request_metrics.statements))
+        return response
+
+    # Metrics in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append("# HELP {} {}".format(metric.name, metric.help))
+            lines.append("# TYPE {} {}".format(metric.name, metric.type))
+            for name, value in metric.samples():
+                lines.append("{} {}".format(name, format_value(value)))
+        return "\n".join(lines) + "\n"
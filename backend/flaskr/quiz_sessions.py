@@ -0,0 +1,204 @@
+import json
+import secrets
+from abc import ABC, abstractmethod
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+'''
+Quiz sessions
+
+A quiz session holds a shuffled deck of question ids for one game, so the
+client does not have to send previous_questions back on every request and
+the server only pops the next id from the deck. The deck is as long as a
+game, not as the category, so starting a session costs the same whatever
+the number of questions.
+
+A store implements create(question_ids), pop(token) and delete(token).
+pop returns the next question id (None once the deck is empty) and the
+number of ids left, and raises KeyError when the session does not exist
+or has expired. Sessions expire ttl seconds after their last use.
+'''
+
+
+class QuizSessionStore(ABC):
+
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+
+    def new_token(self):
+        return secrets.token_urlsafe(16)
+
+    @abstractmethod
+    def create(self, question_ids):
+        pass
+
+    @abstractmethod
+    def pop(self, token):
+        pass
+
+    @abstractmethod
+    def delete(self, token):
+        pass
+
+
+# Default store, sessions live in the memory of the process
+class MemoryQuizSessionStore(QuizSessionStore):
+
+    def __init__(self, ttl=3600):
+        super().__init__(ttl)
+        self.lock = threading.Lock()
+        # token -> (deck, expires_at), least recently used first
+        self.sessions = OrderedDict()
+
+    def evict_expired(self, now):
+        while self.sessions:
+            token, (deck, expires_at) = next(iter(self.sessions.items()))
+            if expires_at > now:
+                break
+            del self.sessions[token]
+
+    def create(self, question_ids):
+        token = self.new_token()
+        now = time.monotonic()
+        # Deck is reversed so that popping from the end keeps the order
+        deck = list(reversed(question_ids))
+        with self.lock:
+            self.evict_expired(now)
+            self.sessions[token] = (deck, now + self.ttl)
+        return token
+
+    def pop(self, token):
+        now = time.monotonic()
+        with self.lock:
+            self.evict_expired(now)
+            deck, expires_at = self.sessions[token]
+            self.sessions[token] = (deck, now + self.ttl)
+            self.sessions.move_to_end(token)
+            question_id = deck.pop() if deck else None
+            return question_id, len(deck)
+
+    def delete(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+
+
+# Store backed by an SQLite file, shared by the workers of one host
+class SQLiteQuizSessionStore(QuizSessionStore):
+
+    def __init__(self, path, ttl=3600):
+        super().__init__(ttl)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None)
+        self.connection.executescript('''
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS quiz_sessions (
+                token TEXT PRIMARY KEY,
+                position INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL NOT NULL);
+            CREATE INDEX IF NOT EXISTS ix_quiz_sessions_expires_at
+                ON quiz_sessions (expires_at);
+            CREATE TABLE IF NOT EXISTS quiz_session_cards (
+                token TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                question_id INTEGER NOT NULL,
+                PRIMARY KEY (token, position)) WITHOUT ROWID;
+        ''')
+
+    def evict_expired(self, now):
+        expired = "SELECT token FROM quiz_sessions WHERE expires_at <= ?"
+        self.connection.execute(
+            "DELETE FROM quiz_session_cards WHERE token IN ({})".format(expired),
+            (now,))
+        self.connection.execute(
+            "DELETE FROM quiz_sessions WHERE expires_at <= ?", (now,))
+
+    def create(self, question_ids):
+        token = self.new_token()
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.evict_expired(now)
+                self.connection.execute(
+                    "INSERT INTO quiz_sessions VALUES (?, 0, ?, ?)",
+                    (token, len(question_ids), now + self.ttl))
+                self.connection.executemany(
+                    "INSERT INTO quiz_session_cards VALUES (?, ?, ?)",
+                    [(token, position, question_id)
+                     for position, question_id in enumerate(question_ids)])
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return token
+
+    def pop(self, token):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                session = self.connection.execute(
+                    "SELECT position, size FROM quiz_sessions "
+                    "WHERE token = ? AND expires_at > ?", (token, now)).fetchone()
+                if session is None:
+                    raise KeyError(token)
+                position, size = session
+                card = self.connection.execute(
+                    "SELECT question_id FROM quiz_session_cards "
+                    "WHERE token = ? AND position = ?", (token, position)).fetchone()
+                if card is not None:
+                    position += 1
+                self.connection.execute(
+                    "UPDATE quiz_sessions SET position = ?, expires_at = ? "
+                    "WHERE token = ?", (position, now + self.ttl, token))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return (card[0] if card else None), size - position
+
+    def delete(self, token):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM quiz_session_cards WHERE token = ?", (token,))
+            self.connection.execute(
+                "DELETE FROM quiz_sessions WHERE token = ?", (token,))
+
+
+# Store for a Redis client (redis-py, or a local stand-in with the same
+# list and key commands). Expiry is left to Redis.
+class RedisQuizSessionStore(QuizSessionStore):
+
+    def __init__(self, client, ttl=3600, prefix="quiz:session:"):
+        super().__init__(ttl)
+        self.client = client
+        self.prefix = prefix
+
+    def keys(self, token):
+        return self.prefix + token + ":deck", self.prefix + token + ":alive"
+
+    def create(self, question_ids):
+        token = self.new_token()
+        deck_key, alive_key = self.keys(token)
+        self.client.set(alive_key, json.dumps(len(question_ids)), ex=self.ttl)
+        if question_ids:
+            self.client.rpush(deck_key, *question_ids)
+            self.client.expire(deck_key, self.ttl)
+        return token
+
+    def pop(self, token):
+        deck_key, alive_key = self.keys(token)
+        if not self.client.expire(alive_key, self.ttl):
+            raise KeyError(token)
+        question_id = self.client.lpop(deck_key)
+        remaining = self.client.llen(deck_key)
+        if remaining:
+            self.client.expire(deck_key, self.ttl)
+        return (int(question_id) if question_id is not None else None), remaining
+
+    def delete(self, token):
+        self.client.delete(*self.keys(token))
@@ -0,0 +1,85 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .serialization import encode_json
+
+'''
+Search result cache
+
+A few search terms make most of the searches, so the pages of results
+are cached by normalized term and page (or cursor). The cache is bounded
+in number of entries and in bytes (size of the results encoded as JSON),
+least recently used entries are evicted first, and entries expire after
+ttl seconds.
+
+Every entry belongs to a data version (models.data_version), which is
+bumped by every write to the questions. A lookup with a newer version
+empties the cache, and results computed under an older version are not
+stored, so a search never returns results from before a write.
+'''
+
+
+class SearchCache:
+
+    def __init__(self, max_entries=1000, max_bytes=16 * 1024 * 1024, ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # key -> (results, size, expires_at), least recently used first
+        self.entries = OrderedDict()
+        self.version = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self, version):
+        self.entries.clear()
+        self.size = 0
+        self.version = version
+
+    def get(self, key, version):
+        now = time.monotonic()
+        with self.lock:
+            if version != self.version:
+                self.clear(version)
+            entry = self.entries.get(key)
+            if entry is None or entry[2] <= now:
+                if entry is not None:
+                    del self.entries[key]
+                    self.size -= entry[1]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, version, results):
+        size = len(encode_json(results))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            # Computed before a write, the results may be stale already
+            if version != self.version:
+                return
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            self.entries[key] = (results, size, time.monotonic() + self.ttl)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                evicted_key, (evicted, evicted_size, expires_at) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.size,
+            }
@@ -0,0 +1,71 @@
+import json
+
+from flask.json.provider import DefaultJSONProvider
+
+from models import Question
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''
+Serialization of list responses
+
+Lists of questions are read as plain column tuples (SQLAlchemy rows, which
+are lightweight named tuples) instead of ORM objects, so no identity map
+entry or instance state is built for each row. Responses are encoded with
+orjson when it is installed, else with the standard json module.
+'''
+
+QUESTION_FIELDS = ("id", "question", "answer", "category", "difficulty")
+QUESTION_COLUMNS = (
+    Question.id,
+    Question.question,
+    Question.answer,
+    Question.category,
+    Question.difficulty,
+)
+
+
+# Turns a query of questions into a query of column tuples
+def project_questions(selection):
+    return selection.with_entities(*QUESTION_COLUMNS)
+
+
+# Same dict as Question.format(), built from a column tuple
+def format_question_row(row):
+    return dict(zip(QUESTION_FIELDS, row))
+
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+    def encode_json(obj, default=None):
+        return orjson.dumps(obj, default=default, option=ORJSON_OPTIONS)
+else:
+    def encode_json(obj, default=None):
+        return json.dumps(
+            obj, default=default, sort_keys=True,
+            separators=(",", ":")).encode("utf-8")
+
+
+'''
+FastJSONProvider
+    JSON provider of the app, used by jsonify. Encodes with encode_json and
+    builds the response from the encoded bytes directly. Falls back to the
+    default provider for pretty printing (debug mode) and custom options.
+'''
+class FastJSONProvider(DefaultJSONProvider):
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return encode_json(obj, self.default).decode("utf-8")
+
+    def response(self, *args, **kwargs):
+        if self._app.debug or self.compact is False:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            encode_json(obj, self.default) + b"\n", mimetype=self.mimetype)
@@ -0,0 +1,96 @@
+import functools
+import threading
+
+from flask import current_app, g, make_response, request
+
+from models import data_version
+
+'''
+Single-flight request coalescing
+
+When many identical reads arrive at once (cold caches, or right after a
+write), only the first one computes its response. The others, in other
+threads of the process, wait for it and get a copy of the same response,
+so the database sees the query once.
+
+Calls are identified by a key, which includes the data version: a
+request arriving after a write never waits for a computation started
+before it. Errors (aborts included) are raised in every waiting request.
+'''
+
+
+class Call:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+'''
+SingleFlight
+    in-flight calls by key, and the number of calls computed and
+    coalesced by labels (method and route)
+'''
+class SingleFlight:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.counts = {}
+
+    def count(self, labels):
+        self.counts[labels] = self.counts.get(labels, 0) + 1
+
+    '''
+    do(labels, key, compute)
+        returns compute(), or the result of the call of compute with the
+        same key running in another thread
+    '''
+    def do(self, labels, key, compute):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+            self.count(labels + ("leader" if leader else "coalesced",))
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = compute()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+# Decorator used to coalesce the identical concurrent requests of a read
+# view, by URL. Reads from the primary and from the replicas are not
+# mixed, so that a client reading its own writes is never given a
+# response read from a replica.
+def single_flight(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        def compute():
+            response = make_response(view(*args, **kwargs))
+            return response.status_code, list(response.headers), response.get_data()
+
+        key = (request.method, request.full_path, data_version.current()[0],
+               g.get("replica_bind") is None)
+        status, headers, body = current_app.extensions["single_flight"].do(
+            (request.method, request.url_rule.rule), key, compute)
+        return current_app.response_class(body, status=status, headers=headers)
+    return wrapper
@@ -0,0 +1,46 @@
+"""initial schema
+
+Revision ID: 40ed020c6db5
+Revises: 
+Create Date: 2026-10-18 09:12:41.508112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '40ed020c6db5'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# Databases restored from trivia.psql already have both tables, they are
+# only created when missing so that `flask db upgrade` works on them too
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+
+    if not inspector.has_table('categories'):
+        op.create_table(
+            'categories',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('type', sa.String(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if not inspector.has_table('questions'):
+        op.create_table(
+            'questions',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('question', sa.String(), nullable=True),
+            sa.Column('answer', sa.String(), nullable=True),
+            sa.Column('category', sa.Integer(), nullable=True),
+            sa.Column('difficulty', sa.Integer(), nullable=True),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+
+def downgrade():
+    op.drop_table('questions')
+    op.drop_table('categories')
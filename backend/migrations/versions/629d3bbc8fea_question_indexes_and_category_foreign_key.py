@@ -0,0 +1,51 @@
+"""question indexes and category foreign key
+
+Revision ID: 629d3bbc8fea
+Revises: 40ed020c6db5
+Create Date: 2026-10-18 09:14:03.217645
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '629d3bbc8fea'
+down_revision = '40ed020c6db5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    has_category_foreign_key = any(
+        foreign_key['constrained_columns'] == ['category']
+        for foreign_key in inspector.get_foreign_keys('questions'))
+
+    # (category, id) also serves the lookups on category alone
+    op.create_index(
+        'ix_questions_category_id', 'questions', ['category', 'id'], unique=False)
+    op.create_index(
+        'ix_questions_difficulty', 'questions', ['difficulty'], unique=False)
+
+    # trivia.psql already declares this foreign key (named "category")
+    if not has_category_foreign_key:
+        with op.batch_alter_table('questions') as batch_op:
+            batch_op.create_foreign_key(
+                'fk_questions_category_categories', 'categories',
+                ['category'], ['id'], onupdate='CASCADE', ondelete='SET NULL')
+
+
+def downgrade():
+    inspector = sa.inspect(op.get_bind())
+    foreign_key_names = [
+        foreign_key['name']
+        for foreign_key in inspector.get_foreign_keys('questions')]
+
+    if 'fk_questions_category_categories' in foreign_key_names:
+        with op.batch_alter_table('questions') as batch_op:
+            batch_op.drop_constraint(
+                'fk_questions_category_categories', type_='foreignkey')
+
+    op.drop_index('ix_questions_difficulty', table_name='questions')
+    op.drop_index('ix_questions_category_id', table_name='questions')
@@ -0,0 +1,35 @@
+"""question counts
+
+Revision ID: a8db951ac7cb
+Revises: ef830f38dec7
+Create Date: 2026-10-18 09:17:52.664018
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8db951ac7cb'
+down_revision = 'ef830f38dec7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'question_counts',
+        sa.Column('category', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('difficulty', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('category', 'difficulty')
+    )
+    # Count the questions already in the database
+    op.execute(
+        "INSERT INTO question_counts (category, difficulty, count) "
+        "SELECT coalesce(category, 0), coalesce(difficulty, 0), count(*) "
+        "FROM questions GROUP BY coalesce(category, 0), coalesce(difficulty, 0)")
+
+
+def downgrade():
+    op.drop_table('question_counts')
@@ -0,0 +1,48 @@
+"""question trigram indexes
+
+Revision ID: c3f1b7d92e4a
+Revises: a8db951ac7cb
+Create Date: 2026-10-18 14:02:51.114208
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3f1b7d92e4a'
+down_revision = 'a8db951ac7cb'
+branch_labels = None
+depends_on = None
+
+
+POSTGRES_UPGRADE = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX IF NOT EXISTS ix_questions_question_trgm
+       ON questions USING gin (question gin_trgm_ops)""",
+    """CREATE INDEX IF NOT EXISTS ix_questions_answer_trgm
+       ON questions USING gin (answer gin_trgm_ops)""",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_questions_answer_trgm",
+    "DROP INDEX IF EXISTS ix_questions_question_trgm",
+]
+
+
+def upgrade():
+    # Without pg_trgm on the server, fuzzy search uses the in-process index
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+    available = bind.execute(sa.text(
+        "SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar()
+    if available:
+        for statement in POSTGRES_UPGRADE:
+            op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for statement in POSTGRES_DOWNGRADE:
+            op.execute(statement)
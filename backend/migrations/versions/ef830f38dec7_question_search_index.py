@@ -0,0 +1,68 @@
+"""question search index
+
+Revision ID: ef830f38dec7
+Revises: 629d3bbc8fea
+Create Date: 2026-10-18 09:15:27.930412
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ef830f38dec7'
+down_revision = '629d3bbc8fea'
+branch_labels = None
+depends_on = None
+
+
+POSTGRES_UPGRADE = [
+    """ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector
+       GENERATED ALWAYS AS (to_tsvector('simple', coalesce(question, ''))) STORED""",
+    """CREATE INDEX IF NOT EXISTS ix_questions_search_vector
+       ON questions USING gin (search_vector)""",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_questions_search_vector",
+    "ALTER TABLE questions DROP COLUMN IF EXISTS search_vector",
+]
+
+SQLITE_UPGRADE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts
+       USING fts5(question, content='questions', content_rowid='id')""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+         INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+         INSERT INTO questions_fts(questions_fts, rowid, question)
+         VALUES ('delete', old.id, old.question);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF question ON questions BEGIN
+         INSERT INTO questions_fts(questions_fts, rowid, question)
+         VALUES ('delete', old.id, old.question);
+         INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question);
+       END""",
+    "INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS questions_fts_update",
+    "DROP TRIGGER IF EXISTS questions_fts_delete",
+    "DROP TRIGGER IF EXISTS questions_fts_insert",
+    "DROP TABLE IF EXISTS questions_fts",
+]
+
+
+def run(statements):
+    dialect = op.get_bind().dialect.name
+    for statement in statements.get(dialect, []):
+        op.execute(statement)
+
+
+def upgrade():
+    run({'postgresql': POSTGRES_UPGRADE, 'sqlite': SQLITE_UPGRADE})
+
+
+def downgrade():
+    run({'postgresql': POSTGRES_DOWNGRADE, 'sqlite': SQLITE_DOWNGRADE})
@@ -1,91 +1,1546 @@
-import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
-import json
-from dotenv import load_dotenv
-load_dotenv()
-
-# database_name = "trivia"
-# database_path = "postgresql://{}:{}@{}/{}".format(
-#     "postgres", "", "localhost:5432", DB_NAME
-# )
-DB_HOST = os.getenv('DB_HOST', '127.0.0.1:5432')
-DB_USER = os.getenv('DB_USER', 'postgres')
-DB_PASSWORD = os.getenv('DB_PASSWORD', '')
-DB_NAME = os.getenv('DB_NAME', 'trivia')
-DB_PATH = "postgresql://{}:{}@{}/{}".format(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
-
-db = SQLAlchemy()
-
-'''
-setup_db(app)
-    binds a flask application and a SQLAlchemy service
-'''
-def setup_db(app, database_path=DB_PATH):
-    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
-    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    db.app = app
-    db.init_app(app)
-    db.create_all()
-
-'''
-Question
-
-'''
-class Question(db.Model):  
-  __tablename__ = 'questions'
-
-  id = Column(Integer, primary_key=True)
-  question = Column(String)
-  answer = Column(String)
-  category = Column(Integer)
-  difficulty = Column(Integer)
-
-  def __init__(self, question, answer, category, difficulty):
-    self.question = question
-    self.answer = answer
-    self.category = category
-    self.difficulty = difficulty
-
-  def insert(self):
-    db.session.add(self)
-    db.session.commit()
-  
-  def update(self):
-    db.session.commit()
-
-  def delete(self):
-    db.session.delete(self)
-    db.session.commit()
-
-  def format(self):
-    return {
-      'id': self.id,
-      'question': self.question,
-      'answer': self.answer,
-      'category': self.category,
-      'difficulty': self.difficulty
-    }
-
-'''
-Category
-
-'''
-class Category(db.Model):  
-  __tablename__ = 'categories'
-
-  id = Column(Integer, primary_key=True)
-  type = Column(String)
-
-  def __init__(self, type):
-    self.type = type
-  
-  def insert(self):
-    db.session.add(self)
-    db.session.commit()
-
-  def format(self):
-    return {
-      'id': self.id,
-      'type': self.type
-    }
\ No newline at end of file
+import os
+import re
+import time
+import fcntl
+import mmap
+import struct
+import tempfile
+import random
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from sqlalchemy import Column, String, Integer, Float, ForeignKey, Index, Table, MetaData, create_engine
+from sqlalchemy import delete, false, func, inspect, literal, literal_column, or_, select, text, orm
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from flask_migrate import Migrate
+import json
+
+# database_name = "trivia"
+# database_path = "postgresql://{}:{}@{}/{}".format(
+#     "postgres", "", "localhost:5432", DB_NAME
+# )
+
+'''
+environment_database_paths()
+    returns the URI of the database and the URIs of its read replicas from
+    the environment: DB_HOST, DB_USER, DB_PASSWORD, DB_NAME, and
+    DB_REPLICA_HOSTS, comma separated hosts with the same user, password
+    and database name as the primary
+'''
+def environment_database_paths():
+    user = os.getenv('DB_USER', 'postgres')
+    password = os.getenv('DB_PASSWORD', '')
+    name = os.getenv('DB_NAME', 'trivia')
+    hosts = [os.getenv('DB_HOST', '127.0.0.1:5432')] + [
+        host for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host]
+    paths = ["postgresql://{}:{}@{}/{}".format(user, password, host, name) for host in hosts]
+    return paths[0], paths[1:]
+
+# File holding the data version shared by the workers of one host, empty
+# to keep the version in the memory of the process
+def environment_data_version_file():
+    return os.getenv('DATA_VERSION_FILE', os.path.join(
+        tempfile.gettempdir(), 'trivia-{}.version'.format(os.getenv('DB_NAME', 'trivia'))))
+
+# Maximum number of ids in the IN list of a single DELETE statement
+DELETE_CHUNK_SIZE = 500
+MIGRATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+'''
+RoutingSession
+
+Session sending the reads of read-only requests to a replica. A request
+is routed to a replica by setting g.replica_bind to the bind key of one
+of the replicas. Writes (flushes, INSERT/UPDATE/DELETE and raw SQL) always
+go to the primary, and once a session wrote, all its reads go to the
+primary too so that it reads its own writes. A statement executed with
+bind_arguments={'primary': True} is read from the primary.
+'''
+class RoutingSession(SignallingSession):
+
+  def __init__(self, db, **options):
+    self.db = db
+    self.wrote = False
+    SignallingSession.__init__(self, db, **options)
+
+  def get_bind(self, mapper=None, clause=None, primary=False, **kwargs):
+    if self._flushing or isinstance(clause, (UpdateBase, TextClause)):
+      self.wrote = True
+    replica_bind = g.get('replica_bind') if has_app_context() else None
+    if replica_bind is not None and not self.wrote and not primary:
+      return self.db.get_engine(self.app, bind=replica_bind)
+    return SignallingSession.get_bind(self, mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+db = RoutingSQLAlchemy()
+migrate = Migrate()
+
+'''
+setup_db(app)
+    binds a flask application and a SQLAlchemy service, and the read
+    replicas as binds replica_0, replica_1...
+    the schema is created and upgraded by the migrations (`flask db upgrade`)
+    the database, replicas, data version file and catalog snapshot file
+    default to the SQLALCHEMY_DATABASE_URI, REPLICA_DATABASE_URIS,
+    DATA_VERSION_FILE and CATALOG_SNAPSHOT_FILE settings of the app, else
+    to the environment. No engine is created
+    before the first query.
+'''
+def setup_db(app, database_path=None, replica_paths=None):
+    if database_path is None or replica_paths is None:
+        environment_path, environment_replica_paths = environment_database_paths()
+        if database_path is None:
+            database_path = app.config.get("SQLALCHEMY_DATABASE_URI") or environment_path
+        if replica_paths is None:
+            replica_paths = app.config.get("REPLICA_DATABASE_URIS")
+            if replica_paths is None:
+                replica_paths = environment_replica_paths
+    data_version.path = app.config.setdefault(
+        "DATA_VERSION_FILE", environment_data_version_file()) or None
+    catalog_snapshot.path = app.config.setdefault(
+        "CATALOG_SNAPSHOT_FILE", environment_catalog_snapshot_file()) or None
+    catalog_snapshot.max_age = app.config.setdefault(
+        "CATALOG_SNAPSHOT_MAX_AGE", float(os.getenv('CATALOG_SNAPSHOT_MAX_AGE', 300)))
+    catalog_snapshot.check_seconds = app.config.setdefault(
+        "CATALOG_SNAPSHOT_CHECK_SECONDS", float(os.getenv('CATALOG_SNAPSHOT_CHECK_SECONDS', 5)))
+
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    app.config["REPLICA_DATABASE_URIS"] = list(replica_paths)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_BINDS"] = {
+        'replica_{}'.format(number): path
+        for number, path in enumerate(replica_paths)}
+    app.config["REPLICA_BINDS"] = sorted(app.config["SQLALCHEMY_BINDS"])
+    db.app = app
+    db.init_app(app)
+    migrate.init_app(app, db, directory=MIGRATIONS_PATH, render_as_batch=True)
+
+'''
+Full-text search index on questions.question
+
+On Postgres a generated tsvector column with a GIN index, on SQLite an
+external content FTS5 table kept in sync by triggers. Both are created by
+the migrations (ef830f38dec7), the only definition of their DDL.
+'''
+# Mirror of the FTS5 table, kept out of db.metadata so create_all ignores it
+questions_fts = Table(
+    'questions_fts', MetaData(),
+    Column('rowid', Integer),
+    Column('question', String),
+    Column('rank', Float))
+
+'''
+search_questions(search_term, ranked=True)
+    returns a query of the questions matching every word of search_term
+    (as a prefix), best matches first when ranked, else ordered by id
+'''
+def search_words(search_term):
+    return re.findall(r'[^\W_]+', search_term.lower())
+
+'''
+search_clauses(search_term, words, dialect)
+    returns (join, condition, rank) to search questions on a dialect: join
+    is None or the (table, onclause) to join, rank None when unranked
+'''
+def search_clauses(search_term, words, dialect):
+    if dialect == 'postgresql':
+        ts_query = func.to_tsquery(
+            'simple', ' & '.join('{}:*'.format(word) for word in words))
+        search_vector = literal_column('questions.search_vector')
+        return (None, search_vector.op('@@')(ts_query),
+                func.ts_rank(search_vector, ts_query).desc())
+    if dialect == 'sqlite':
+        fts_query = ' '.join('"{}"*'.format(word) for word in words)
+        # FTS5 rank is bm25, lower is better
+        return ((questions_fts, questions_fts.c.rowid == Question.id),
+                literal_column('questions_fts').op('MATCH')(fts_query),
+                questions_fts.c.rank)
+    return (None, Question.question.ilike("%{}%".format(search_term)), None)
+
+def search_questions(search_term, ranked=True):
+    words = search_words(search_term)
+    if not words:
+        return Question.query.filter(false())
+
+    join, condition, rank = search_clauses(
+        search_term, words, db.engine.dialect.name)
+    selection = Question.query
+    if join is not None:
+        selection = selection.join(*join)
+    selection = selection.filter(condition)
+
+    if ranked and rank is not None:
+        return selection.order_by(rank, Question.id)
+    return selection.order_by(Question.id)
+
+# Engines on which the pg_trgm extension is installed, by URL
+trigram_extensions = {}
+
+def has_trigram_extension():
+    engine = db.engine
+    if engine.dialect.name != 'postgresql':
+        return False
+    key = str(engine.url)
+    if key not in trigram_extensions:
+        with engine.connect() as connection:
+            trigram_extensions[key] = connection.execute(text(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None
+    return trigram_extensions[key]
+
+'''
+fuzzy_search_questions(search_term, threshold, ranked=True)
+    returns a query of the questions whose question or answer contains
+    words similar to search_term (pg_trgm word similarity of at least
+    threshold), most similar first when ranked, else ordered by id.
+    Returns None where pg_trgm is not installed, question_text_index
+    searches instead.
+'''
+def fuzzy_search_questions(search_term, threshold, ranked=True):
+    if not has_trigram_extension():
+        return None
+
+    # Threshold of the <% operator, for the current transaction only
+    db.session.execute(select(func.set_config(
+        'pg_trgm.word_similarity_threshold', str(threshold), True)))
+    term = literal(search_term)
+    selection = Question.query.filter(or_(
+        term.op('<%')(Question.question), term.op('<%')(Question.answer)))
+
+    if ranked:
+        similarity = func.greatest(
+            func.word_similarity(term, Question.question),
+            func.word_similarity(term, Question.answer))
+        return selection.order_by(similarity.desc(), Question.id)
+    return selection.order_by(Question.id)
+
+'''
+Question
+
+'''
+class Question(db.Model):  
+  __tablename__ = 'questions'
+
+  id = Column(Integer, primary_key=True)
+  question = Column(String)
+  answer = Column(String)
+  category = Column(Integer, ForeignKey(
+    'categories.id', name='fk_questions_category_categories',
+    onupdate='CASCADE', ondelete='SET NULL'))
+  difficulty = Column(Integer)
+
+  # (category, id) serves the category filters and keyset pagination in them
+  __table_args__ = (
+    Index('ix_questions_category_id', 'category', 'id'),
+    Index('ix_questions_difficulty', 'difficulty'),
+  )
+
+  def __init__(self, question, answer, category, difficulty):
+    self.question = question
+    self.answer = answer
+    self.category = category
+    self.difficulty = difficulty
+
+  def insert(self):
+    db.session.add(self)
+    QuestionCount.add(self.category, self.difficulty, 1)
+    db.session.commit()
+    data_version.bump()
+    catalog_snapshot.invalidate()
+    question_id_index.add(self.id, self.category)
+    question_text_index.add(self.id, self.question, self.answer)
+
+  '''
+  insert_many(rows)
+      inserts questions from (question, answer, category, difficulty)
+      dicts in one transaction, returns the format() of each question
+  '''
+  @staticmethod
+  def insert_many(rows):
+    created = Question.commit_many(rows)
+    Question.inserted_many(created)
+    return created
+
+  '''
+  commit_many(rows)
+      the transaction of insert_many, raises only when it is not committed
+  '''
+  @staticmethod
+  def commit_many(rows):
+    questions = [Question(**row) for row in rows]
+    try:
+      db.session.add_all(questions)
+      QuestionCount.add_rows(rows)
+      db.session.flush()
+      # Read before the commit expires them
+      created = [question.format() for question in questions]
+      db.session.commit()
+    except BaseException:
+      db.session.rollback()
+      raise
+    return created
+
+  '''
+  inserted_many(created)
+      updates the data version and the indexes after commit_many
+  '''
+  @staticmethod
+  def inserted_many(created):
+    data_version.bump()
+    catalog_snapshot.invalidate()
+    for question in created:
+      question_id_index.add(question['id'], question['category'])
+      question_text_index.add(question['id'], question['question'], question['answer'])
+  
+  def update(self):
+    # Move the question between counters if its category or difficulty changed
+    state = inspect(self)
+    category = state.attrs.category.history
+    difficulty = state.attrs.difficulty.history
+    if category.has_changes() or difficulty.has_changes():
+      QuestionCount.add(
+        (category.deleted or category.unchanged or [None])[0],
+        (difficulty.deleted or difficulty.unchanged or [None])[0], -1)
+      QuestionCount.add(self.category, self.difficulty, 1)
+    # Texts before and after the update, for the text index
+    question = state.attrs.question.history
+    answer = state.attrs.answer.history
+    old_texts = ((question.deleted or question.unchanged or [None])[0],
+                 (answer.deleted or answer.unchanged or [None])[0])
+    new_texts = (self.question, self.answer)
+    db.session.commit()
+    data_version.bump()
+    catalog_snapshot.invalidate()
+    # The category may have changed, let the index reload
+    question_id_index.reset()
+    if old_texts != new_texts:
+      question_text_index.remove(self.id, *old_texts)
+      question_text_index.add(self.id, *new_texts)
+
+  def delete(self):
+    db.session.delete(self)
+    QuestionCount.add(self.category, self.difficulty, -1)
+    db.session.commit()
+    data_version.bump()
+    catalog_snapshot.invalidate()
+    question_id_index.remove(self.id, self.category)
+    question_text_index.remove(self.id, self.question, self.answer)
+
+  '''
+  delete_many(ids, category, difficulty)
+      deletes the questions matching all the given criteria with set-based
+      DELETE statements in one transaction, returns the number deleted
+  '''
+  @staticmethod
+  def delete_many(ids=None, category=None, difficulty=None):
+    criteria = []
+    if category is not None:
+      criteria.append(Question.category == category)
+    if difficulty is not None:
+      criteria.append(Question.difficulty == difficulty)
+
+    try:
+      if ids is None:
+        deleted = Question.delete_counted(criteria)
+      else:
+        # Ids are sent in chunks to stay under the bound parameters limit
+        ids = list(ids)
+        deleted = 0
+        for start in range(0, len(ids), DELETE_CHUNK_SIZE):
+          chunk = ids[start:start + DELETE_CHUNK_SIZE]
+          deleted += Question.delete_counted(criteria + [Question.id.in_(chunk)])
+      db.session.commit()
+    except BaseException:
+      db.session.rollback()
+      raise
+
+    if deleted:
+      data_version.bump()
+      catalog_snapshot.invalidate()
+      question_id_index.reset()
+      question_text_index.invalidate()
+    return deleted
+
+  '''
+  delete_counted(criteria)
+      deletes the questions matching criteria and removes them from the
+      counters, counting the very rows deleted: with DELETE ... RETURNING
+      on Postgres, and after taking the write lock on SQLite, so that no
+      write commits between the count and the delete
+  '''
+  @staticmethod
+  def delete_counted(criteria):
+    if db.session.get_bind().dialect.name == 'postgresql':
+      deleted = delete(Question).where(*criteria).returning(
+        Question.category, Question.difficulty).cte('deleted')
+      counts = db.session.execute(select(
+        deleted.c.category, deleted.c.difficulty, func.count()).group_by(
+        deleted.c.category, deleted.c.difficulty), bind_arguments={'primary': True}).all()
+    else:
+      # SQLite serializes the write transactions, a write statement starts one
+      db.session.execute(text('UPDATE question_counts SET count = count WHERE 0'))
+      counts = db.session.query(
+        Question.category, Question.difficulty, func.count(Question.id)).filter(
+        *criteria).group_by(Question.category, Question.difficulty).all()
+      db.session.query(Question).filter(*criteria).delete(synchronize_session=False)
+
+    for category, difficulty, count in counts:
+      QuestionCount.add(category, difficulty, -count)
+    return sum(count for category, difficulty, count in counts)
+
+  def format(self):
+    return {
+      'id': self.id,
+      'question': self.question,
+      'answer': self.answer,
+      'category': self.category,
+      'difficulty': self.difficulty
+    }
+
+'''
+QuestionCount
+
+Number of questions per category and difficulty, kept up to date in the
+same transaction as the writes to the questions table, so totals never
+need to scan it. Questions without category or difficulty are counted
+under 0.
+'''
+class QuestionCount(db.Model):
+  __tablename__ = 'question_counts'
+
+  category = Column(Integer, primary_key=True, autoincrement=False)
+  difficulty = Column(Integer, primary_key=True, autoincrement=False)
+  count = Column(Integer, nullable=False, default=0)
+
+  '''
+  add(category, difficulty, delta)
+      adds delta to a counter in the current transaction
+  '''
+  @staticmethod
+  def add(category, difficulty, delta):
+    db.session.execute(text(
+      "INSERT INTO question_counts (category, difficulty, count) "
+      "VALUES (:category, :difficulty, :delta) "
+      "ON CONFLICT (category, difficulty) "
+      "DO UPDATE SET count = question_counts.count + excluded.count"), {
+      'category': category or 0,
+      'difficulty': difficulty or 0,
+      'delta': delta
+    })
+
+  # Adds the questions of a list of rows (dicts) to the counters
+  @staticmethod
+  def add_rows(rows):
+    counts = Counter((row['category'], row['difficulty']) for row in rows)
+    for (category, difficulty), count in counts.items():
+      QuestionCount.add(category, difficulty, count)
+
+  '''
+  total(category=None)
+      returns the number of questions, of a category when given
+  '''
+  @staticmethod
+  def total(category=None):
+    selection = db.session.query(func.coalesce(func.sum(QuestionCount.count), 0))
+    if category is not None:
+      selection = selection.filter(QuestionCount.category == category)
+    return selection.scalar()
+
+  '''
+  stats()
+      returns the counters by category and by difficulty
+  '''
+  @staticmethod
+  def stats():
+    categories = {}
+    difficulties = {}
+    for counter in QuestionCount.query.filter(QuestionCount.count != 0):
+      category = categories.setdefault(
+        counter.category, {'total_questions': 0, 'difficulties': {}})
+      category['total_questions'] += counter.count
+      category['difficulties'][counter.difficulty] = counter.count
+      difficulties[counter.difficulty] = difficulties.get(
+        counter.difficulty, 0) + counter.count
+    return {
+      'total_questions': sum(difficulties.values()),
+      'categories': categories,
+      'difficulties': difficulties
+    }
+
+  # Recomputes every counter from the questions table
+  @staticmethod
+  def rebuild():
+    db.session.execute(text("DELETE FROM question_counts"))
+    db.session.execute(text(
+      "INSERT INTO question_counts (category, difficulty, count) "
+      "SELECT coalesce(category, 0), coalesce(difficulty, 0), count(*) "
+      "FROM questions GROUP BY coalesce(category, 0), coalesce(difficulty, 0)"))
+    db.session.commit()
+
+'''
+Category
+
+'''
+class Category(db.Model):  
+  __tablename__ = 'categories'
+
+  id = Column(Integer, primary_key=True)
+  type = Column(String)
+
+  def __init__(self, type):
+    self.type = type
+  
+  def insert(self):
+    db.session.add(self)
+    db.session.commit()
+    data_version.bump()
+    catalog_snapshot.invalidate()
+    category_cache.invalidate()
+    question_id_index.add_category(self.id)
+
+  def update(self):
+    db.session.commit()
+    data_version.bump()
+    catalog_snapshot.invalidate()
+    category_cache.invalidate()
+
+  def delete(self):
+    db.session.delete(self)
+    db.session.commit()
+    # The questions of the category lost their category (ON DELETE SET NULL)
+    QuestionCount.rebuild()
+    data_version.bump()
+    catalog_snapshot.invalidate()
+    category_cache.invalidate()
+    question_id_index.reset()
+
+  def format(self):
+    return {
+      'id': self.id,
+      'type': self.type
+    }
+
+'''
+new_data_version()
+    first version of a data version without a file, or whose file was
+    lost: the current time in microseconds, times 1024 plus random bits.
+    A version is then never used again by a restarted process, nor by
+    another host, as long as there are fewer than 1024 writes per
+    microsecond.
+'''
+def new_data_version():
+    return int(time.time() * 1000000) * 1024 + random.randrange(1024)
+
+'''
+DataVersion
+    version of the questions and categories, bumped by every write. Read
+    endpoints derive their ETag and Last-Modified from it, so they can
+    answer conditional requests without a query. When path is set the
+    version lives in that file and is shared by all the processes of the
+    host, otherwise it is kept in the memory of the process. It starts
+    from new_data_version(), not 0, so that the ETag of a data state is
+    never given to another one.
+'''
+class DataVersion:
+
+  def __init__(self, path=None):
+    self.path = path or None
+    self.lock = threading.Lock()
+    self.version = new_data_version()
+    self.last_modified = time.time()
+
+  def current(self):
+    if self.path is None:
+      with self.lock:
+        return self.version, self.last_modified
+    current = self.read()
+    if current is None:
+      # First use of the file, or it was lost
+      try:
+        current = self.write(bump=False)
+      except OSError:
+        current = (self.version, self.last_modified)
+    return current
+
+  def read(self):
+    try:
+      with open(self.path) as version_file:
+        version, last_modified = version_file.read().split()
+      return int(version), float(last_modified)
+    except (OSError, ValueError):
+      return None
+
+  # Writes the version after the one of the file when bumping, and a new
+  # version when the file has none
+  def write(self, bump):
+    with self.lock:
+      # Serialize the writers of all processes, readers see either the
+      # old or the new file thanks to the atomic rename
+      with open(self.path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        current = self.read()
+        if current is not None and not bump:
+          return current
+        version = current[0] + 1 if current is not None else new_data_version()
+        current = (version, time.time())
+        temporary_path = '{}.{}.tmp'.format(self.path, os.getpid())
+        with open(temporary_path, 'w') as version_file:
+          version_file.write('{} {}'.format(*current))
+        os.replace(temporary_path, self.path)
+        return current
+
+  def bump(self):
+    if self.path is None:
+      with self.lock:
+        self.version += 1
+        self.last_modified = time.time()
+      return
+    self.write(bump=True)
+
+# Its file is set by setup_db
+data_version = DataVersion()
+
+'''
+Catalog snapshot
+
+Read-only copy of the questions and categories in a file that every
+process of the host maps in memory, so that the pre-fork workers share
+one copy of the catalog in the page cache instead of each loading its
+own. The columns are native arrays read in place through memoryviews and
+the texts are UTF-8 in a single blob addressed by offsets, in sections
+aligned on 8 bytes:
+
+  header            magic, data version, questions, categories, blob size,
+                    build time, database fingerprint
+  ids               int32 per question, ascending
+  categories        int32 per question, -1 for none
+  difficulties      int32 per question, -1 for none
+  by_category       int32 positions of the questions, ordered by category
+                    then id
+  offsets           int64 start of the question then of the answer of
+                    every question in the blob, then the end of the texts
+  category_ids      int32 per category, ascending
+  category_ranges   int64 start and end of every category in by_category
+  category_offsets  int64 start of every category type in the blob, then
+                    the end of the blob
+  blob              the texts, b'\xff' (never valid UTF-8) for NULL
+
+A snapshot holds the data version it was built at, and is only used
+while that is still the current version, for at most max_age seconds,
+and while the fingerprint of the database (catalog_fingerprint(),
+compared every check_seconds) is the one it was built with: the data
+version is only shared by the processes of a host, the database also
+sees the writes of the other hosts. Otherwise, it is rebuilt in the
+background and atomically replaced (rename) by a new generation, which
+every process maps on its next read. Meanwhile the reads go to the
+database.
+'''
+CATALOG_MAGIC = b'TRIVCAT2'
+CATALOG_HEADER = struct.Struct('=8sqqqqdqqq')
+CATALOG_HEADER_SIZE = 128
+CATALOG_NULL_TEXT = b'\xff'
+
+# File of the catalog snapshot shared by the workers of one host, empty to
+# not use a snapshot
+def environment_catalog_snapshot_file():
+    return os.getenv('CATALOG_SNAPSHOT_FILE', os.path.join(
+        tempfile.gettempdir(), 'trivia-{}.catalog'.format(os.getenv('DB_NAME', 'trivia'))))
+
+def padded(data):
+    return data + b'\0' * (-len(data) % 8)
+
+'''
+write_catalog(path, version, categories, questions)
+    writes a snapshot of (id, type) category rows and (id, question,
+    answer, category, difficulty) question rows ordered by id, both from
+    data version version, to a temporary file renamed to path
+'''
+def write_catalog(path, version, categories, questions, fingerprint=(0, 0, 0)):
+    ids, question_categories, difficulties = array('i'), array('i'), array('i')
+    offsets, blob = array('q'), bytearray()
+    for id, question, answer, category, difficulty in questions:
+        ids.append(id)
+        question_categories.append(-1 if category is None else category)
+        difficulties.append(-1 if difficulty is None else difficulty)
+        for value in (question, answer):
+            offsets.append(len(blob))
+            blob += CATALOG_NULL_TEXT if value is None else value.encode('utf-8')
+    offsets.append(len(blob))
+
+    # Stable sort, the questions of a category stay in id order
+    by_category = array('i', sorted(range(len(ids)), key=question_categories.__getitem__))
+    sorted_categories = [question_categories[position] for position in by_category]
+    category_ids, category_ranges, category_offsets = array('i'), array('q'), array('q')
+    for id, type in categories:
+        category_ids.append(id)
+        category_ranges.append(bisect_left(sorted_categories, id))
+        category_ranges.append(bisect_right(sorted_categories, id))
+        category_offsets.append(len(blob))
+        blob += CATALOG_NULL_TEXT if type is None else type.encode('utf-8')
+    category_offsets.append(len(blob))
+
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(CATALOG_HEADER.pack(
+            CATALOG_MAGIC, version, len(ids), len(category_ids), len(blob),
+            time.time(), *fingerprint
+        ).ljust(CATALOG_HEADER_SIZE, b'\0'))
+        for column in (ids, question_categories, difficulties, by_category, offsets,
+                       category_ids, category_ranges, category_offsets):
+            snapshot_file.write(padded(column.tobytes()))
+        snapshot_file.write(blob)
+    os.replace(temporary_path, path)
+
+'''
+CatalogGeneration
+    one mapped snapshot file, read in place
+'''
+class CatalogGeneration:
+
+  def __init__(self, mapping):
+    self.mapping = mapping
+    magic, self.version, questions, categories, blob_size, self.built_at, *fingerprint = \
+      CATALOG_HEADER.unpack_from(mapping)
+    self.fingerprint = tuple(fingerprint)
+    if magic != CATALOG_MAGIC:
+      raise ValueError('not a catalog snapshot')
+    view = memoryview(mapping)
+    start = CATALOG_HEADER_SIZE
+
+    def section(format, count):
+      nonlocal start
+      size = struct.calcsize(format) * count
+      column = view[start:start + size].cast(format)
+      start += size + (-size % 8)
+      return column
+
+    self.ids = section('i', questions)
+    self.categories = section('i', questions)
+    self.difficulties = section('i', questions)
+    self.by_category = section('i', questions)
+    self.offsets = section('q', 2 * questions + 1)
+    self.category_ids = section('i', categories)
+    self.category_ranges = section('q', 2 * categories)
+    self.category_offsets = section('q', categories + 1)
+    self.blob = view[start:start + blob_size]
+
+  def __len__(self):
+    return len(self.ids)
+
+  def text(self, start, end):
+    data = self.blob[start:end]
+    return None if data == CATALOG_NULL_TEXT else str(data, 'utf-8')
+
+  def category_types(self):
+    return {
+      id: self.text(self.category_offsets[number], self.category_offsets[number + 1])
+      for number, id in enumerate(self.category_ids)}
+
+  # Same dict as Question.format() for the question at position
+  def question(self, position):
+    category = self.categories[position]
+    difficulty = self.difficulties[position]
+    return {
+      'id': self.ids[position],
+      'question': self.text(self.offsets[2 * position], self.offsets[2 * position + 1]),
+      'answer': self.text(self.offsets[2 * position + 1], self.offsets[2 * position + 2]),
+      'category': None if category == -1 else category,
+      'difficulty': None if difficulty == -1 else difficulty,
+    }
+
+  '''
+  positions(category_id)
+      returns the positions of the questions of the category (None for
+      all the questions) ordered by id, None when the category does not
+      exist
+  '''
+  def positions(self, category_id):
+    if category_id is None:
+      return range(len(self.ids))
+    number = bisect_left(self.category_ids, category_id)
+    if number == len(self.category_ids) or self.category_ids[number] != category_id:
+      return None
+    start, end = self.category_ranges[2 * number], self.category_ranges[2 * number + 1]
+    return self.by_category[start:end]
+
+  # Number of positions whose question id is at most last_id
+  def count_up_to(self, positions, last_id):
+    low, high = 0, len(positions)
+    while low < high:
+      middle = (low + high) // 2
+      if self.ids[positions[middle]] <= last_id:
+        low = middle + 1
+      else:
+        high = middle
+    return low
+
+  # Random position not in excluded question ids, None when there is none left
+  def choice(self, positions, excluded, tries=8):
+    if not positions:
+      return None
+    for _ in range(tries):
+      position = positions[random.randrange(len(positions))]
+      if self.ids[position] not in excluded:
+        return position
+    # Most questions are excluded, pick among the remaining ones
+    remaining = [position for position in positions if self.ids[position] not in excluded]
+    return random.choice(remaining) if remaining else None
+
+  # Up to count distinct random positions not in excluded question ids
+  def sample(self, positions, excluded, count, tries=8):
+    chosen = []
+    chosen_ids = set()
+    misses = 0
+    while len(chosen) < count and misses < tries and len(positions) > 2 * (len(excluded) + count):
+      position = positions[random.randrange(len(positions))]
+      id = self.ids[position]
+      if id in excluded or id in chosen_ids:
+        misses += 1
+        continue
+      chosen.append(position)
+      chosen_ids.add(id)
+    if len(chosen) < count:
+      remaining = [position for position in positions
+                   if self.ids[position] not in excluded and self.ids[position] not in chosen_ids]
+      chosen.extend(random.sample(remaining, min(count - len(chosen), len(remaining))))
+    return chosen
+
+'''
+catalog_fingerprint()
+    (categories, questions, greatest question id) in the primary
+    database, changed by the inserts and deletes of every host
+'''
+def catalog_fingerprint():
+    return tuple(db.session.execute(select(
+        select(func.count(Category.id)).scalar_subquery(),
+        func.coalesce(select(func.sum(QuestionCount.count)).scalar_subquery(), 0),
+        func.coalesce(select(func.max(Question.id)).scalar_subquery(), 0)),
+        bind_arguments={'primary': True}).one())
+
+'''
+CatalogSnapshot
+    the snapshot file of the host at path (set by setup_db, None to not
+    use one). Needs the data version to be shared in a file too.
+'''
+class CatalogSnapshot:
+
+  def __init__(self, path=None, retry_seconds=5, max_age=300, check_seconds=5):
+    self.path = path or None
+    self.retry_seconds = retry_seconds
+    self.max_age = max_age
+    self.check_seconds = check_seconds
+    self.lock = threading.Lock()
+    self.generation = None
+    # (inode, modification time, size) of the mapped file
+    self.file_id = None
+    # Time of the last fingerprint check of the mapped generation, and
+    # whether the database still had its fingerprint
+    self.checked_at = 0
+    self.unchanged = True
+    self.thread = None
+    self.retry_at = 0
+    self.rebuilds = 0
+
+  '''
+  current()
+      returns the CatalogGeneration of the current data version, mapping
+      the file again when it was replaced, or None when there is no up to
+      date snapshot. A stale or missing snapshot is then rebuilt in the
+      background.
+  '''
+  def current(self):
+    if self.path is None or data_version.path is None:
+      return None
+    path = self.path
+    try:
+      stat = os.stat(path)
+      file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except OSError:
+      file_id = None
+
+    with self.lock:
+      if file_id != self.file_id:
+        self.generation = self.map(path) if file_id is not None else None
+        self.file_id = file_id
+        # Its fingerprint was read when it was built
+        self.checked_at = self.generation.built_at if self.generation is not None else 0
+        self.unchanged = True
+      generation = self.generation
+
+    if generation is not None and generation.version == data_version.current()[0] and \
+        time.time() - generation.built_at < self.max_age and self.is_unchanged(generation):
+      return generation
+    self.refresh(current_app._get_current_object())
+    return None
+
+  # Tells if the database still has the fingerprint of generation, read
+  # again every check_seconds
+  def is_unchanged(self, generation):
+    now = time.time()
+    with self.lock:
+      if generation is not self.generation or now < self.checked_at + self.check_seconds:
+        return self.unchanged
+    unchanged = catalog_fingerprint() == generation.fingerprint
+    with self.lock:
+      if generation is self.generation:
+        self.checked_at = now
+        self.unchanged = unchanged
+    return unchanged
+
+  def map(self, path):
+    try:
+      with open(path, 'rb') as snapshot_file:
+        # The mapping stays valid after the file is replaced or closed
+        return CatalogGeneration(mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ))
+    except (OSError, ValueError, struct.error):
+      return None
+
+  '''
+  refresh(app)
+      rebuilds the snapshot in a background thread from the database of
+      app, unless a rebuild is running in this process or the last one
+      failed less than retry_seconds ago
+  '''
+  def refresh(self, app):
+    with self.lock:
+      if self.path is None or self.thread is not None or time.monotonic() < self.retry_at:
+        return
+      self.thread = threading.Thread(
+        target=self.rebuild, args=(app,), name="catalog-snapshot", daemon=True)
+    self.thread.start()
+
+  # After a write, rebuilds the snapshot in the background if there is one
+  def invalidate(self):
+    if self.path is not None and data_version.path is not None and has_app_context():
+      self.refresh(current_app._get_current_object())
+
+  def rebuild(self, app):
+    try:
+      with app.app_context():
+        try:
+          self.build()
+        finally:
+          db.session.remove()
+    except Exception:
+      app.logger.exception("Could not build the catalog snapshot")
+      with self.lock:
+        self.retry_at = time.monotonic() + self.retry_seconds
+    finally:
+      with self.lock:
+        self.thread = None
+
+  '''
+  build()
+      writes a snapshot of the current data version and database
+      fingerprint, again until no write happened while it was built. The
+      builders of all processes are serialized, and nothing is written
+      when the file is up to date.
+  '''
+  def build(self):
+    with open(self.path + '.lock', 'a') as lock_file:
+      fcntl.flock(lock_file, fcntl.LOCK_EX)
+      written = False
+      while True:
+        # Read before the rows, so writes made meanwhile leave it stale
+        version = data_version.current()[0]
+        fingerprint = catalog_fingerprint()
+        db.session.rollback()
+        on_disk = self.map(self.path)
+        if on_disk is not None and on_disk.version == version and \
+            on_disk.fingerprint == fingerprint and \
+            (written or time.time() - on_disk.built_at < self.max_age):
+          return
+        write_catalog(
+          self.path, version,
+          db.session.query(Category.id, Category.type).order_by(Category.id).all(),
+          db.session.query(
+            Question.id, Question.question, Question.answer, Question.category,
+            Question.difficulty).order_by(Question.id).yield_per(10000),
+          fingerprint)
+        db.session.rollback()
+        written = True
+        with self.lock:
+          self.rebuilds += 1
+
+  def stats(self):
+    with self.lock:
+      generation = self.generation
+      return {
+        'version': generation.version if generation is not None else None,
+        'questions': len(generation) if generation is not None else 0,
+        'bytes': len(generation.mapping) if generation is not None else 0,
+        'rebuilds': self.rebuilds,
+      }
+
+# Its file is set by setup_db
+catalog_snapshot = CatalogSnapshot()
+
+'''
+CategoryCache
+    thread-safe in-process cache of the categories as an {id: type} dict
+    ordered by id. Category.insert/update/delete invalidate it by bumping
+    its version, so a reload started before a write is never stored. It
+    also reloads after max_age seconds to pick up writes made by other
+    processes. The categories are loaded from the primary, so that a
+    replica behind a write never fills the cache.
+'''
+class CategoryCache:
+
+  def __init__(self, max_age=300):
+    self.max_age = max_age
+    self.lock = threading.Lock()
+    self.version = 0
+    self.categories = None
+    self.loaded_at = None
+    self.hits = 0
+    self.misses = 0
+
+  def get(self):
+    categories, version = self.lookup()
+    if categories is not None:
+      return categories
+    return self.store(version, self.load())
+
+  def load(self):
+    return dict(db.session.execute(
+      select(Category.id, Category.type).order_by(Category.id),
+      bind_arguments={'primary': True}).all())
+
+  '''
+  lookup()
+      returns (categories, None) on a hit, else (None, version) where
+      version is to be passed to store() with the categories once loaded
+  '''
+  def lookup(self):
+    with self.lock:
+      if self.categories is not None and time.monotonic() - self.loaded_at < self.max_age:
+        self.hits += 1
+        return self.categories, None
+      self.misses += 1
+      return None, self.version
+
+  def store(self, version, categories):
+    with self.lock:
+      # Not kept when invalidated while loading
+      if self.version == version:
+        self.categories = categories
+        self.loaded_at = time.monotonic()
+    return categories
+
+  def invalidate(self):
+    with self.lock:
+      self.version += 1
+      self.categories = None
+
+  def stats(self):
+    with self.lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'version': self.version
+      }
+
+category_cache = CategoryCache()
+
+'''
+IdPool
+    set of ids supporting O(1) add, remove and random choice
+'''
+class IdPool:
+
+  def __init__(self):
+    self.ids = []
+    self.positions = {}
+
+  def __len__(self):
+    return len(self.ids)
+
+  def add(self, id):
+    if id not in self.positions:
+      self.positions[id] = len(self.ids)
+      self.ids.append(id)
+
+  def remove(self, id):
+    position = self.positions.pop(id, None)
+    if position is None:
+      return
+    # Move the last id in the hole left by the removed one
+    last = self.ids.pop()
+    if last != id:
+      self.ids[position] = last
+      self.positions[last] = position
+
+  def choice(self, excluded, tries=8):
+    if len(excluded) >= len(self.ids) and all(id in excluded for id in self.ids):
+      return None
+    # Rejection sampling is O(1) on average while most ids are available
+    for _ in range(tries):
+      id = random.choice(self.ids)
+      if id not in excluded:
+        return id
+    # Most ids are excluded, pick among the remaining ones
+    remaining = [id for id in self.ids if id not in excluded]
+    return random.choice(remaining) if remaining else None
+
+  def sample(self, excluded, count, tries=8):
+    chosen = []
+    chosen_set = set()
+    # Rejection sampling while the pool is large compared to what is
+    # excluded or already chosen
+    misses = 0
+    while len(chosen) < count and misses < tries and len(self.ids) > 2 * (len(excluded) + count):
+      id = random.choice(self.ids)
+      if id in excluded or id in chosen_set:
+        misses += 1
+        continue
+      chosen.append(id)
+      chosen_set.add(id)
+    if len(chosen) < count:
+      remaining = [id for id in self.ids if id not in excluded and id not in chosen_set]
+      chosen.extend(random.sample(remaining, min(count - len(chosen), len(remaining))))
+    return chosen
+
+'''
+QuestionIdIndex
+    in-memory index of question ids per category used to pick quiz questions
+    without scanning the questions table. Loaded by the first quiz, kept up
+    to date by Question.insert/update/delete and Category.insert, and
+    reloaded in the background after max_age seconds to pick up writes
+    made by other processes. Quizzes keep using the previous pools while
+    it is reloaded.
+'''
+class QuestionIdIndex:
+
+  def __init__(self, max_age=300):
+    self.max_age = max_age
+    self.lock = threading.RLock()
+    self.thread = None
+    self.generation = 0
+    self.reset()
+
+  def reset(self):
+    with self.lock:
+      # A reload running since before the reset is not kept
+      self.generation += 1
+      self.loaded_at = None
+      self.all_questions = IdPool()
+      self.categories = {}
+      # (write, arguments) made during a reload, replayed on the reloaded index
+      self.pending = None
+
+  def is_loaded(self):
+    return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age
+
+  '''
+  load()
+      loads the index if it was never loaded, waiting for a reload already
+      running, and starts a reload in the background when it is too old
+  '''
+  def load(self):
+    with self.lock:
+      thread = self.thread
+    if self.loaded_at is None and thread is not None:
+      thread.join()
+    with self.lock:
+      if self.loaded_at is None:
+        self.fill(db.session.query(Category.id),
+                  db.session.query(Question.id, Question.category))
+    if not self.is_loaded():
+      self.refresh(current_app._get_current_object())
+
+  '''
+  refresh(app)
+      reloads the index in a background thread from the database of app,
+      unless a reload is running
+  '''
+  def refresh(self, app):
+    with self.lock:
+      if self.thread is not None:
+        return
+      self.pending = []
+      self.thread = threading.Thread(
+        target=self.reload, args=(app, self.generation), name="question-id-index", daemon=True)
+    self.thread.start()
+
+  def reload(self, app, generation):
+    try:
+      with app.app_context():
+        try:
+          self.fill(db.session.query(Category.id).all(),
+                    db.session.query(Question.id, Question.category).yield_per(10000),
+                    generation)
+        finally:
+          db.session.remove()
+    except Exception:
+      app.logger.exception("Could not load the question id index")
+    finally:
+      with self.lock:
+        self.thread = None
+        self.pending = None
+
+  '''
+  fill(category_rows, question_rows, generation=None)
+      replaces the index with (category id,) and (question id, category id)
+      rows, for callers which load them with their own session, then
+      replays the writes made while the rows were read. Not kept when the
+      index was reset since generation.
+  '''
+  def fill(self, category_rows, question_rows, generation=None):
+    all_questions = IdPool()
+    categories = {}
+    for (category_id,) in category_rows:
+      categories[category_id] = IdPool()
+    for question_id, category_id in question_rows:
+      all_questions.add(question_id)
+      categories.setdefault(category_id, IdPool()).add(question_id)
+    with self.lock:
+      if generation is not None and generation != self.generation:
+        return
+      self.all_questions = all_questions
+      self.categories = categories
+      self.loaded_at = time.monotonic()
+      pending, self.pending = self.pending or [], None
+      for write, arguments in pending:
+        write(*arguments)
+
+  def add(self, question_id, category_id):
+    with self.lock:
+      if self.pending is not None:
+        self.pending.append((self.add, (question_id, category_id)))
+      if self.loaded_at is None:
+        return
+      self.all_questions.add(question_id)
+      self.categories.setdefault(category_id, IdPool()).add(question_id)
+
+  def remove(self, question_id, category_id):
+    with self.lock:
+      if self.pending is not None:
+        self.pending.append((self.remove, (question_id, category_id)))
+      if self.loaded_at is None:
+        return
+      self.all_questions.remove(question_id)
+      if category_id in self.categories:
+        self.categories[category_id].remove(question_id)
+
+  def add_category(self, category_id):
+    with self.lock:
+      if self.pending is not None:
+        self.pending.append((self.add_category, (category_id,)))
+      if self.loaded_at is not None:
+        self.categories.setdefault(category_id, IdPool())
+
+  def pool(self, category_id):
+    return self.all_questions if category_id is None else self.categories.get(category_id)
+
+  # Random id of the category not in excluded, None when there is none left
+  def choose(self, category_id, excluded):
+    with self.lock:
+      pool = self.pool(category_id)
+      return pool.choice(excluded) if pool is not None else None
+
+  # Up to count distinct random ids of the category not in excluded
+  def sample(self, category_id, excluded, count):
+    with self.lock:
+      pool = self.pool(category_id)
+      return pool.sample(excluded, count) if pool is not None else []
+
+  '''
+  random_question(category_id, previous_questions)
+      returns a random question of the category (None for all categories)
+      which is not in previous_questions, or None when there is none left
+  '''
+  def random_question(self, category_id, previous_questions):
+    self.load()
+    excluded = set(previous_questions)
+    while True:
+      question_id = self.choose(category_id, excluded)
+      if question_id is None:
+        return None
+
+      question = Question.query.get(question_id)
+      if question is not None:
+        return question
+      # Deleted by another process since the index was loaded
+      self.remove(question_id, category_id)
+      excluded.add(question_id)
+
+  '''
+  random_questions(category_id, previous_questions, count)
+      returns up to count distinct random questions of the category (None
+      for all categories) which are not in previous_questions
+  '''
+  def random_questions(self, category_id, previous_questions, count):
+    self.load()
+    excluded = set(previous_questions)
+    questions = []
+    while len(questions) < count:
+      question_ids = self.sample(category_id, excluded, count - len(questions))
+      if not question_ids:
+        break
+
+      found = Question.query.filter(Question.id.in_(question_ids)).all()
+      found_by_id = {question.id: question for question in found}
+      for question_id in question_ids:
+        excluded.add(question_id)
+        if question_id in found_by_id:
+          questions.append(found_by_id[question_id])
+        else:
+          # Deleted by another process since the index was loaded
+          self.remove(question_id, category_id)
+    return questions
+
+question_id_index = QuestionIdIndex()
+
+# Trigrams of a word as pg_trgm makes them: padded with two spaces in
+# front and one behind, so that short words and word starts count
+def word_trigrams(word):
+    padded = "  " + word + " "
+    return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+# Words of a text in the trigram index, numbers included
+def indexed_words(*texts):
+    words = set()
+    for text in texts:
+        if text:
+            words.update(search_words(text))
+    return words
+
+'''
+QuestionTextIndex
+    in-memory trigram index of the words of the questions and answers,
+    used for fuzzy search where pg_trgm is not available. The questions
+    containing a word are kept in a sorted list per word, and the words
+    containing a trigram in a set per trigram, so that a search compares
+    the words of the search term with the vocabulary and never with the
+    questions.
+
+    Built by the first search (or in a background thread at startup),
+    kept up to date by Question.insert/update/delete, and rebuilt in the
+    background after bulk writes and every max_age seconds to pick up
+    writes made by other processes. Searches keep using the previous
+    index while it is rebuilt.
+'''
+class QuestionTextIndex:
+
+  def __init__(self, max_age=300):
+    self.max_age = max_age
+    self.lock = threading.RLock()
+    self.thread = None
+    self.reset()
+
+  def reset(self):
+    with self.lock:
+      self.loaded_at = None
+      # word -> list of the ids of the questions containing it, sorted
+      self.postings = {}
+      # word -> number of trigrams of the word
+      self.sizes = {}
+      # trigram -> set of the words containing it
+      self.trigrams = {}
+      # (add or remove, question id, texts) made during a rebuild, replayed
+      # on the rebuilt index
+      self.pending = None
+
+  def is_loaded(self):
+    return self.loaded_at is not None and time.monotonic() - self.loaded_at < self.max_age
+
+  '''
+  load()
+      builds the index if it was never built, waiting for a build already
+      running, and starts a rebuild in the background when it is too old
+  '''
+  def load(self):
+    with self.lock:
+      thread = self.thread
+    if self.loaded_at is None and thread is not None:
+      thread.join()
+    with self.lock:
+      if self.loaded_at is None:
+        self.fill(db.session.query(Question.id, Question.question, Question.answer)
+                  .order_by(Question.id).yield_per(10000))
+    if not self.is_loaded():
+      self.refresh(current_app._get_current_object())
+
+  '''
+  refresh(app)
+      rebuilds the index in a background thread from the database of app,
+      unless a rebuild is running. Where pg_trgm is installed, the index
+      is not needed and not built, nor before the migrations created the
+      questions table.
+  '''
+  def refresh(self, app):
+    with self.lock:
+      if self.thread is not None:
+        return
+      self.pending = []
+      self.thread = threading.Thread(
+        target=self.rebuild, args=(app,), name="question-text-index", daemon=True)
+    self.thread.start()
+
+  # After bulk writes, rebuilds the index in the background if it was built
+  def invalidate(self):
+    if self.loaded_at is not None:
+      self.refresh(current_app._get_current_object())
+
+  def rebuild(self, app):
+    try:
+      with app.app_context():
+        try:
+          if not has_trigram_extension() and \
+              inspect(db.engine).has_table(Question.__tablename__):
+            self.fill(db.session.query(Question.id, Question.question, Question.answer)
+                      .order_by(Question.id).yield_per(10000))
+        finally:
+          db.session.remove()
+    except Exception:
+      app.logger.exception("Could not build the fuzzy search index")
+    finally:
+      with self.lock:
+        self.thread = None
+        self.pending = None
+
+  '''
+  fill(rows)
+      replaces the index with (question id, question, answer) rows ordered
+      by id, then replays the writes made while the rows were read
+  '''
+  def fill(self, rows):
+    postings = {}
+    for question_id, question, answer in rows:
+      for word in indexed_words(question, answer):
+        ids = postings.get(word)
+        if ids is None:
+          ids = postings[word] = []
+        ids.append(question_id)
+
+    sizes = {}
+    trigrams = {}
+    for word in postings:
+      word_trigram_set = word_trigrams(word)
+      sizes[word] = len(word_trigram_set)
+      for trigram in word_trigram_set:
+        trigrams.setdefault(trigram, set()).add(word)
+
+    with self.lock:
+      self.postings = postings
+      self.sizes = sizes
+      self.trigrams = trigrams
+      self.loaded_at = time.monotonic()
+      pending, self.pending = self.pending or [], None
+      for write, question_id, texts in pending:
+        write(question_id, *texts)
+
+  def add(self, question_id, *texts):
+    with self.lock:
+      if self.pending is not None:
+        self.pending.append((self.add, question_id, texts))
+      if self.loaded_at is None:
+        return
+      for word in indexed_words(*texts):
+        ids = self.postings.get(word)
+        if ids is None:
+          ids = self.postings[word] = []
+          self.sizes[word] = len(word_trigrams(word))
+          for trigram in word_trigrams(word):
+            self.trigrams.setdefault(trigram, set()).add(word)
+        position = bisect_left(ids, question_id)
+        if position == len(ids) or ids[position] != question_id:
+          ids.insert(position, question_id)
+
+  def remove(self, question_id, *texts):
+    with self.lock:
+      if self.pending is not None:
+        self.pending.append((self.remove, question_id, texts))
+      if self.loaded_at is None:
+        return
+      for word in indexed_words(*texts):
+        ids = self.postings.get(word)
+        if ids is None:
+          continue
+        position = bisect_left(ids, question_id)
+        if position < len(ids) and ids[position] == question_id:
+          del ids[position]
+        if not ids:
+          # Last question with the word, the word leaves the vocabulary
+          del self.postings[word]
+          del self.sizes[word]
+          for trigram in word_trigrams(word):
+            words = self.trigrams.get(trigram)
+            if words is not None:
+              words.discard(word)
+              if not words:
+                del self.trigrams[trigram]
+
+  '''
+  similar_words(word, threshold)
+      returns {word: similarity} of the indexed words whose trigram
+      similarity with word (shared trigrams over all the trigrams of
+      both, as pg_trgm similarity) is at least threshold
+  '''
+  def similar_words(self, word, threshold):
+    word_trigram_set = word_trigrams(word)
+    shared = Counter()
+    for trigram in word_trigram_set:
+      shared.update(self.trigrams.get(trigram, ()))
+    similar = {}
+    for other, count in shared.items():
+      similarity = count / (len(word_trigram_set) + self.sizes[other] - count)
+      if similarity >= threshold:
+        similar[other] = similarity
+    return similar
+
+  '''
+  search(search_term, threshold, ranked=True)
+      returns the ids of the questions with, for every word of
+      search_term, a word similar to it in their question or answer. Most
+      similar first when ranked (sum of the best similarity of every
+      word), ordered by id otherwise.
+  '''
+  def search(self, search_term, threshold, ranked=True):
+    words = indexed_words(search_term)
+    if not words:
+      return []
+    self.load()
+
+    with self.lock:
+      similar = [self.similar_words(word, threshold) for word in words]
+      if len(similar) == 1 and len(similar[0]) == 1:
+        # One word similar to the only word searched, its ids are the results
+        (other,) = similar[0]
+        return list(self.postings[other])
+
+      # Questions with a similar word for every word searched, starting
+      # with the word found in the fewest questions
+      postings = sorted(
+        ([self.postings[other] for other in similar_words] for similar_words in similar),
+        key=lambda word_postings: sum(map(len, word_postings)))
+      matches = set().union(*postings[0])
+      for word_postings in postings[1:]:
+        matches = set().union(*[matches.intersection(ids) for ids in word_postings])
+      question_ids = sorted(matches)
+      # Equally similar when every word searched has one similar word
+      if not ranked or all(len(similar_words) == 1 for similar_words in similar):
+        return question_ids
+
+      # Sum over the words searched of the best similarity of a word of
+      # the question, the most similar words are applied last
+      scores = dict.fromkeys(question_ids, 0.0)
+      for similar_words in similar:
+        best = {}
+        for other, similarity in sorted(similar_words.items(), key=lambda item: item[1]):
+          best.update(dict.fromkeys(matches.intersection(self.postings[other]), similarity))
+        for question_id, similarity in best.items():
+          scores[question_id] += similarity
+
+    # Stable, so equally similar questions stay in id order
+    question_ids.sort(key=scores.__getitem__, reverse=True)
+    return question_ids
+
+question_text_index = QuestionTextIndex()
@@ -1,201 +1,1244 @@
-from operator import and_, or_
-import os
-from unicodedata import category
-import unittest
-import json
-from flask_sqlalchemy import SQLAlchemy
-
-from flaskr import create_app
-from models import setup_db, Question, Category
-
-
-class TriviaTestCase(unittest.TestCase):
-    """This class represents the trivia test case"""
-
-    def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
-        self.database_name = "trivia_test"
-        self.database_path = "postgresql://{}:{}@{}/{}".format(
-            "postgres", "", "localhost:5432", self.database_name
-        )
-        setup_db(self.app, self.database_path)
-
-        # Default question used to test create new question functionnality
-        self.new_question = {"answer": "Joe Biden", "category": 4, "difficulty": 1, "question": "Who is the actual president of United States?"}
-        # Default category used to test create new category functionnality
-        self.new_category = {"type": "Literature"}
-         # Search term used to test search functionnality
-        self.searchTerm = {"search_term": "Who"}
-        # Inputs used to test quiz functionnality
-        self.quizInputs = {
-            'previous_questions': [],
-            'quiz_category': {'type': 'History', 'id': 4}
-        }
-
-        # binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-            # create all tables
-            self.db.create_all()
-    
-    def tearDown(self):
-        """Executed after reach test"""
-        pass
-
-    """
-    TODO
-    Write at least one test for each test for successful operation and for expected errors.
-    """
-    # Test endpoint to get all categories
-    def test_get_categories(self):
-        res = self.client().get("/categories")
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 200)
-        self.assertTrue(data["categories"])
-
-    # Test if request to get categories is valid
-    def test_422_get_categories_with_params(self):
-        res = self.client().post("/categories")
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 400)
-        self.assertEqual(data["success"], False)
-        self.assertEqual(data["message"], "You request is not valid")
-    
-    # Test endpoint to get all questions
-    def test_get_questions(self):
-        res = self.client().get("/questions")
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 200)
-        self.assertTrue(data["total_questions"])
-        self.assertTrue(len(data["questions"]))
-        self.assertTrue(data["categories"])
-
-    # Test if page parameter is not valid
-    def test_404_if_the_page_is_not_valid(self):
-        res = self.client().get("/questions?page=1000")
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 404)
-        self.assertEqual(data["success"], False)
-        self.assertEqual(data["message"], "Resource not found")
-    
-    # Test endpoint to delete one question
-    def test_delete_question(self):
-        res = self.client().delete("/questions/24")
-        data = json.loads(res.data)
-
-        question = Question.query.filter(Question.id == 24).one_or_none()
-
-        self.assertEqual(res.status_code, 200)
-        self.assertEqual(data["question_deleted"], 24)
-        self.assertTrue(data["total_questions"])
-
-    # Test if question ID does not exist when trying to delete it
-    def test_422_if_question_does_not_exist(self):
-        res = self.client().delete("/questions/3000")
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 422)
-        self.assertEqual(data["success"], False)
-        self.assertEqual(data["message"], "Unprocessable")
-
-    # Test endpoint to create new question
-    def test_create_new_question(self):
-        res = self.client().post("/questions", json=self.new_question)
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 200)
-        self.assertTrue(data["question_created"])
-
-    # Test if question's creation is not allowed
-    def test_405_if_new_question_creation_not_allowed(self):
-        res = self.client().post("/questions/45", json=self.new_question)
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 405)
-        self.assertEqual(data["success"], False)
-        self.assertEqual(data["message"], "Method not allowed")
-    
-    # Test endpoint to create new category
-    def test_create_new_category(self):
-        res = self.client().post("/categories", json=self.new_category)
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 200)
-        self.assertTrue(data["category_created"])
-
-    # Test if category's creation is unprocessable
-    def test_405_if_new_category_creation_is_unprocessable(self):
-        res = self.client().post("/categories", json={"mine": "yesterday"})
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 422)
-        self.assertEqual(data["success"], False)
-        self.assertEqual(data["message"], "Unprocessable")
-        
-    # Test endpoint to get questions based on search term
-    def test_get_questions_based_on_search_term(self):
-        res = self.client().post("/questions", json=self.searchTerm)
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 200)
-        self.assertTrue(data["questions"])
-        self.assertTrue(data["total_questions"])
-
-    # Test if search is not allowed
-    def test_422_if_questions_based_on_search_term_not_allowed(self):
-        res = self.client().post("/questions/2", json={"search_term": "yesterday"})
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 405)
-        self.assertEqual(data["success"], False)
-        self.assertEqual(data["message"], "Method not allowed")
-    
-    # Test endpoint to get questions for quiz
-    def test_get_questions_to_play_the_quiz(self):
-        res = self.client().post("/quizzes", json=self.quizInputs)
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 200)
-        self.assertTrue(data["question"])
-
-    # Test if getting question is unprocessable
-    def test_422_if_quizzes_questions_do_not_exists(self):
-        res = self.client().post("/quizzes", json={
-            'previous_questions': [1, 4, 20, 15],
-            'quiz_category': 'Current category'
-        })
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 422)
-        self.assertEqual(data["success"], False)
-        self.assertEqual(data["message"], "Unprocessable")
-    
-    # Test endpoint to get questions based on category
-    def test_get_questions_based_on_category(self):
-        res = self.client().get("/categories/4/questions")
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 200)
-        self.assertTrue(data["current_category"])
-        self.assertTrue(data["total_questions"])
-        self.assertTrue(data["questions"])
-
-    # Test if category does not exist
-    def test_404_if_category_does_not_exist_when_retrieve_questions(self):
-        res = self.client().get("/categories/1000/questions")
-        data = json.loads(res.data)
-
-        self.assertEqual(res.status_code, 404)
-        self.assertEqual(data["success"], False)
-        self.assertEqual(data["message"], "Resource not found")
-
-# Make the tests conveniently executable
-if __name__ == "__main__":
+from operator import and_, or_
+import os
+from unicodedata import category
+import unittest
+import asyncio
+import importlib.util
+import json
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from unittest import mock
+from flask_sqlalchemy import SQLAlchemy
+from flask_migrate import upgrade
+from sqlalchemy import event, orm
+
+from flaskr import create_app, encode_cursor
+from flaskr.config import CONFIG_PROFILES
+from flaskr.single_flight import SingleFlight
+from flaskr.quiz_sessions import QuizSessionStore, MemoryQuizSessionStore, SQLiteQuizSessionStore, RedisQuizSessionStore
+from models import setup_db, db, DataVersion, data_version, catalog_snapshot, category_cache, question_id_index, question_text_index, Question, QuestionCount, Category
+
+SAMPLE_DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "trivia.psql")
+app = None
+
+
+def load_sample_data(path):
+    """Insert the categories and questions of the COPY blocks of a pg_dump."""
+    tables = {"public.categories": Category.__table__, "public.questions": Question.__table__}
+    with open(path, encoding="utf-8") as dump:
+        lines = iter(dump.read().splitlines())
+    for line in lines:
+        if not line.startswith("COPY "):
+            continue
+        name, columns = line[len("COPY "):].split(" ", 1)
+        columns = [column.strip() for column in columns.split("(")[1].split(")")[0].split(",")]
+        rows = []
+        for row in lines:
+            if row == "\\.":
+                break
+            rows.append({
+                column: None if value == "\\N" else value
+                for column, value in zip(columns, row.split("\t"))})
+        db.session.execute(tables[name].insert(), rows)
+    QuestionCount.rebuild()
+
+
+def setUpModule():
+    """Build the in-memory database once for all the tests."""
+    global app
+    app = create_app("test")
+    with app.app_context():
+        # pysqlite does not emit BEGIN itself, which breaks the SAVEPOINT
+        # used to roll back every test
+        @event.listens_for(db.engine, "connect")
+        def do_connect(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(db.engine, "begin")
+        def do_begin(connection):
+            connection.exec_driver_sql("BEGIN")
+
+        upgrade()
+        load_sample_data(SAMPLE_DATA_PATH)
+
+
+class TriviaTestCase(unittest.TestCase):
+    """This class represents the trivia test case"""
+
+    def setUp(self):
+        """Define test variables and start the transaction of the test."""
+        self.app = app
+        self.client = self.app.test_client
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        # Everything the test writes, commits included, is rolled back in
+        # tearDown: the sessions of the app are bound to a connection in a
+        # transaction, and commit to a SAVEPOINT started again after each
+        # commit or rollback
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        self.session = db.session
+        session_factory = db.create_scoped_session(
+            options={"bind": self.connection, "binds": {}}).session_factory
+
+        @event.listens_for(session_factory, "after_transaction_end")
+        def restart_savepoint(session, transaction):
+            if transaction.nested and not transaction._parent.nested:
+                session.expire_all()
+                session.begin_nested()
+
+        def begin_session():
+            session = session_factory()
+            session.begin_nested()
+            return session
+        db.session = orm.scoped_session(
+            begin_session, scopefunc=self.session.registry.scopefunc)
+
+        # Default question used to test create new question functionnality
+        self.new_question = {"answer": "Joe Biden", "category": 4, "difficulty": 1, "question": "Who is the actual president of United States?"}
+        # Default category used to test create new category functionnality
+        self.new_category = {"type": "Literature"}
+         # Search term used to test search functionnality
+        self.searchTerm = {"search_term": "Who"}
+        # Inputs used to test quiz functionnality
+        self.quizInputs = {
+            'previous_questions': [],
+            'quiz_category': {'type': 'History', 'id': 4}
+        }
+
+    def tearDown(self):
+        """Executed after reach test"""
+        db.session.remove()
+        db.session = self.session
+        self.transaction.rollback()
+        self.connection.close()
+        self.app_context.pop()
+        # The in-process caches may hold rows of the rolled back transaction
+        category_cache.invalidate()
+        question_id_index.reset()
+        question_text_index.reset()
+
+    """
+    TODO
+    Write at least one test for each test for successful operation and for expected errors.
+    """
+    # Test endpoint to get all categories
+    def test_get_categories(self):
+        res = self.client().get("/categories")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["categories"])
+
+    # Test if unchanged categories are not sent again
+    def test_304_get_categories_if_not_modified(self):
+        res = self.client().get("/categories")
+        etag = res.headers["ETag"]
+
+        res = self.client().get("/categories", headers={"If-None-Match": etag})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.headers["ETag"], etag)
+
+    # Test if ETag changes after a write
+    def test_etag_changes_after_creating_new_question(self):
+        res = self.client().get("/questions")
+        etag = res.headers["ETag"]
+
+        self.client().post("/questions", json=self.new_question)
+        res = self.client().get("/questions", headers={"If-None-Match": etag})
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotEqual(res.headers["ETag"], etag)
+
+    # Test if request to get categories is valid
+    def test_422_get_categories_with_params(self):
+        res = self.client().post("/categories")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "You request is not valid")
+    
+    # Test endpoint to get all questions
+    def test_get_questions(self):
+        res = self.client().get("/questions")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["total_questions"])
+        self.assertTrue(len(data["questions"]))
+        self.assertTrue(data["categories"])
+
+    # Test if page parameter is not valid
+    def test_404_if_the_page_is_not_valid(self):
+        res = self.client().get("/questions?page=1000")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Resource not found")
+    
+    # Test endpoint to get questions with cursor pagination
+    def test_get_questions_with_cursor(self):
+        res = self.client().get("/questions?cursor=")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data["questions"]), 10)
+        self.assertTrue(data["next_cursor"])
+
+        res = self.client().get("/questions?cursor={}".format(data["next_cursor"]))
+        next_data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(next_data["questions"][0]["id"] > data["questions"][-1]["id"])
+
+    # Test if cursor parameter is not valid
+    def test_400_if_the_cursor_is_not_valid(self):
+        res = self.client().get("/questions?cursor=not-a-cursor")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "You request is not valid")
+
+    # Test if a cursor with an id out of the range of the ids is not valid
+    def test_400_if_the_cursor_id_is_out_of_range(self):
+        for last_id in (2 ** 63, 10 ** 30, -1):
+            res = self.client().get("/questions?cursor={}".format(encode_cursor(last_id)))
+
+            self.assertEqual(res.status_code, 400)
+
+    # Test endpoint to get question counters
+    def test_get_stats(self):
+        res = self.client().get("/stats")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], Question.query.count())
+        self.assertEqual(data["categories"]["4"]["type"], "History")
+        self.assertEqual(
+            data["categories"]["4"]["total_questions"],
+            Question.query.filter(Question.category == 4).count())
+
+    # Test endpoint to get the metrics
+    def test_get_metrics(self):
+        self.client().get("/questions")
+        res = self.client().get("/metrics")
+        body = res.data.decode("utf-8")
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('trivia_requests_total{method="GET",route="/questions",status="200"}', body)
+        self.assertIn('trivia_request_queries_count{method="GET",route="/questions"}', body)
+        self.assertIn('trivia_single_flight_requests_total{method="GET",route="/questions",result="leader"}', body)
+
+    # Test endpoint to delete one question
+    def test_delete_question(self):
+        res = self.client().delete("/questions/5")
+        data = json.loads(res.data)
+
+        question = Question.query.filter(Question.id == 5).one_or_none()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["question_deleted"], 5)
+        self.assertTrue(data["total_questions"])
+        self.assertEqual(question, None)
+
+    # Test endpoint to delete questions in bulk
+    def test_delete_questions_in_bulk(self):
+        res = self.client().post("/questions", json=self.new_question)
+        question_id = json.loads(res.data)["question_created"]["id"]
+
+        res = self.client().delete("/questions", json={"ids": [question_id]})
+        data = json.loads(res.data)
+
+        question = Question.query.filter(Question.id == question_id).one_or_none()
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["questions_deleted"], 1)
+        self.assertTrue(data["total_questions"])
+        self.assertEqual(question, None)
+
+    # Test if bulk delete has no criteria
+    def test_422_if_bulk_delete_has_no_criteria(self):
+        res = self.client().delete("/questions", json={})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Unprocessable")
+
+    # Test if question ID does not exist when trying to delete it
+    def test_422_if_question_does_not_exist(self):
+        res = self.client().delete("/questions/3000")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Unprocessable")
+
+    # Test endpoint to create new question
+    def test_create_new_question(self):
+        res = self.client().post("/questions", json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["question_created"])
+
+    # Test endpoint to import questions in bulk
+    def test_import_questions(self):
+        rows = [
+            self.new_question,
+            {"answer": "Paris", "category": 1000, "difficulty": 1, "question": "Capital of France?"},
+        ]
+        res = self.client().post(
+            "/questions/import",
+            data="\n".join(json.dumps(row) for row in rows),
+            content_type="application/x-ndjson")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["inserted"], 1)
+        self.assertEqual(data["rejected"], 1)
+        self.assertEqual(data["rejected_rows"][0]["line"], 2)
+
+    # Test if import format is not valid
+    def test_422_if_import_format_is_not_valid(self):
+        res = self.client().post("/questions/import?format=xml", data="<questions/>")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Unprocessable")
+
+    # Test endpoint to export questions as NDJSON
+    def test_export_questions(self):
+        res = self.client().get("/questions/export?category=4")
+        questions = [json.loads(line) for line in res.data.decode().splitlines()]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertTrue(questions)
+        self.assertTrue(all(question["category"] == 4 for question in questions))
+
+    # Test if question's creation is not allowed
+    def test_405_if_new_question_creation_not_allowed(self):
+        res = self.client().post("/questions/45", json=self.new_question)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 405)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Method not allowed")
+    
+    # Test endpoint to create new category
+    def test_create_new_category(self):
+        res = self.client().post("/categories", json=self.new_category)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["category_created"])
+
+    # Test if new category is listed right after its creation
+    def test_get_categories_after_creating_new_category(self):
+        self.client().get("/categories")
+        res = self.client().post("/categories", json=self.new_category)
+        category_created = json.loads(res.data)["category_created"]
+
+        res = self.client().get("/categories")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(
+            data["categories"][str(category_created["id"])], self.new_category["type"])
+
+    # Test if category's creation is unprocessable
+    def test_405_if_new_category_creation_is_unprocessable(self):
+        res = self.client().post("/categories", json={"mine": "yesterday"})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Unprocessable")
+        
+    # Test endpoint to get questions based on search term
+    def test_get_questions_based_on_search_term(self):
+        res = self.client().post("/questions", json=self.searchTerm)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["questions"])
+        self.assertTrue(data["total_questions"])
+
+    # Test if search results are cached until the next write
+    def test_search_results_are_cached_until_next_write(self):
+        search_cache = self.app.config["SEARCH_CACHE"]
+        res = self.client().post("/questions", json={"search_term": "who"})
+        total_questions = json.loads(res.data)["total_questions"]
+        hits = search_cache.stats()["hits"]
+
+        res = self.client().post("/questions", json={"search_term": "  WHO "})
+        self.assertEqual(search_cache.stats()["hits"], hits + 1)
+        self.assertEqual(json.loads(res.data)["total_questions"], total_questions)
+
+        self.client().post("/questions", json=self.new_question)
+        res = self.client().post("/questions", json={"search_term": "who"})
+        self.assertEqual(json.loads(res.data)["total_questions"], total_questions + 1)
+
+    # Test typo tolerant search, on the in-process trigram index with SQLite
+    def test_fuzzy_search_finds_misspelled_words(self):
+        res = self.client().post("/questions", json={"search_term": "penicilin"})
+        self.assertEqual(res.status_code, 422)
+
+        res = self.client().post(
+            "/questions", json={"search_term": "penicilin", "fuzzy": True})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question["id"] for question in data["questions"]], [21])
+
+        # Numbers are indexed, as the exact search finds them
+        res = self.client().post("/questions", json={"search_term": "1990", "fuzzy": True})
+        data = json.loads(res.data)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([question["id"] for question in data["questions"]], [6])
+
+        # Answers are searched too
+        res = self.client().post(
+            "/questions", json={"search_term": "alexandre flemming", "fuzzy": True})
+        data = json.loads(res.data)
+        self.assertEqual(data["questions"][0]["id"], 21)
+
+        # New questions are indexed
+        res = self.client().post("/questions", json=self.new_question)
+        question_id = json.loads(res.data)["question_created"]["id"]
+        res = self.client().post(
+            "/questions", json={"search_term": "presidant", "fuzzy": True})
+        data = json.loads(res.data)
+        self.assertIn(question_id, [question["id"] for question in data["questions"]])
+
+    # Test if search is not allowed
+    def test_422_if_questions_based_on_search_term_not_allowed(self):
+        res = self.client().post("/questions/2", json={"search_term": "yesterday"})
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 405)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Method not allowed")
+    
+    # Test endpoint to get questions for quiz
+    def test_get_questions_to_play_the_quiz(self):
+        res = self.client().post("/quizzes", json=self.quizInputs)
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["question"])
+
+    # Test endpoint to get questions for quiz from all categories
+    def test_get_questions_to_play_the_quiz_in_all_categories(self):
+        res = self.client().post("/quizzes", json={
+            'previous_questions': [2, 4],
+            'quiz_category': {'type': 'click', 'id': 0}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["question"])
+        self.assertNotIn(data["question"]["id"], [2, 4])
+
+    # Test if getting question is unprocessable
+    def test_422_if_quizzes_questions_do_not_exists(self):
+        res = self.client().post("/quizzes", json={
+            'previous_questions': [1, 4, 20, 15],
+            'quiz_category': 'Current category'
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Unprocessable")
+    
+    # Test endpoint to get a batch of questions for quiz
+    def test_get_batch_of_questions_to_play_the_quiz(self):
+        res = self.client().post("/quizzes/batch", json={
+            'previous_questions': [5],
+            'quiz_category': {'type': 'History', 'id': 4},
+            'count': 3
+        })
+        data = json.loads(res.data)
+        question_ids = [question["id"] for question in data["questions"]]
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(question_ids), 3)
+        self.assertEqual(len(set(question_ids)), 3)
+        self.assertNotIn(5, question_ids)
+
+    # Test if batch size is not valid
+    def test_422_if_quiz_batch_size_is_not_valid(self):
+        res = self.client().post("/quizzes/batch", json={
+            'previous_questions': [],
+            'quiz_category': {'type': 'History', 'id': 4},
+            'count': 1000
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 422)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Unprocessable")
+
+    # Test endpoint to play a quiz with a server-side session
+    def test_play_quiz_session(self):
+        res = self.client().post("/quizzes/sessions", json={
+            'quiz_category': {'type': 'History', 'id': 4}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["session"])
+        self.assertEqual(data["total_questions"], 4)
+
+        asked_questions = []
+        for _ in range(data["total_questions"]):
+            res = self.client().post(
+                "/quizzes/sessions/{}/next".format(data["session"]))
+            question = json.loads(res.data)["question"]
+
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(question["category"], 4)
+            self.assertNotIn(question["id"], asked_questions)
+            asked_questions.append(question["id"])
+
+        res = self.client().post(
+            "/quizzes/sessions/{}/next".format(data["session"]))
+        self.assertEqual(json.loads(res.data)["question"], None)
+
+    # Test if a quiz session holds the questions of one game
+    def test_quiz_session_size(self):
+        res = self.client().post("/quizzes/sessions", json={
+            'quiz_category': {'type': 'All', 'id': 0}
+        })
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], app.config["QUIZ_SESSION_SIZE"])
+
+    # Test if quiz session does not exist
+    def test_404_if_quiz_session_does_not_exist(self):
+        res = self.client().post("/quizzes/sessions/unknown/next")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Resource not found")
+
+    # Test endpoint to get questions based on category
+    def test_get_questions_based_on_category(self):
+        res = self.client().get("/categories/4/questions")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(data["current_category"])
+        self.assertTrue(data["total_questions"])
+        self.assertTrue(data["questions"])
+
+    # Test if category does not exist
+    def test_404_if_category_does_not_exist_when_retrieve_questions(self):
+        res = self.client().get("/categories/1000/questions")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(data["message"], "Resource not found")
+
+
+class DataVersionTestCase(unittest.TestCase):
+    """This class tests the versions of the data"""
+
+    # Test if a restarted process does not use the versions of the previous one
+    def test_versions_are_not_used_again_after_a_restart(self):
+        previous = DataVersion()
+        previous.bump()
+        time.sleep(0.001)
+
+        self.assertGreater(DataVersion().current()[0], previous.current()[0])
+
+    # Test if a lost version file starts again from a new version
+    def test_versions_are_not_used_again_after_losing_the_file(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "trivia.version")
+        version = DataVersion(path)
+        first = version.current()[0]
+        version.bump()
+        self.assertEqual(DataVersion(path).current()[0], first + 1)
+
+        os.remove(path)
+        time.sleep(0.001)
+        self.assertGreater(version.current()[0], first + 1)
+        self.assertEqual(DataVersion(path).current(), version.current())
+
+
+class QuestionIdIndexTestCase(unittest.TestCase):
+    """This class tests the reloads of the question id index"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app(dict(
+            CONFIG_PROFILES["test"],
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(self.directory, "trivia.db")))
+
+        with self.app.app_context():
+            upgrade()
+            Category(type="History").insert()
+            Question(question="Who?", answer="Me", category=1, difficulty=1).insert()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        question_id_index.reset()
+        shutil.rmtree(self.directory)
+
+    # Test if an old index is reloaded in the background, quizzes using the
+    # previous pools meanwhile and the writes of the reload being kept
+    def test_old_index_is_reloaded_in_the_background(self):
+        with self.app.app_context():
+            question_id_index.reset()
+            question_id_index.load()
+            self.assertEqual(question_id_index.sample(1, set(), 5), [1])
+
+            # Created by another process
+            db.session.execute(Question.__table__.insert(), [
+                {"question": "Who else?", "answer": "You", "category": 1, "difficulty": 1}])
+            db.session.commit()
+            question_id_index.loaded_at -= question_id_index.max_age + 1
+
+            with question_id_index.lock:
+                question_id_index.load()
+                self.assertEqual(question_id_index.sample(1, set(), 5), [1])
+                # Made while the index is reloaded
+                question_id_index.add(3, 1)
+                thread = question_id_index.thread
+            thread.join()
+
+            self.assertTrue(question_id_index.is_loaded())
+            self.assertEqual(sorted(question_id_index.sample(1, set(), 5)), [1, 2, 3])
+
+
+class QuestionTextIndexTestCase(unittest.TestCase):
+    """This class tests the fuzzy search index of a new database"""
+
+    # Test if building the index before the migrations logs no error
+    def test_warm_up_before_the_migrations(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        question_text_index.reset()
+        with self.assertNoLogs(level="ERROR"):
+            create_app(dict(
+                CONFIG_PROFILES["test"],
+                SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(directory, "trivia.db"),
+                FUZZY_INDEX_WARM_UP=True))
+            while question_text_index.thread is not None:
+                time.sleep(0.001)
+        self.assertIsNone(question_text_index.loaded_at)
+
+
+class CatalogSnapshotTestCase(unittest.TestCase):
+    """This class tests the reads served from the catalog snapshot file"""
+
+    def setUp(self):
+        """Create a SQLite database and the snapshot of its catalog."""
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app(dict(
+            CONFIG_PROFILES["test"],
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(self.directory, "trivia.db"),
+            DATA_VERSION_FILE=os.path.join(self.directory, "trivia.version"),
+            CATALOG_SNAPSHOT_FILE=os.path.join(self.directory, "trivia.catalog")))
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            upgrade()
+            Category(type="History").insert()
+            Category(type="Art").insert()
+            for number in range(12):
+                Question(question="Who is number {}?".format(number), answer="Me",
+                         category=1 + number % 2, difficulty=1).insert()
+            self.wait_for_snapshot()
+
+            self.queries = []
+            event.listen(db.engine, "before_cursor_execute", self.count_query)
+
+    def tearDown(self):
+        """Executed after reach test"""
+        self.wait_for_snapshot()
+        with self.app.app_context():
+            event.remove(db.engine, "before_cursor_execute", self.count_query)
+        data_version.path = None
+        catalog_snapshot.path = None
+        catalog_snapshot.max_age = 300
+        catalog_snapshot.check_seconds = 5
+        shutil.rmtree(self.directory)
+
+    def count_query(self, *args):
+        self.queries.append(args[2])
+
+    def wait_for_snapshot(self):
+        thread = catalog_snapshot.thread
+        if thread is not None:
+            thread.join()
+
+    # Test if listing, category filtering and quizzes are read from the
+    # snapshot, with the documents the database gives
+    def test_reads_are_served_from_the_snapshot(self):
+        requests = (
+            ("GET", "/questions?page=2", None),
+            ("GET", "/categories/2/questions", None),
+            ("POST", "/quizzes", {"previous_questions": [1, 3, 5, 7, 9], "quiz_category": {"id": 1}}),
+            ("POST", "/quizzes/batch", {"quiz_category": {"id": 1}, "count": 6}))
+        from_snapshot = [self.client().open(path, method=method, json=body).get_json()
+                         for method, path, body in requests]
+        self.assertEqual(self.queries, [])
+
+        catalog_snapshot.path = None
+        from_database = [self.client().open(path, method=method, json=body).get_json()
+                         for method, path, body in requests]
+        self.assertEqual(from_snapshot[:2], from_database[:2])
+        self.assertEqual(from_snapshot[2]["question"]["id"], 11)
+        self.assertEqual(sorted(question["id"] for question in from_snapshot[3]["questions"]),
+                         [1, 3, 5, 7, 9, 11])
+
+    # Test if a write is read from the database, then from a new snapshot
+    def test_snapshot_is_rebuilt_after_a_write(self):
+        self.client().post("/questions", json={
+            "answer": "You", "category": 1, "difficulty": 1, "question": "Who else?"})
+
+        res = self.client().get("/questions?page=2")
+        self.assertEqual(json.loads(res.data)["total_questions"], 13)
+        self.wait_for_snapshot()
+
+        del self.queries[:]
+        res = self.client().get("/questions?page=2")
+        self.assertEqual(json.loads(res.data)["total_questions"], 13)
+        self.assertEqual(self.queries, [])
+
+    # Test if a write of another host, which leaves the data version as is,
+    # is seen when the fingerprint is checked
+    def test_snapshot_is_rebuilt_after_a_write_of_another_host(self):
+        connection = sqlite3.connect(os.path.join(self.directory, "trivia.db"))
+        with connection:
+            connection.execute(
+                "INSERT INTO questions (question, answer, category, difficulty)"
+                " VALUES ('Who else?', 'You', 1, 1)")
+        connection.close()
+
+        res = self.client().get("/categories/1/questions")
+        self.assertEqual(len(json.loads(res.data)["questions"]), 6)
+        catalog_snapshot.check_seconds = 0
+        res = self.client().get("/categories/1/questions")
+        self.assertEqual(len(json.loads(res.data)["questions"]), 7)
+        self.wait_for_snapshot()
+
+        catalog_snapshot.check_seconds = 60
+        del self.queries[:]
+        res = self.client().get("/categories/1/questions")
+        self.assertEqual(len(json.loads(res.data)["questions"]), 7)
+        self.assertEqual(self.queries, [])
+
+    # Test if a snapshot older than the max age is not used
+    def test_snapshot_expires(self):
+        catalog_snapshot.max_age = 0
+        self.client().get("/questions?page=2")
+        self.assertNotEqual(self.queries, [])
+
+
+class LocalRedis:
+    """Stand-in for a Redis client with the commands of RedisQuizSessionStore,
+    without expiry."""
+
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def expire(self, key, seconds):
+        return key in self.values
+
+    def rpush(self, key, *values):
+        self.values.setdefault(key, []).extend(str(value).encode() for value in values)
+
+    def lpop(self, key):
+        values = self.values.get(key)
+        return values.pop(0) if values else None
+
+    def llen(self, key):
+        return len(self.values.get(key, []))
+
+    def delete(self, *keys):
+        for key in keys:
+            self.values.pop(key, None)
+
+
+class QuizSessionStoreTestCase(unittest.TestCase):
+    """This class tests the quiz session stores"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check_store(self, store):
+        """Play a session to the end, then delete another one."""
+        token = store.create([3, 1, 2])
+        self.assertEqual(store.pop(token), (3, 2))
+        self.assertEqual(store.pop(token), (1, 1))
+        self.assertEqual(store.pop(token), (2, 0))
+        self.assertEqual(store.pop(token), (None, 0))
+
+        token = store.create([4])
+        store.delete(token)
+        with self.assertRaises(KeyError):
+            store.pop(token)
+        with self.assertRaises(KeyError):
+            store.pop("unknown")
+
+    def test_memory_store(self):
+        self.check_store(MemoryQuizSessionStore())
+
+    def test_sqlite_store(self):
+        self.check_store(SQLiteQuizSessionStore(os.path.join(self.directory, "sessions.db")))
+
+    # Test if the sessions of the SQLite store expire
+    def test_sqlite_store_expiry(self):
+        store = SQLiteQuizSessionStore(os.path.join(self.directory, "sessions.db"), ttl=0)
+        token = store.create([1])
+        with self.assertRaises(KeyError):
+            store.pop(token)
+
+    def test_redis_store(self):
+        self.check_store(RedisQuizSessionStore(LocalRedis()))
+
+    # Test if a store must implement the store methods
+    def test_incomplete_store(self):
+        class Incomplete(QuizSessionStore):
+            def create(self, question_ids):
+                return "token"
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    """This class tests the coalescing of identical concurrent calls"""
+
+    def call_in_threads(self, coalescer, compute, count):
+        """Call compute in count threads while the first call runs, returns
+        the results and errors of all the calls."""
+        started, release = threading.Event(), threading.Event()
+        outcomes = []
+
+        def leader_compute():
+            started.set()
+            release.wait()
+            return compute()
+
+        def call(function):
+            try:
+                outcomes.append(coalescer.do(("GET", "/categories"), "key", function))
+            except Exception as error:
+                outcomes.append(error)
+
+        threads = [threading.Thread(target=call, args=(leader_compute,))]
+        threads[0].start()
+        started.wait()
+        for _ in range(count - 1):
+            threads.append(threading.Thread(target=call, args=(compute,)))
+            threads[-1].start()
+        while coalescer.stats().get(("GET", "/categories", "coalesced"), 0) < count - 1:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    # Test if concurrent calls with the same key compute once
+    def test_concurrent_calls_share_one_computation(self):
+        coalescer = SingleFlight()
+        calls = []
+        outcomes = self.call_in_threads(coalescer, lambda: calls.append(1) or "result", 4)
+
+        self.assertEqual(calls, [1])
+        self.assertEqual(outcomes, ["result"] * 4)
+        self.assertEqual(coalescer.stats(), {
+            ("GET", "/categories", "leader"): 1, ("GET", "/categories", "coalesced"): 3})
+        # Once done, the next call computes again
+        self.assertEqual(coalescer.do(("GET", "/categories"), "key", lambda: "again"), "again")
+
+    # Test if the error of the computation is raised in every call
+    def test_concurrent_calls_share_the_error(self):
+        def compute():
+            raise ValueError("failed")
+
+        outcomes = self.call_in_threads(SingleFlight(), compute, 3)
+        self.assertEqual([type(outcome) for outcome in outcomes], [ValueError] * 3)
+
+
+class GroupCommitTestCase(unittest.TestCase):
+    """This class tests the question creations committed in batches"""
+
+    def setUp(self):
+        """Create a SQLite database and an app in group commit mode."""
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app(dict(
+            CONFIG_PROFILES["test"],
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(self.directory, "trivia.db"),
+            GROUP_COMMIT=True, GROUP_COMMIT_MAX_WAIT_MS=50))
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            upgrade()
+            Category(type="History").insert()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        shutil.rmtree(self.directory)
+
+    def create_questions(self, difficulties):
+        """Create a question per difficulty from as many threads, returns
+        the responses in the same order."""
+        responses = [None] * len(difficulties)
+
+        def create(number):
+            responses[number] = self.client().post("/questions", json={
+                "question": "Who is number {}?".format(number), "answer": "Me",
+                "category": 1, "difficulty": difficulties[number]})
+
+        threads = [threading.Thread(target=create, args=(number,))
+                   for number in range(len(difficulties))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    # Test if concurrent creations are committed together, each caller
+    # getting its own question
+    def test_concurrent_creations_are_committed_together(self):
+        responses = self.create_questions([1, 2, 3, 4, 5, 1, 2, 3])
+
+        self.assertEqual([res.status_code for res in responses], [200] * 8)
+        created = [json.loads(res.data)["question_created"] for res in responses]
+        self.assertEqual([question["difficulty"] for question in created], [1, 2, 3, 4, 5, 1, 2, 3])
+        self.assertEqual(len(set(question["id"] for question in created)), 8)
+        self.assertLess(self.app.extensions["group_commit"].stats()["batches"], 8)
+
+        with self.app.app_context():
+            self.assertEqual(Question.query.count(), 8)
+            self.assertEqual(QuestionCount.total(), 8)
+
+    # Test if a failed creation only fails its own request
+    def test_failed_creation_fails_only_its_request(self):
+        responses = self.create_questions([1, 2, {"level": 3}, 4])
+
+        self.assertEqual([res.status_code for res in responses], [200, 200, 422, 200])
+        with self.app.app_context():
+            self.assertEqual(Question.query.count(), 3)
+            self.assertEqual(QuestionCount.total(), 3)
+
+    # Test if a failure after the commit does not insert the questions again
+    def test_failure_after_commit_does_not_insert_again(self):
+        bump = data_version.bump
+        failures = [RuntimeError("failed")]
+
+        def failing_bump():
+            if failures:
+                raise failures.pop()
+            return bump()
+
+        with mock.patch.object(data_version, "bump", side_effect=failing_bump):
+            responses = self.create_questions([1, 2, 3, 4])
+
+        self.assertEqual([res.status_code for res in responses], [200] * 4)
+        with self.app.app_context():
+            self.assertEqual(Question.query.count(), 4)
+            self.assertEqual(QuestionCount.total(), 4)
+
+    # Test if a creation not committed in time gets a 503, and if the
+    # writer is started again after it died
+    def test_timeout_and_writer_restart(self):
+        group_commit = self.app.extensions["group_commit"]
+        group_commit.timeout = 0.1
+        release = threading.Event()
+
+        def commit_many(rows):
+            release.wait()
+            raise SystemExit()
+
+        with mock.patch.object(Question, "commit_many", side_effect=commit_many):
+            res = self.client().post("/questions", json={
+                "question": "Who?", "answer": "Me", "category": 1, "difficulty": 1})
+            self.assertEqual(res.status_code, 503)
+            self.assertEqual(res.headers["Retry-After"], "1")
+            release.set()
+            group_commit.thread.join()
+
+        group_commit.timeout = 10
+        responses = self.create_questions([1])
+        self.assertEqual(responses[0].status_code, 200)
+
+
+class BulkDeleteTestCase(unittest.TestCase):
+    """This class tests the question counters of bulk deletes racing with
+    other writes, on a SQLite file"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app(dict(
+            CONFIG_PROFILES["test"],
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(self.directory, "trivia.db")))
+
+        with self.app.app_context():
+            upgrade()
+            Category(type="History").insert()
+            for number in range(3):
+                Question(question="Who {}?".format(number), answer="Me",
+                         category=1, difficulty=1).insert()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        shutil.rmtree(self.directory)
+
+    def insert_question(self):
+        with self.app.app_context():
+            Question(question="Who else?", answer="You", category=1, difficulty=1).insert()
+            db.session.remove()
+
+    # Test if a question created while a bulk delete counts its rows is
+    # either deleted and counted, or kept and counted
+    def test_counts_after_a_bulk_delete_racing_an_insert(self):
+        inserts = []
+
+        def insert_after_the_count(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith("SELECT questions.category") and not inserts:
+                inserts.append(threading.Thread(target=self.insert_question))
+                inserts[0].start()
+                # Committed now, unless the delete holds the write lock
+                inserts[0].join(0.2)
+
+        with self.app.app_context():
+            event.listen(db.engine, "after_cursor_execute", insert_after_the_count)
+            try:
+                Question.delete_many(category=1)
+            finally:
+                event.remove(db.engine, "after_cursor_execute", insert_after_the_count)
+            inserts[0].join()
+
+            self.assertEqual(QuestionCount.total(1), Question.query.filter(Question.category == 1).count())
+            self.assertEqual(QuestionCount.total(), Question.query.count())
+
+
+class AdmissionControlTestCase(unittest.TestCase):
+    """This class tests the concurrency and rate limits of the routes"""
+
+    def setUp(self):
+        """Create a SQLite database and an app with limited routes."""
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app(dict(
+            CONFIG_PROFILES["test"],
+            SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(self.directory, "trivia.db"),
+            ADMISSION_LIMITS={
+                "GET /categories": {"concurrency": 1},
+                "POST /quizzes": {"rate": 1, "burst": 2}}))
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            upgrade()
+            Category(type="History").insert()
+            Question(question="Who?", answer="Me", category=1, difficulty=1).insert()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        shutil.rmtree(self.directory)
+
+    # Test if a request over the concurrency limit is shed with a 503
+    def test_concurrency_limit(self):
+        limits = self.app.extensions["admission_control"].routes["GET", "/categories"]
+        self.assertTrue(limits.concurrency.acquire())
+
+        res = self.client().get("/categories")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(data["success"], False)
+        self.assertEqual(res.headers["Retry-After"], "1")
+        # Other routes are not limited
+        self.assertEqual(self.client().get("/questions").status_code, 200)
+
+        limits.concurrency.release()
+        self.assertEqual(self.client().get("/categories").status_code, 200)
+        self.assertEqual(limits.concurrency.running, 0)
+
+    # Test if the requests over the rate are shed with a 429
+    def test_rate_limit(self):
+        body = {"previous_questions": [], "quiz_category": {"id": 0}}
+        responses = [self.client().post("/quizzes", json=body) for _ in range(3)]
+
+        self.assertEqual([res.status_code for res in responses], [200, 200, 429])
+        self.assertEqual(json.loads(responses[2].data)["error"], 429)
+        self.assertEqual(responses[2].headers["Retry-After"], "1")
+
+        res = self.client().get("/metrics")
+        self.assertIn('trivia_admission_requests_total{method="POST",route="/quizzes",'
+                      'result="admitted"} 2', res.get_data(as_text=True))
+        self.assertIn('trivia_admission_requests_total{method="POST",route="/quizzes",'
+                      'result="shed_rate"} 1', res.get_data(as_text=True))
+
+
+class ReplicaRoutingTestCase(unittest.TestCase):
+    """This class tests the read replica routing with two SQLite files"""
+
+    def setUp(self):
+        """Create a primary and a replica which is a copy of it."""
+        self.directory = tempfile.mkdtemp()
+        primary_path = os.path.join(self.directory, "primary.db")
+        replica_path = os.path.join(self.directory, "replica.db")
+
+        self.app = create_app("test")
+        setup_db(self.app, "sqlite:///" + primary_path, ["sqlite:///" + replica_path])
+        self.client = self.app.test_client
+
+        with self.app.app_context():
+            upgrade()
+            Category(type="History").insert()
+            Question(question="Who?", answer="Me", category=1, difficulty=1).insert()
+        shutil.copy(primary_path, replica_path)
+
+    def tearDown(self):
+        """Executed after reach test"""
+        shutil.rmtree(self.directory)
+
+    # Test if reads go to the replica
+    def test_reads_go_to_replica(self):
+        client = self.client()
+        client.post("/questions", json={
+            "answer": "You", "category": 1, "difficulty": 1, "question": "Who else?"})
+
+        res = self.client().get("/questions")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], 1)
+
+    # Test if a client reads its own writes
+    def test_reads_go_to_primary_after_a_write(self):
+        client = self.client()
+        res = client.post("/questions", json={
+            "answer": "You", "category": 1, "difficulty": 1, "question": "Who else?"})
+
+        self.assertIn("trivia_primary_until", res.headers["Set-Cookie"])
+
+        res = client.get("/questions")
+        data = json.loads(res.data)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data["total_questions"], 2)
+
+    # Test if the process caches filled while another client reads from the
+    # replica still give the writer its own writes
+    def test_caches_keep_the_writes_of_the_writer(self):
+        writer = self.client()
+        writer.post("/categories", json={"type": "Art"})
+        writer.post("/questions", json={
+            "answer": "You", "category": 1, "difficulty": 1, "question": "Who else?"})
+
+        other = self.client()
+        res = other.post("/questions", json={"search_term": "who"})
+        self.assertEqual(json.loads(res.data)["total_questions"], 1)
+        res = other.get("/categories")
+        self.assertNotIn("ETag", res.headers)
+
+        res = writer.post("/questions", json={"search_term": "who"})
+        self.assertEqual(json.loads(res.data)["total_questions"], 2)
+        res = writer.get("/categories")
+        self.assertEqual(json.loads(res.data)["categories"], {"1": "History", "2": "Art"})
+        self.assertIn("ETag", res.headers)
+
+@unittest.skipIf(
+    importlib.util.find_spec("aiosqlite") is None or importlib.util.find_spec("asgiref") is None,
+    "the async serving mode needs aiosqlite and asgiref")
+class AsgiTestCase(unittest.TestCase):
+    """This class tests the ASGI app against the WSGI app on SQLite"""
+
+    def setUp(self):
+        from flaskr.asgi import create_asgi_app
+
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app("test")
+        setup_db(self.app, "sqlite:///" + os.path.join(self.directory, "trivia.db"), [])
+        self.client = self.app.test_client
+        self.asgi = create_asgi_app(self.app)
+
+        with self.app.app_context():
+            upgrade()
+            Category(type="History").insert()
+            for number in range(12):
+                Question(question="Who is number {}?".format(number), answer="Me",
+                         category=1, difficulty=1).insert()
+
+    def tearDown(self):
+        """Executed after reach test"""
+        asyncio.run(self.asgi.dispose())
+        shutil.rmtree(self.directory)
+
+    def request(self, method, path, body=None):
+        """Send a request to the ASGI app, returns (status, JSON body)."""
+        path, _, query_string = path.partition("?")
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        scope = {
+            "type": "http", "method": method, "path": path, "root_path": "",
+            "query_string": query_string.encode("ascii"), "http_version": "1.1",
+            "scheme": "http", "server": ("localhost", 80), "client": ("127.0.0.1", 0),
+            "headers": [(b"content-type", b"application/json"),
+                        (b"content-length", str(len(payload)).encode("ascii"))],
+        }
+        messages = [{"type": "http.request", "body": payload, "more_body": False}]
+        sent = []
+
+        async def receive():
+            return messages.pop() if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.asgi(scope, receive, send))
+        body = b"".join(message.get("body", b"") for message in sent[1:])
+        return sent[0]["status"], json.loads(body)
+
+    # Test if the async routes send the same documents as the flask app
+    def test_async_routes_match_wsgi_routes(self):
+        for method, path, body in (
+                ("GET", "/categories", None),
+                ("GET", "/questions?page=2", None),
+                ("GET", "/categories/1/questions", None),
+                ("GET", "/categories/9/questions", None),
+                ("POST", "/questions", {"search_term": "number"}),
+                ("POST", "/quizzes/batch", {"quiz_category": {"id": 9}})):
+            res = self.client().open(path, method=method, json=body)
+            self.assertEqual(self.request(method, path, body), (res.status_code, json.loads(res.data)))
+
+    # Test if the other routes are served by the flask app
+    def test_create_question_through_asgi(self):
+        status, data = self.request("POST", "/questions", {
+            "answer": "You", "category": 1, "difficulty": 1, "question": "Who else?"})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(data["question_created"]["question"], "Who else?")
+
+        status, data = self.request("GET", "/questions")
+        self.assertEqual(data["total_questions"], 13)
+
+# Make the tests conveniently executable
+if __name__ == "__main__":
     unittest.main()
\ No newline at end of file